@@ -0,0 +1,9 @@
+"""
+    Benchmarks for the bot's internals that don't need discord or the internet.
+
+    Run them from the bot's folder:
+        python -m benchmarks               lookups and downloads, see `--help` for the options
+        python -m benchmarks.gain          the volume/gain stage
+        python -m benchmarks.entryqueue    the playlist's queue operations
+        python -m benchmarks.queuememory   memory per queued song
+"""
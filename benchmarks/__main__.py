@@ -0,0 +1,68 @@
+import sys
+import asyncio
+import argparse
+
+from . import download
+from .harness import BenchBot, quiet, run
+from .stubserver import StubServer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Measures song lookups and downloads against a local stub site, no internet needed.")
+
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help="what to run (default: all of them): %s" % ', '.join(sorted(download.SCENARIOS)))
+    parser.add_argument('--songs', type=int, default=50, help="songs per scenario (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=50, help="ms the stub site takes per lookup (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=512, help="KB per song (default: %(default)s)")
+    parser.add_argument('--hit-ratio', type=float, default=0.5, help="cached fraction for cache_mix (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=4, help="the ExtractionWorkers option (default: %(default)s)")
+    parser.add_argument('--processes', action='store_true', help="turn the ExtractionProcesses option on")
+    parser.add_argument('--concurrency', type=int, default=3, help="the PlaylistConcurrency option (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true', help="turn the info cache off (MetadataCacheSize = 0)")
+    parser.add_argument('--verbose', action='store_true', help="show what the bot prints while it runs")
+
+    args = parser.parse_args()
+    names = args.scenarios or sorted(download.SCENARIOS)
+
+    for name in names:
+        if name not in download.SCENARIOS:
+            parser.error("unknown scenario %r" % name)
+
+    print("%s songs, %sms lookups, %sKB each, %s %s, playlist concurrency %s, info cache %s" % (
+        args.songs, args.latency, args.size, args.workers, ['threads', 'processes'][args.processes],
+        args.concurrency, ['on', 'off'][args.no_cache]))
+
+    with StubServer(latency=args.latency / 1000, media_size=args.size * 1024) as server:
+        for name in names:
+            requests = server.requests
+            results = run(_run_scenario(download.SCENARIOS[name], server, args))
+
+            for result in results:
+                print(result)
+            print(' ' * 24 + 'requests=%s' % (server.requests - requests))
+
+
+async def _run_scenario(scenario, server, args):
+    bot = BenchBot(
+        asyncio.get_event_loop(),
+        workers=args.workers,
+        use_processes=args.processes,
+        cache_size=0 if args.no_cache else 32,
+        playlist_concurrency=args.concurrency)
+
+    try:
+        with quiet(not args.verbose):
+            results = await scenario(bot, server, args)
+
+        results[0].extra.update(bot.stats())
+        return results
+
+    finally:
+        bot.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
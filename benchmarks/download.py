@@ -0,0 +1,100 @@
+"""
+    Scenarios for the lookup and download path: Downloader, Playlist.add_entry and URLPlaylistEntry._download.
+    Each one gets a fresh BenchBot, so the caches start out empty unless the scenario fills them itself.
+"""
+
+import random
+import asyncio
+
+from musicbot.playlist import Playlist
+
+from .harness import Result, Stopwatch
+
+
+async def _timed(coro, latencies, clock):
+    await coro
+    latencies.append(clock())
+
+
+async def _add_and_download(playlist, song_url):
+    entry, _ = await playlist.add_entry(song_url)
+    await entry.get_ready_future()
+
+
+async def playlist_import(bot, server, args):
+    """
+        Imports a playlist of `--songs` songs, timing how long after the start each one is queued.
+    """
+    playlist = Playlist(bot)
+    latencies = []
+    clock = Stopwatch()
+
+    async for _ in playlist.import_from(server.playlist_url('import', args.songs)):
+        latencies.append(clock())
+
+    return [Result('playlist_import', latencies, clock())]
+
+
+async def play_burst(bot, server, args):
+    """
+        `--songs` people using !play at the same time, timing how long each one waits for the song to be queued.
+    """
+    playlist = Playlist(bot)
+    latencies = []
+    clock = Stopwatch()
+
+    await asyncio.gather(*[
+        _timed(playlist.add_entry(server.song_url('burst-%s' % i)), latencies, clock) for i in range(args.songs)])
+
+    return [Result('play_burst', latencies, clock())]
+
+
+async def download(bot, server, args):
+    """
+        Looks up `--songs` songs (not timed), then downloads them all at once, timing when each one is ready.
+    """
+    playlist = Playlist(bot)
+    entries = []
+
+    for i in range(args.songs):
+        entry = await playlist._resolve_entry(server.song_url('download-%s' % i))
+        entries.append(entry)
+
+    latencies = []
+    clock = Stopwatch()
+
+    await asyncio.gather(*[_timed(entry.get_ready_future(), latencies, clock) for entry in entries])
+
+    return [Result('download', latencies, clock(), {'mb': round(args.size * len(entries) / 1024, 1)})]
+
+
+async def cache_mix(bot, server, args):
+    """
+        !play then download `--songs` songs, `--hit-ratio` of which were already played before so their info and
+        audio are cached.  The hits and misses are reported separately.
+    """
+    song_ids = ['mix-%s' % i for i in range(args.songs)]
+    random.Random(args.songs).shuffle(song_ids)
+    hits = set(song_ids[:int(len(song_ids) * args.hit_ratio)])
+
+    warmup = Playlist(bot)
+    for song_id in hits:
+        await _add_and_download(warmup, server.song_url(song_id))
+
+    playlist = Playlist(bot)
+    latencies = {True: [], False: []}
+    clock = Stopwatch()
+
+    await asyncio.gather(*[
+        _timed(_add_and_download(playlist, server.song_url(song_id)), latencies[song_id in hits], clock)
+        for song_id in song_ids])
+
+    elapsed = clock()
+    return [
+        Result('cache_mix', latencies[True] + latencies[False], elapsed),
+        Result('  hits', latencies[True], elapsed),
+        Result('  misses', latencies[False], elapsed),
+    ]
+
+
+SCENARIOS = {func.__name__: func for func in (playlist_import, play_burst, download, cache_mix)}
@@ -0,0 +1,95 @@
+"""
+    How long the queue operations that !play, !search and the player use take on a long queue, for the EntryQueue
+    the playlist uses and for the plain deque it used to be.  Run it with `python -m benchmarks.entryqueue`.
+"""
+
+import sys
+import time
+import random
+import argparse
+
+from collections import deque
+from itertools import islice
+
+from musicbot.entryqueue import EntryQueue
+
+
+class FakeEntry:
+    def __init__(self, author, duration):
+        self.meta = {'author': author}
+        self.duration = duration
+
+
+def _entries(count, authors=50):
+    rand = random.Random(0)
+    return [FakeEntry('user%s' % rand.randrange(authors), rand.randint(60, 600)) for _ in range(count)]
+
+
+class DequeQueue:
+    """
+        What the playlist did before, for comparison.
+    """
+
+    def __init__(self, entries):
+        self.entries = deque(entries)
+
+    def count_for(self, author):
+        return sum(1 for e in self.entries if e.meta.get('author', None) == author)
+
+    def duration_before(self, position):
+        return sum([e.duration for e in islice(self.entries, position)])
+
+    def remove(self, entry):
+        self.entries.remove(entry)
+
+    def append(self, entry):
+        self.entries.append(entry)
+
+
+def measure(operation, seconds):
+    """
+        Returns how long `operation` takes on average, in microseconds.
+    """
+    done = 0
+    started = time.perf_counter()
+
+    while time.perf_counter() - started < seconds:
+        operation()
+        done += 1
+
+    return (time.perf_counter() - started) / done * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.entryqueue', description=__doc__.strip())
+    parser.add_argument('--songs', type=int, nargs='+', default=[100, 1000, 10000],
+                        help="queue lengths to try (default: %(default)s)")
+    parser.add_argument('--seconds', type=float, default=0.5, help="time per case (default: %(default)s)")
+    args = parser.parse_args()
+
+    print("%-8s %-16s %12s %12s" % ('songs', 'operation', 'deque us', 'indexed us'))
+
+    for songs in args.songs:
+        entries = _entries(songs)
+        rand = random.Random(1)
+
+        for name, make in (('count_for', lambda q: lambda: q.count_for('user7')),
+                           ('duration_before', lambda q: lambda: q.duration_before(songs - 1)),
+                           ('remove+append', lambda q: _remove_append(q, entries, rand))):
+            old = measure(make(DequeQueue(entries)), args.seconds)
+            new = measure(make(EntryQueue(entries)), args.seconds)
+            print("%-8s %-16s %12.2f %12.2f" % (songs, name, old, new))
+
+
+def _remove_append(queue, entries, rand):
+    def operation():
+        # Somewhere in the middle, like the songs a max length filter drops
+        entry = entries[rand.randrange(len(entries))]
+        queue.remove(entry)
+        queue.append(entry)
+
+    return operation
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+    How many 20ms frames a second one core can push through the gain stage, and so how many players it can keep up
+    with (each one needs 50 frames a second).  Run it with `python -m benchmarks.gain`.
+"""
+
+import sys
+import time
+import random
+import argparse
+
+from musicbot import gain
+from musicbot.gain import GainStage
+
+FRAME_SIZE = 3840  # 20ms of 48kHz stereo s16le
+FRAMES_PER_SECOND = 50
+
+
+def _frames(count=50):
+    rand = random.Random(0)
+    return [bytes(rand.getrandbits(8) for _ in range(FRAME_SIZE)) for _ in range(count)]
+
+
+def measure(stage, frames, seconds, *, ramping=False):
+    """
+        Returns frames processed per second of cpu time.
+    """
+    done = 0
+    volumes = (0.2, 0.6)
+    started = time.process_time()
+
+    while time.process_time() - started < seconds:
+        for frame in frames:
+            if ramping and not done % stage.ramp_frames:
+                stage.volume = volumes[done // stage.ramp_frames % 2]
+
+            stage.process(frame)
+            done += 1
+
+    return done / (time.process_time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.gain', description=__doc__.strip())
+    parser.add_argument('--seconds', type=float, default=1.0, help="cpu time per case (default: %(default)s)")
+    args = parser.parse_args()
+
+    frames = _frames()
+    backend = 'numpy' if gain.numpy is not None else 'audioop' if gain.audioop is not None else 'python'
+
+    cases = [
+        ('constant volume', GainStage(0.3), False),
+        ('ramping volume', GainStage(0.3), True),
+        ('limiter, 200%', GainStage(2.0, limiter=True), False),
+    ]
+
+    print("gain stage backend: %s" % backend)
+
+    for name, stage, ramping in cases:
+        if stage.limiter and gain.numpy is None:
+            continue
+
+        stage.frames = 1  # So the ramping case actually ramps
+        rate = measure(stage, frames, args.seconds, ramping=ramping)
+        print("%-18s %10.0f frames/s per core  (~%s players)" % (name, rate, int(rate // FRAMES_PER_SECOND)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import os
+import io
+import time
+import types
+import shutil
+import asyncio
+import tempfile
+import contextlib
+
+from musicbot.config import ConfigDefaults
+from musicbot.downloader import Downloader
+
+from .stubextractor import StubIE
+
+
+def percentile(values, percent):
+    """
+        Nearest rank percentile, `percent` from 0 to 100.
+    """
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    rank = max(1, int(round(percent / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+class Result:
+    def __init__(self, name, latencies, elapsed, extra=None):
+        self.name = name
+        self.latencies = latencies
+        self.elapsed = elapsed
+        self.extra = extra or {}
+
+    @property
+    def rate(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        line = "%-22s n=%-5s p50=%8.3fs  p99=%8.3fs  songs/s=%7.1f  (%.2fs total)" % (
+            self.name, len(self.latencies), percentile(self.latencies, 50), percentile(self.latencies, 99),
+            self.rate, self.elapsed)
+
+        if self.extra:
+            line += '\n' + ' ' * 24 + '  '.join('%s=%s' % item for item in sorted(self.extra.items()))
+
+        return line
+
+
+class BenchBot:
+    """
+        Just enough of MusicBot for a Playlist to work with: a loop, the config and a Downloader that
+        only knows the stub site.  Everything it downloads or caches goes in a temporary folder.
+    """
+
+    def __init__(self, loop, *, workers=4, use_processes=False, cache_size=32, **config):
+        self.loop = loop
+        self.aiosession = None
+        self.predownload_budget = None
+        self.folder = tempfile.mkdtemp(prefix='musicbot-bench-')
+
+        defaults = {k: v for k, v in vars(ConfigDefaults).items() if not k.startswith('_')}
+        defaults.update(extraction_workers=workers, extraction_processes=use_processes, metadata_cache_size=cache_size)
+        defaults.update(config)
+        self.config = types.SimpleNamespace(**defaults)
+
+        self.downloader = Downloader(
+            download_folder=os.path.join(self.folder, 'audio_cache'),
+            cache_folder=os.path.join(self.folder, 'info_cache') if cache_size else None,
+            cache_size=cache_size * 1024 * 1024,
+            workers=workers,
+            use_processes=use_processes,
+            extractors=[StubIE])
+
+    def stats(self):
+        stats = {'coalesced': self.downloader.coalesced}
+        stats.update(('done_' + name, depths['completed']) for name, depths in self.downloader.queue_depths.items())
+
+        if self.downloader.info_cache:
+            stats.update(info_hits=self.downloader.info_cache.hits, info_misses=self.downloader.info_cache.misses)
+
+        return stats
+
+    def close(self):
+        self.downloader.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class Stopwatch:
+    def __init__(self):
+        self.started = time.perf_counter()
+
+    def __call__(self):
+        return time.perf_counter() - self.started
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """
+        Swallows everything the bot prints while it's running, so it doesn't drown out the results.
+    """
+    if not enabled:
+        yield
+        return
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        # Predownloads the scenario didn't wait for
+        pending = asyncio.all_tasks(loop) if hasattr(asyncio, 'all_tasks') else asyncio.Task.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+        asyncio.set_event_loop(None)
@@ -0,0 +1,69 @@
+"""
+    How much memory a playlist import leaves behind for each song: the queue, the songs in it and the info cache,
+    everything the import allocated that's still around once it's done.  Each size is imported from the stub site
+    twice, once with every song looked up and kept as a URLPlaylistEntry (a predownload window as big as the
+    playlist, which is how every import used to go) and once as it goes now, where only the songs in the window
+    are looked up and the rest wait as rows in the playlist's SongRecords, straight from the playlist's song list.
+    Run it with `python -m benchmarks.queuememory`.
+"""
+
+import gc
+import sys
+import asyncio
+import argparse
+import tracemalloc
+
+from musicbot.config import ConfigDefaults
+from musicbot.playlist import Playlist
+
+from .harness import BenchBot, quiet, run
+from .stubserver import StubServer
+
+
+async def measure(server, songs, window):
+    """
+        Returns the bytes per song that importing a playlist of `songs` songs with a predownload window of
+        `window` leaves allocated, and how many lookups it took.
+    """
+    bot = BenchBot(asyncio.get_event_loop(), predownload_window=window)
+    requests = server.requests
+
+    try:
+        with quiet():
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+
+            playlist = Playlist(bot)
+            entries = await playlist.import_from(server.playlist_url('memory-%s' % window, songs)).wait()
+
+            gc.collect()
+            used = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+
+        assert len(entries) == len(playlist.entries) == songs
+        return used / songs, server.requests - requests
+
+    finally:
+        bot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.queuememory', description=__doc__.strip())
+    parser.add_argument('--songs', type=int, nargs='+', default=[500, 2000],
+                        help="songs in the playlist (default: %(default)s)")
+    args = parser.parse_args()
+
+    print("%-8s %16s %16s %8s %18s" % ('songs', 'looked up bytes', 'lazy bytes', 'ratio', 'lookups'))
+
+    with StubServer(latency=0, media_size=16 * 1024) as server:
+        for songs in args.songs:
+            old, old_lookups = run(measure(server, songs, songs + 1))
+            new, new_lookups = run(measure(server, songs, ConfigDefaults.predownload_window))
+
+            print("%-8s %16.0f %16.0f %7.1fx %18s" % (
+                songs, old, new, old / new, '%s -> %s' % (old_lookups, new_lookups)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+import re
+
+from youtube_dl.extractor.common import InfoExtractor
+
+
+class StubIE(InfoExtractor):
+    """
+        Extracts songs and playlists from a `StubServer`, the same way a real extractor would from a real site.
+    """
+
+    IE_NAME = 'stub'
+    _VALID_URL = r'https?://127\.0\.0\.1:\d+/(?P<kind>song|playlist)/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        kind, item_id = re.match(self._VALID_URL, url).groups()
+        base_url = url.split('/%s/' % kind, 1)[0]
+        data = self._download_json(url, item_id)
+
+        if kind == 'playlist':
+            entries = [self.url_result('%s/song/%s' % (base_url, song_id), ie=self.ie_key(), video_id=song_id)
+                       for song_id in data['entries']]
+            return self.playlist_result(entries, item_id, data['title'])
+
+        return {
+            'id': item_id,
+            'title': data['title'],
+            'duration': data['duration'],
+            'url': '%s/media/%s.m4a' % (base_url, item_id),
+            'ext': 'm4a',
+            'vcodec': 'none',
+            'acodec': 'mp4a.40.2',
+        }
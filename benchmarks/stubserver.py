@@ -0,0 +1,109 @@
+import json
+import time
+import threading
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+        /song/<id>                   json info for a song
+        /playlist/<id>?count=<n>     json info for a playlist of n songs, with ids <id>-0 to <id>-<n-1>
+        /media/<id>.m4a              the song's "audio", `media_size` bytes of filler
+    """
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        kind, _, item = parts.path.strip('/').partition('/')
+
+        if kind == 'song':
+            time.sleep(self.server.latency)
+            self._send_json({'id': item, 'title': 'Song %s' % item, 'duration': 180})
+
+        elif kind == 'playlist':
+            time.sleep(self.server.latency)
+            count = int(parse_qs(parts.query).get('count', ['10'])[0])
+            self._send_json({'id': item, 'title': 'Playlist %s' % item,
+                             'entries': ['%s-%s' % (item, i) for i in range(count)]})
+
+        elif kind == 'media':
+            self._send_media()
+
+        else:
+            self.send_error(404)
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_media(self):
+        remaining = self.server.media_size
+        chunk = b'\0' * 65536
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Content-Length', str(remaining))
+        self.end_headers()
+
+        while remaining > 0:
+            self.wfile.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        self.server.requests += 1
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Bursts open a lot of connections at once
+
+
+class StubServer:
+    """
+        A local http server that pretends to be a video site for `StubIE`.  `latency` (in seconds) is added to
+        every info request, the media files are `media_size` bytes and come as fast as the machine can send them.
+    """
+
+    def __init__(self, latency=0.05, media_size=512 * 1024):
+        self.httpd = _Server(('127.0.0.1', 0), _Handler)
+        self.httpd.latency = latency
+        self.httpd.media_size = media_size
+        self.httpd.requests = 0
+
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%s' % self.httpd.server_address[1]
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def song_url(self, song_id):
+        return '%s/song/%s' % (self.base_url, song_id)
+
+    def playlist_url(self, playlist_id, count):
+        return '%s/playlist/%s?count=%s' % (self.base_url, playlist_id, count)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,449 @@
+import os
+import math
+import json
+import time
+import asyncio
+import hashlib
+import traceback
+
+INDEX_FOLDER = '.index'
+INDEX_VERSION = 2
+
+# Each play (on a log scale) counts as this many seconds of recency when picking what to evict,
+# so a song played 15 times a week ago outlives one played once yesterday
+PLAY_WEIGHT = 60 * 60 * 24
+
+# Leftovers from interrupted downloads older than this are deleted
+PARTIAL_MAX_AGE = 60 * 60
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.tmp')
+
+
+def cache_key(filename):
+    """
+        Returns the key a song is stored under from its (expected or actual) filename.
+
+        Youtube ids are always 11 characters and can have dashes in them, so they're cut by length.  Other ids can
+        have dashes too and don't have a fixed length, so those are keyed by the whole name, like the old folder
+        lookup did.  Generic files also lose the hash `_really_download` puts on the end.
+    """
+    stem = os.path.basename(filename).rsplit('.', 1)[0]
+    extractor, _, rest = stem.partition('-')
+
+    if extractor == 'youtube':
+        return '%s-%s' % (extractor, rest[:11])
+
+    if extractor == 'generic':
+        base, _, tail = stem.rpartition('-')
+        if len(tail) == 8 and all(c in '0123456789abcdef' for c in tail):
+            return base
+
+    return stem
+
+
+class AudioCache:
+    """
+        An index of the audio cache folder, so looking up a song is a dict lookup instead of a directory listing.
+
+        Each key (see `cache_key`) maps to the files stored for it by extension, plus whatever else gets recorded
+        about them.  The index is saved in shards under `.index/` in the cache folder, so a change only rewrites one
+        small file and startup doesn't have to list the folder.  If the index is missing it's rebuilt from one scan.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_folder = os.path.join(folder, INDEX_FOLDER)
+
+        self._records = {}  # key -> {ext: record}
+        self._dirty = set()  # shard names that need saving
+        self._save_handle = None
+
+        self.load()
+
+    @staticmethod
+    def _shard(key):
+        return hashlib.md5(key.encode('utf-8')).hexdigest()[:2]
+
+    def load(self):
+        """
+            Reads the saved index, or rebuilds it from the folder if there isn't one.
+        """
+        self._records.clear()
+        self._dirty.clear()
+
+        if not os.path.isdir(self.folder):
+            return
+
+        try:
+            with open(os.path.join(self.index_folder, 'version')) as f:
+                version = int(f.read().strip())
+        except (OSError, ValueError):
+            version = None
+
+        if version != INDEX_VERSION:
+            self.rebuild()
+            return
+
+        for shard in os.listdir(self.index_folder):
+            if not shard.endswith('.json'):
+                continue
+
+            try:
+                with open(os.path.join(self.index_folder, shard), encoding='utf8') as f:
+                    self._records.update(json.load(f))
+            except Exception:
+                print("[AudioCache] Index shard %s is broken, rebuilding the index" % shard)
+                self.rebuild()
+                return
+
+    def rebuild(self):
+        """
+            Scans the cache folder once and indexes everything in it.
+        """
+        self._records.clear()
+
+        if os.path.isdir(self.folder):
+            for item in os.scandir(self.folder):
+                if item.is_file() and not item.name.endswith(('.part', '.ytdl')):
+                    self._add(item.name, item.stat().st_size)
+
+        self._dirty.update(self._shard(key) for key in self._records)
+        self.save(rewrite=True)
+
+    def clear(self):
+        """
+            Forgets everything, for when the folder has been wiped.
+        """
+        self._records.clear()
+        self._dirty.clear()
+
+    def _add(self, name, size):
+        key = cache_key(name)
+        ext = name.rsplit('.', 1)[-1] if '.' in name else ''
+
+        record = self._records.setdefault(key, {}).setdefault(ext, {})
+        record.update(name=name, size=size, added=record.get('added', time.time()))
+
+        self._dirty.add(self._shard(key))
+        return record
+
+    def add(self, filename):
+        """
+            Records a newly downloaded file.  Returns its record.
+        """
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            size = 0
+
+        return self._add(os.path.basename(filename), size)
+
+    def discard(self, filename):
+        """
+            Forgets a file, if it was there.
+        """
+        name = os.path.basename(filename)
+        key = cache_key(name)
+        variants = self._records.get(key)
+
+        if not variants:
+            return
+
+        for ext, record in list(variants.items()):
+            if record['name'] == name:
+                del variants[ext]
+
+        if not variants:
+            del self._records[key]
+
+        self._dirty.add(self._shard(key))
+
+    def lookup(self, expected_filename):
+        """
+            Returns the path of the cached file for `expected_filename`, preferring the same extension, or None.
+            This only stats the one file it finds, to make sure it hasn't been deleted behind our back.
+        """
+        key = cache_key(expected_filename)
+        variants = self._records.get(key)
+
+        if not variants:
+            return None
+
+        ext = expected_filename.rsplit('.', 1)[-1]
+        record = variants.get(ext) or next(iter(variants.values()))
+        path = os.path.join(self.folder, record['name'])
+
+        if os.path.isfile(path):
+            return path
+
+        self.discard(path)
+        return self.lookup(expected_filename)
+
+    def record_for(self, filename):
+        """
+            Returns the record for a file in the cache, or None.  Records are dicts that other parts of the bot
+            can keep their own data about the file in.  Call `touch` after changing one.
+        """
+        name = os.path.basename(filename)
+        for record in self._records.get(cache_key(name), {}).values():
+            if record['name'] == name:
+                return record
+
+        return None
+
+    def touch(self, filename):
+        self._dirty.add(self._shard(cache_key(filename)))
+
+    def played(self, filename):
+        """
+            Counts a play of a cached file, for the eviction order.
+        """
+        record = self.record_for(filename)
+
+        if record:
+            record['plays'] = record.get('plays', 0) + 1
+            record['last_played'] = time.time()
+            self.touch(filename)
+
+    @staticmethod
+    def sidecars(record):
+        """
+            Returns the extra files kept for a song (like its opus packets), which are dicts in its record with a name.
+        """
+        return [value for value in record.values() if isinstance(value, dict) and 'name' in value]
+
+    def paths_for(self, record):
+        """
+            Returns the paths of the song's file and all its sidecar files.
+        """
+        return [os.path.join(self.folder, item['name']) for item in [record] + self.sidecars(record)]
+
+    @staticmethod
+    def size_of(record):
+        return record.get('size', 0) + sum(item.get('size', 0) for item in AudioCache.sidecars(record))
+
+    @property
+    def total_size(self):
+        return sum(self.size_of(record) for record in self)
+
+    def __len__(self):
+        return sum(len(v) for v in self._records.values())
+
+    def __iter__(self):
+        for variants in list(self._records.values()):
+            yield from list(variants.values())
+
+    def schedule_save(self, loop, delay=5):
+        """
+            Saves the changed shards in the background a little later, so a burst of changes is written once.
+        """
+        if not self._dirty or self._save_handle:
+            return
+
+        def _save():
+            self._save_handle = None
+            loop.run_in_executor(None, self.save, False, self._snapshot())
+
+        self._save_handle = loop.call_later(delay, _save)
+
+    def _snapshot(self):
+        shards = {}
+
+        for shard in self._dirty:
+            shards[shard] = {}
+
+        for key, variants in self._records.items():
+            shard = self._shard(key)
+            if shard in shards:
+                shards[shard][key] = {ext: dict(record) for ext, record in variants.items()}
+
+        self._dirty.clear()
+        return shards
+
+    def save(self, rewrite=False, shards=None):
+        """
+            Writes the changed shards to disk.  This does file io, so run it in an executor if the loop is running.
+        """
+        if shards is None:
+            shards = self._snapshot()
+
+        try:
+            os.makedirs(self.index_folder, exist_ok=True)
+
+            if rewrite:
+                for old in os.listdir(self.index_folder):
+                    if old[:-5] not in shards:
+                        os.unlink(os.path.join(self.index_folder, old))
+
+            for shard, records in shards.items():
+                path = os.path.join(self.index_folder, shard + '.json')
+
+                if not records:
+                    if os.path.exists(path):
+                        os.unlink(path)
+                    continue
+
+                with open(path + '.tmp', 'w', encoding='utf8') as f:
+                    json.dump(records, f)
+
+                os.replace(path + '.tmp', path)
+
+            with open(os.path.join(self.index_folder, 'version'), 'w') as f:
+                f.write(str(INDEX_VERSION))
+
+        except OSError:
+            traceback.print_exc()
+
+
+class AudioCacheManager:
+    """
+        Keeps the audio cache under a size budget.  Every so often it evicts the least valuable files (least
+        recently and least often played, see `PLAY_WEIGHT`) and cleans up leftovers from broken downloads.
+        Anything `get_pinned` returns (cache keys of queued or playing songs) is never evicted.
+    """
+
+    def __init__(self, cache, budget, loop, get_pinned=None, *, interval=60):
+        self.cache = cache
+        self.budget = budget
+        self.loop = loop
+        self.get_pinned = get_pinned or set
+        self.interval = interval
+
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self._task = None
+
+    def start(self):
+        if not self._task:
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    @staticmethod
+    def score(record):
+        last_used = max(record.get('last_played', 0), record.get('added', 0))
+        return last_used + PLAY_WEIGHT * math.log2(1 + record.get('plays', 0))
+
+    def pick_victims(self, pinned=()):
+        """
+            Returns the records to delete to get down to 90% of the budget, so it's not evicting on every download.
+        """
+        total = self.cache.total_size
+        if total <= self.budget:
+            return []
+
+        target = self.budget * 0.9
+        victims = []
+
+        for record in sorted(self.cache, key=self.score):
+            if total <= target:
+                break
+
+            if cache_key(record['name']) in pinned:
+                continue
+
+            victims.append(record)
+            total -= self.cache.size_of(record)
+
+        return victims
+
+    async def _run(self):
+        # Startup is busy enough already
+        await asyncio.sleep(self.interval)
+
+        last_cleanup = 0
+
+        while True:
+            try:
+                await self.evict()
+
+                if time.time() - last_cleanup > PARTIAL_MAX_AGE / 2:
+                    last_cleanup = time.time()
+                    await self.loop.run_in_executor(None, self.remove_partials)
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception:
+                traceback.print_exc()
+
+            await asyncio.sleep(self.interval)
+
+    async def evict(self):
+        victims = self.pick_victims(self.get_pinned())
+        if not victims:
+            return
+
+        paths = [self.cache.paths_for(record) for record in victims]
+        removed = await self.loop.run_in_executor(None, self._unlink_all, paths, self._still_unpinned)
+
+        for path, size in removed:
+            self.cache.discard(path)
+            self.evicted += 1
+            self.evicted_bytes += size
+
+        self.cache.schedule_save(self.loop)
+        print("[AudioCache] Evicted %s files (%.1f MB), cache is now %.1f/%.1f MB" % (
+            len(removed), sum(size for _, size in removed) / 1048576,
+            self.cache.total_size / 1048576, self.budget / 1048576))
+
+    def _still_unpinned(self, path):
+        """
+            Whether the song at `path` can still go.  It's asked from the executor right before deleting it, since the
+            song could have been queued after it was picked, and the queues belong to the loop.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._is_pinned(path), self.loop)
+        return not future.result()
+
+    async def _is_pinned(self, path):
+        return cache_key(os.path.basename(path)) in self.get_pinned()
+
+    @staticmethod
+    def _unlink_all(paths, evictable=None):
+        """
+            Deletes each song's files, the song's own file last, skipping the songs `evictable(path)` says to keep.
+            Returns the songs that are gone, and their size.
+        """
+        removed = []
+
+        for song_paths in paths:
+            size = 0
+
+            if evictable and not evictable(song_paths[0]):
+                continue
+
+            try:
+                for path in reversed(song_paths):
+                    try:
+                        size += os.path.getsize(path)
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+
+                removed.append((song_paths[0], size))
+
+            except OSError:
+                # Probably playing right now on windows, it'll get picked again next time
+                pass
+
+        return removed
+
+    def remove_partials(self):
+        """
+            Deletes old half downloaded files.  This does file io, so run it in an executor.
+        """
+        if not os.path.isdir(self.cache.folder):
+            return
+
+        cutoff = time.time() - PARTIAL_MAX_AGE
+
+        for item in os.scandir(self.cache.folder):
+            if item.is_file() and item.name.endswith(PARTIAL_SUFFIXES):
+                try:
+                    if item.stat().st_mtime < cutoff:
+                        os.unlink(item.path)
+                        print("[AudioCache] Removed leftover partial download", item.name)
+                except OSError:
+                    pass
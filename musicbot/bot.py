@@ -29,6 +29,10 @@ from collections import defaultdict
 
 from musicbot.playlist import Playlist
 from musicbot.player import MusicPlayer
+from musicbot.audiocache import AudioCacheManager, cache_key
+from musicbot.voicesupervisor import VoiceSupervisor
+from musicbot.decodehub import DecodeHub
+from musicbot.queuejournal import QueueJournal
 from musicbot.config import Config, ConfigDefaults
 from musicbot.permissions import Permissions, PermissionsDefaults
 from musicbot.utils import load_file, write_file, sane_round_int
@@ -40,7 +44,7 @@ from . import exceptions
 from . import downloader
 from .opus_loader import load_opus_lib
 from .constants import VERSION as BOTVERSION
-from .constants import DISCORD_MSG_CHAR_LIMIT, AUDIO_CACHE_PATH
+from .constants import DISCORD_MSG_CHAR_LIMIT, AUDIO_CACHE_PATH, INFO_CACHE_PATH, QUEUE_PATH
 
 
 load_opus_lib()
@@ -107,7 +111,16 @@ class MusicBot(discord.Client):
 
         self.blacklist = set(load_file(self.config.blacklist_file))
         self.autoplaylist = load_file(self.config.auto_playlist_file)
-        self.downloader = downloader.Downloader(download_folder='audio_cache')
+        self.downloader = downloader.Downloader(
+            download_folder='audio_cache',
+            cache_folder=INFO_CACHE_PATH,
+            cache_size=self.config.metadata_cache_size * 1024 * 1024,
+            workers=self.config.extraction_workers,
+            use_processes=self.config.extraction_processes)
+        self.audio_cache_manager = None
+        self.voice_supervisor = None
+        self.decode_hub = DecodeHub()
+        self.queue_journals = {}  # server id -> QueueJournal
         self.days = [WeeklyDay(REL.MO, 17, 0),
                     WeeklyDay(REL.WE, 17, 0),
                     WeeklyDay(REL.FR, 17, 0)]
@@ -126,6 +139,11 @@ class MusicBot(discord.Client):
 
         super().__init__()
         self.aiosession = aiohttp.ClientSession(loop=self.loop)
+        self.voice_supervisor = VoiceSupervisor(self)
+        self.predownload_budget = None
+
+        if self.config.predownload_concurrency:
+            self.predownload_budget = asyncio.Semaphore(self.config.predownload_concurrency, loop=self.loop)
         self.http.user_agent += ' MusicBot/%s' % BOTVERSION
 
         self.lastfm = Lastfm(self.config)
@@ -160,6 +178,24 @@ class MusicBot(discord.Client):
         else:
             return discord.utils.find(lambda m: m.id == self.config.owner_id, self.get_all_members())
 
+    def _pinned_audio_files(self):
+        """
+            Returns the cache keys of every song that's playing or queued, so the cache manager leaves them alone.
+        """
+        pinned = set()
+
+        for player in self.players.values():
+            entries = list(player.playlist.entries)
+            if player.current_entry:
+                entries.append(player.current_entry)
+
+            for entry in entries:
+                filename = entry.filename or getattr(entry, 'expected_filename', None)
+                if filename:
+                    pinned.add(cache_key(filename))
+
+        return pinned
+
     def _delete_old_audiocache(self, path=AUDIO_CACHE_PATH):
         try:
             shutil.rmtree(path)
@@ -292,6 +328,7 @@ class MusicBot(discord.Client):
                     print("Attempting connection...")
                     await asyncio.wait_for(voice_client.connect(), timeout=10, loop=self.loop)
                     print("Connection established.")
+                    self.voice_supervisor.watch(voice_client)
                     break
                 except:
                     traceback.print_exc()
@@ -321,11 +358,16 @@ class MusicBot(discord.Client):
     async def move_voice_client(self, channel):
         await self._update_voice_state(channel)
 
-    async def reconnect_voice_client(self, server):
-        if server.id not in self.the_voice_clients:
+    async def reconnect_voice_client(self, server, channel=None):
+        """
+            Drops the server's voice connection and makes a new one, if a player is using it.  `channel` is where to
+            connect to if the old connection is already gone (a reconnect that failed part way).
+        """
+        if server.id not in self.the_voice_clients and not channel:
             return
 
-        vc = self.the_voice_clients.pop(server.id)
+        vc = self.the_voice_clients.pop(server.id, None)
+        channel = vc.channel if vc else channel
         _paused = False
 
         player = None
@@ -336,7 +378,8 @@ class MusicBot(discord.Client):
                 _paused = True
 
         try:
-            await vc.disconnect()
+            if vc:
+                await vc.disconnect()
         except:
             print("Error disconnecting during reconnect")
             traceback.print_exc()
@@ -344,7 +387,7 @@ class MusicBot(discord.Client):
         await asyncio.sleep(0.1)
 
         if player:
-            new_vc = await self.get_voice_client(vc.channel)
+            new_vc = await self.get_voice_client(channel)
             player.reload_voice(new_vc)
 
             if player.is_paused and _paused:
@@ -355,8 +398,15 @@ class MusicBot(discord.Client):
             return
 
         if server.id in self.players:
-            self.players.pop(server.id).kill()
+            player = self.players.pop(server.id)
+
+            # Leaving on purpose, so the song that was playing is done with too
+            if player.playlist.journal:
+                player.playlist.journal.finished(player.current_entry)
 
+            player.kill()
+
+        self.voice_supervisor.forget(server)
         await self.the_voice_clients.pop(server.id).disconnect()
 
     async def disconnect_all_voice_clients(self):
@@ -408,10 +458,35 @@ class MusicBot(discord.Client):
                 .on('entry-added', self.on_player_entry_added)
 
             player.skip_state = SkipState()
+            playlist.predownloader.attach(player)
             self.players[server.id] = player
 
+            if self.config.persistent_queue:
+                self._restore_queue(server, player)
+
         return self.players[server.id]
 
+    def _restore_queue(self, server, player):
+        journal = self.queue_journals.get(server.id)
+
+        if not journal:
+            journal = self.queue_journals[server.id] = QueueJournal(os.path.join(QUEUE_PATH, server.id), self.loop)
+
+        started = time.time()
+        restored = player.playlist.restore(journal.attach(player))
+
+        if restored:
+            print("[Queue] Restored %s songs in %s in %.0fms" % (restored, server.name, (time.time() - started) * 1000))
+
+    def _save_queues(self):
+        """
+            Saves every queue where it's at, for the restart.  The players' queues aren't saved after this.
+        """
+        for server_id, journal in self.queue_journals.items():
+            journal.close(self.players.get(server_id))
+
+        self.queue_journals.clear()
+
     async def on_player_play(self, player, entry):
         await self.update_now_playing(entry)
         player.skip_state.reset()
@@ -455,7 +530,8 @@ class MusicBot(discord.Client):
         if not player.playlist.entries and not player.current_entry and self.config.auto_playlist:
             while self.autoplaylist:
                 song_url = choice(self.autoplaylist)
-                info = await self.downloader.safe_extract_info(player.playlist.loop, song_url, download=False, process=False)
+                info = await self.downloader.safe_extract_info(
+                    player.playlist.loop, song_url, download=False, process=False, priority=downloader.PRIORITY_BACKGROUND)
 
                 if not info:
                     self.autoplaylist.remove(song_url)
@@ -469,7 +545,8 @@ class MusicBot(discord.Client):
 
                 # TODO: better checks here
                 try:
-                    await player.playlist.add_entry(song_url, channel=None, author=None)
+                    await player.playlist.add_entry(
+                        song_url, priority=downloader.PRIORITY_BACKGROUND, channel=None, author=None)
                 except exceptions.ExtractionError as e:
                     print("Error adding song from autoplaylist:", e)
                     continue
@@ -568,11 +645,21 @@ class MusicBot(discord.Client):
             return await super().edit_profile(self.config._password,**fields)
 
     def _cleanup(self):
+        self._save_queues()
+
         try:
             self.loop.run_until_complete(self.logout())
         except: # Can be ignored
             pass
 
+        if self.audio_cache_manager:
+            self.audio_cache_manager.stop()
+
+        self.voice_supervisor.stop()
+        self.decode_hub.close()
+
+        self.downloader.shutdown()
+
         pending = asyncio.Task.all_tasks()
         gathered = asyncio.gather(*pending)
 
@@ -726,14 +813,27 @@ class MusicBot(discord.Client):
         if self.config.delete_messages:
             print("    Delete Invoking: " + ['Disabled', 'Enabled'][self.config.delete_invoking])
         print("  Debug Mode: " + ['Disabled', 'Enabled'][self.config.debug_mode])
-        print("  Downloaded songs will be %s" % ['deleted', 'saved'][self.config.save_videos])
+        if self.config.audio_cache_size:
+            print("  Downloaded songs will be kept up to %s MB" % self.config.audio_cache_size)
+        else:
+            print("  Downloaded songs will be %s" % ['deleted', 'saved'][self.config.save_videos])
+        print("  Extraction workers: %s %s" % (
+            self.config.extraction_workers, ['threads', 'processes'][self.config.extraction_processes]))
         print()
 
         # maybe option to leave the ownerid blank and generate a random command for the owner to use
         # wait_for_message is pretty neato
 
-        if not self.config.save_videos and os.path.isdir(AUDIO_CACHE_PATH):
+        if self.config.audio_cache_size:
+            if not self.audio_cache_manager:
+                self.audio_cache_manager = AudioCacheManager(
+                    self.downloader.audio_cache, self.config.audio_cache_size * 1024 * 1024, self.loop,
+                    self._pinned_audio_files)
+                self.audio_cache_manager.start()
+
+        elif not self.config.save_videos and os.path.isdir(AUDIO_CACHE_PATH):
             if self._delete_old_audiocache():
+                self.downloader.audio_cache.clear()
                 print("Deleting old audio cache")
             else:
                 print("Could not delete old audio cache, moving on.")
@@ -1852,74 +1952,13 @@ class MusicBot(discord.Client):
                     expire_in=30
                 )
 
-            if info['extractor'].lower() in ['youtube:playlist', 'soundcloud:set', 'bandcamp:album']:
-                try:
-                    return await self._cmd_play_playlist_async(player, channel, author, permissions, song_url, info['extractor'])
-                except exceptions.CommandError:
-                    raise
-                except Exception as e:
-                    traceback.print_exc()
-                    raise exceptions.CommandError("Error queuing playlist:\n%s" % e, expire_in=30)
-
-            t0 = time.time()
-
-            # My test was 1.2 seconds per song, but we maybe should fudge it a bit, unless we can
-            # monitor it and edit the message with the estimated time, but that's some ADVANCED SHIT
-            # I don't think we can hook into it anyways, so this will have to do.
-            # It would probably be a thread to check a few playlists and get the speed from that
-            # Different playlists might download at different speeds though
-            wait_per_song = 1.2
-
-            procmesg = await self.safe_send_message(
-                channel,
-                'Gathering playlist information for {} songs{}'.format(
-                    num_songs,
-                    ', ETA: {} seconds'.format(self._fixg(
-                        num_songs * wait_per_song)) if num_songs >= 10 else '.'))
-
-            # We don't have a pretty way of doing this yet.  We need either a loop
-            # that sends these every 10 seconds or a nice context manager.
-            await self.send_typing(channel)
-
-            # TODO: I can create an event emitter object instead, add event functions, and every play list might be asyncified
-            #       Also have a "verify_entry" hook with the entry as an arg and returns the entry if its ok
-
-            entry_list, position = await player.playlist.import_from(song_url, channel=channel, author=author)
-
-            tnow = time.time()
-            ttime = tnow - t0
-            listlen = len(entry_list)
-            drop_count = 0
-
-            if permissions.max_song_length:
-                for e in entry_list.copy():
-                    if e.duration > permissions.max_song_length:
-                        player.playlist.entries.remove(e)
-                        entry_list.remove(e)
-                        drop_count += 1
-                        # Im pretty sure there's no situation where this would ever break
-                        # Unless the first entry starts being played, which would make this a race condition
-                if drop_count:
-                    print("Dropped %s songs" % drop_count)
-
-            print("Processed {} songs in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
-                listlen,
-                self._fixg(ttime),
-                ttime / listlen,
-                ttime / listlen - wait_per_song,
-                self._fixg(wait_per_song * num_songs))
-            )
-
-            await self.safe_delete_message(procmesg)
-
-            if not listlen - drop_count:
-                raise exceptions.CommandError(
-                    "No songs were added, all songs were over max duration (%ss)" % permissions.max_song_length,
-                    expire_in=30
-                )
-
-            reply_text = "Enqueued **%s** songs to be played. Position in queue: %s"
-            btext = str(listlen - drop_count)
+            try:
+                return await self._cmd_play_playlist_async(player, channel, author, permissions, song_url, info)
+            except exceptions.CommandError:
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                raise exceptions.CommandError("Error queuing playlist:\n%s" % e, expire_in=30)
 
         else:
             if permissions.max_song_length and info.get('duration', 0) > permissions.max_song_length:
@@ -1960,99 +1999,67 @@ class MusicBot(discord.Client):
 
         return Response(reply_text, delete_after=30)
 
-    async def _cmd_play_playlist_async(self, player, channel, author, permissions, playlist_url, extractor_type):
+    async def _cmd_play_playlist_async(self, player, channel, author, permissions, playlist_url, info):
         """
         Secret handler to use the async wizardry to make playlist queuing non-"blocking"
         """
 
-        await self.send_typing(channel)
-        info = await self.downloader.extract_info(player.playlist.loop, playlist_url, download=False, process=False)
-
-        if not info:
-            raise exceptions.CommandError("That playlist cannot be played.")
-
         num_songs = sum(1 for _ in info['entries'])
-        t0 = time.time()
+        position = len(player.playlist.entries) + 1
 
         busymsg = await self.safe_send_message(
             channel, "Processing %s songs..." % num_songs)  # TODO: From playlist_title
         await self.send_typing(channel)
 
-        entries_added = 0
-        if extractor_type == 'youtube:playlist':
-            try:
-                entries_added = await player.playlist.async_process_youtube_playlist(
-                    playlist_url, channel=channel, author=author)
-                # TODO: Add hook to be called after each song
-                # TODO: Add permissions
-
-            except Exception:
-                traceback.print_exc()
-                raise exceptions.CommandError('Error handling playlist %s queuing.' % playlist_url, expire_in=30)
-
-        elif extractor_type.lower() in ['soundcloud:set', 'bandcamp:album']:
-            try:
-                entries_added = await player.playlist.async_process_sc_bc_playlist(
-                    playlist_url, channel=channel, author=author)
-                # TODO: Add hook to be called after each song
-                # TODO: Add permissions
-
-            except Exception:
-                traceback.print_exc()
-                raise exceptions.CommandError('Error handling playlist %s queuing.' % playlist_url, expire_in=30)
+        importer = player.playlist.import_from(
+            playlist_url, max_song_length=permissions.max_song_length, channel=channel, author=author)
+        progress = importer.progress
+        last_update = time.time()
 
+        try:
+            async for entry in importer:
+                # The first songs are already playing or downloading while we're here, so keep them posted
+                if busymsg and time.time() - last_update > 5:
+                    last_update = time.time()
+                    busymsg = await self.safe_edit_message(
+                        busymsg, "Processing %s songs... %s added so far, %s to go" % (
+                            num_songs, progress.added, num_songs - progress.processed))
 
-        songs_processed = len(entries_added)
-        drop_count = 0
-        skipped = False
-
-        if permissions.max_song_length:
-            for e in entries_added.copy():
-                if e.duration > permissions.max_song_length:
-                    try:
-                        player.playlist.entries.remove(e)
-                        entries_added.remove(e)
-                        drop_count += 1
-                    except:
-                        pass
-
-            if drop_count:
-                print("Dropped %s songs" % drop_count)
+        except exceptions.ExtractionError as e:
+            await self.safe_delete_message(busymsg)
+            raise exceptions.CommandError('Error handling playlist %s queuing:\n%s' % (playlist_url, e), expire_in=30)
 
-            if player.current_entry and player.current_entry.duration > permissions.max_song_length:
-                await self.safe_delete_message(self.server_specific_data[channel.server]['last_np_msg'])
-                self.server_specific_data[channel.server]['last_np_msg'] = None
-                skipped = True
-                player.skip()
-                entries_added.pop()
+        if progress.dropped:
+            print("Dropped %s songs" % progress.dropped)
 
         await self.safe_delete_message(busymsg)
 
-        songs_added = len(entries_added)
-        tnow = time.time()
-        ttime = tnow - t0
-        wait_per_song = 1.2
-        # TODO: actually calculate wait per song in the process function and return that too
+        songs_added = len(importer.entries)
 
-        # This is technically inaccurate since bad songs are ignored but still take up time
-        print("Processed {}/{} songs in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
-            songs_processed,
+        # Other people's songs can be ahead of it if the queue takes turns
+        if songs_added and importer.entries[0] in player.playlist.entries:
+            position = player.playlist.entries.index(importer.entries[0]) + 1
+
+        # Bad songs are counted too, they take up time the same as good ones
+        print("Processed {}/{} songs in {} seconds at {:.2f}s/song ({:.2f} songs/s, {} at a time)".format(
+            progress.processed,
             num_songs,
-            self._fixg(ttime),
-            ttime / num_songs,
-            ttime / num_songs - wait_per_song,
-            self._fixg(wait_per_song * num_songs))
+            self._fixg(progress.elapsed),
+            progress.per_song,
+            progress.processed / max(progress.elapsed, 0.001),
+            self.config.playlist_concurrency)
         )
 
         if not songs_added:
-            basetext = "No songs were added, all songs were over max duration (%ss)" % permissions.max_song_length
-            if skipped:
-                basetext += "\nAdditionally, the current song was skipped for being too long."
+            if progress.dropped:
+                raise exceptions.CommandError(
+                    "No songs were added, all songs were over max duration (%ss)" % permissions.max_song_length,
+                    expire_in=30)
 
-            raise exceptions.CommandError(basetext, expire_in=30)
+            raise exceptions.CommandError("No songs were added, none of them could be played.", expire_in=30)
 
-        return Response("Enqueued {} songs to be played in {} seconds".format(
-            songs_added, self._fixg(ttime, 1)), delete_after=30)
+        return Response("Enqueued {} songs to be played in {} seconds. Position in queue: {}".format(
+            songs_added, self._fixg(progress.elapsed, 1), position), delete_after=30)
 
     async def cmd_search(self, player, channel, author, permissions, leftover_args):
         """
@@ -2207,6 +2214,11 @@ class MusicBot(discord.Client):
             else:
                 np_text = "Now Playing: **%s** %s\n" % (player.current_entry.title, prog_str)
 
+            levels = player.current_levels()
+            if levels:
+                np_text += "Levels: %.0f%% average, %.0f%% peak, %s clipped samples\n" % (
+                    levels['average'] * 100, levels['peak'] * 100, levels['clipped'])
+
             self.server_specific_data[server]['last_np_msg'] = await self.safe_send_message(channel, np_text)
             await self._manual_delete_check(message)
         else:
@@ -2387,6 +2399,56 @@ class MusicBot(discord.Client):
                 delete_after=20
             )
 
+    async def cmd_seek(self, player, position=None):
+        """
+        Usage:
+            {command_prefix}seek (+/-)[time]
+
+        Jumps to a point in the current song, without downloading it again.  The time can be in seconds or like 1:30.
+        Putting + or - before the time will jump relative to where the song is now.
+        """
+
+        if not player.current_entry:
+            raise exceptions.CommandError('Nothing is playing.', expire_in=20)
+
+        if not position:
+            raise exceptions.CommandError(
+                'Where to?  Usage: {}seek (+/-)[time]'.format(self.config.command_prefix), expire_in=20)
+
+        parts = position.lstrip('+-').split(':')
+
+        try:
+            if len(parts) > 3:
+                raise ValueError
+
+            seconds = 0
+            for part in parts:
+                seconds = seconds * 60 + float(part)
+
+        except ValueError:
+            raise exceptions.CommandError('{} is not a valid time'.format(position), expire_in=20)
+
+        if position[0] == '+':
+            seconds = player.position + seconds
+        elif position[0] == '-':
+            # Going back past the start just starts it over
+            seconds = max(0, player.position - seconds)
+
+        duration = player.current_entry.duration
+
+        # Some sources don't say how long they are, so there's no end to check against
+        if duration and seconds >= duration:
+            raise exceptions.CommandError(
+                'That\'s outside the song, it\'s {} long.'.format(
+                    str(timedelta(seconds=duration)).lstrip('0').lstrip(':')), expire_in=20)
+
+        # Between songs or still waiting on the download, there's nothing to move yet
+        if not player.seek(seconds):
+            raise exceptions.CommandError('Nothing is playing right now.', expire_in=20)
+
+        return Response(
+            'Skipped to `%s`' % str(timedelta(seconds=int(seconds))).lstrip('0').lstrip(':'), delete_after=20)
+
     async def cmd_volume(self, message, player, new_volume=None):
         """
         Usage:
@@ -2730,11 +2792,13 @@ class MusicBot(discord.Client):
 
     async def cmd_restart(self, channel):
         await self.safe_send_message(channel, ":wave:")
+        self._save_queues()
         await self.disconnect_all_voice_clients()
         raise exceptions.RestartSignal
 
     async def cmd_shutdown(self, channel):
         await self.safe_send_message(channel, ":wave:")
+        self._save_queues()
         await self.disconnect_all_voice_clients()
         raise exceptions.TerminateSignal
 
@@ -78,6 +78,7 @@ class Config:
         self.skips_required = config.getint('MusicBot', 'SkipsRequired', fallback=ConfigDefaults.skips_required)
         self.skip_ratio_required = config.getfloat('MusicBot', 'SkipRatio', fallback=ConfigDefaults.skip_ratio_required)
         self.save_videos = config.getboolean('MusicBot', 'SaveVideos', fallback=ConfigDefaults.save_videos)
+        self.audio_cache_size = config.getint('MusicBot', 'AudioCacheSize', fallback=ConfigDefaults.audio_cache_size)
         self.now_playing_mentions = config.getboolean('MusicBot', 'NowPlayingMentions', fallback=ConfigDefaults.now_playing_mentions)
         self.auto_summon = config.getboolean('MusicBot', 'AutoSummon', fallback=ConfigDefaults.auto_summon)
         self.auto_playlist = config.getboolean('MusicBot', 'UseAutoPlaylist', fallback=ConfigDefaults.auto_playlist)
@@ -85,6 +86,25 @@ class Config:
         self.delete_messages  = config.getboolean('MusicBot', 'DeleteMessages', fallback=ConfigDefaults.delete_messages)
         self.delete_invoking = config.getboolean('MusicBot', 'DeleteInvoking', fallback=ConfigDefaults.delete_invoking)
         self.debug_mode = config.getboolean('MusicBot', 'DebugMode', fallback=ConfigDefaults.debug_mode)
+        self.soft_limiter = config.getboolean('MusicBot', 'SoftLimiter', fallback=ConfigDefaults.soft_limiter)
+        self.level_meter = config.getboolean('MusicBot', 'LevelMeter', fallback=ConfigDefaults.level_meter)
+        self.opus_cache = config.getboolean('MusicBot', 'OpusCache', fallback=ConfigDefaults.opus_cache)
+        self.opus_passthrough = config.getboolean('MusicBot', 'OpusPassthrough', fallback=ConfigDefaults.opus_passthrough)
+        self.normalize_loudness = config.getboolean('MusicBot', 'NormalizeLoudness', fallback=ConfigDefaults.normalize_loudness)
+        self.loudness_target = config.getfloat('MusicBot', 'LoudnessTarget', fallback=ConfigDefaults.loudness_target)
+        self.gapless = config.getboolean('MusicBot', 'Gapless', fallback=ConfigDefaults.gapless)
+        self.crossfade = config.getfloat('MusicBot', 'Crossfade', fallback=ConfigDefaults.crossfade)
+        self.jitter_buffer = config.getint('MusicBot', 'JitterBuffer', fallback=ConfigDefaults.jitter_buffer)
+        self.shared_decoding = config.getboolean('MusicBot', 'SharedDecoding', fallback=ConfigDefaults.shared_decoding)
+        self.persistent_queue = config.getboolean('MusicBot', 'PersistentQueue', fallback=ConfigDefaults.persistent_queue)
+        self.fair_queue = config.getboolean('MusicBot', 'FairQueue', fallback=ConfigDefaults.fair_queue)
+        self.metadata_cache_size = config.getint('MusicBot', 'MetadataCacheSize', fallback=ConfigDefaults.metadata_cache_size)
+        self.extraction_workers = config.getint('MusicBot', 'ExtractionWorkers', fallback=ConfigDefaults.extraction_workers)
+        self.extraction_processes = config.getboolean('MusicBot', 'ExtractionProcesses', fallback=ConfigDefaults.extraction_processes)
+        self.stream_while_downloading = config.getboolean('MusicBot', 'StreamWhileDownloading', fallback=ConfigDefaults.stream_while_downloading)
+        self.predownload_window = config.getint('MusicBot', 'PredownloadWindow', fallback=ConfigDefaults.predownload_window)
+        self.predownload_concurrency = config.getint('MusicBot', 'PredownloadConcurrency', fallback=ConfigDefaults.predownload_concurrency)
+        self.playlist_concurrency = config.getint('MusicBot', 'PlaylistConcurrency', fallback=ConfigDefaults.playlist_concurrency)
 
 
         #
@@ -187,6 +207,38 @@ class Config:
 
         self.delete_invoking = self.delete_invoking and self.delete_messages
 
+        if self.extraction_workers < 1:
+            print("[Warning] ExtractionWorkers must be at least 1, using %s" % ConfigDefaults.extraction_workers)
+            self.extraction_workers = ConfigDefaults.extraction_workers
+
+        if self.audio_cache_size < 0:
+            print("[Warning] AudioCacheSize can't be negative, turning it off")
+            self.audio_cache_size = 0
+
+        if not -40 <= self.loudness_target <= -5:
+            print("[Warning] LoudnessTarget should be between -40 and -5, using %s" % ConfigDefaults.loudness_target)
+            self.loudness_target = ConfigDefaults.loudness_target
+
+        if not 0 <= self.crossfade <= 10:
+            print("[Warning] Crossfade should be between 0 and 10 seconds, turning it off")
+            self.crossfade = 0.0
+
+        if self.jitter_buffer < 0:
+            print("[Warning] JitterBuffer can't be negative, turning it off")
+            self.jitter_buffer = 0
+
+        if self.predownload_window < 1:
+            print("[Warning] PredownloadWindow must be at least 1, using 1")
+            self.predownload_window = 1
+
+        if self.predownload_concurrency < 0:
+            print("[Warning] PredownloadConcurrency can't be negative, turning it off")
+            self.predownload_concurrency = 0
+
+        if self.playlist_concurrency < 1:
+            print("[Warning] PlaylistConcurrency must be at least 1, using %s" % ConfigDefaults.playlist_concurrency)
+            self.playlist_concurrency = ConfigDefaults.playlist_concurrency
+
         self.bound_channels = set(item.replace(',', ' ').strip() for item in self.bound_channels)
 
         self.autojoin_channels = set(item.replace(',', ' ').strip() for item in self.autojoin_channels)
@@ -219,6 +271,7 @@ class ConfigDefaults:
     skips_required = 4
     skip_ratio_required = 0.5
     save_videos = True
+    audio_cache_size = 0
     now_playing_mentions = False
     auto_summon = True
     auto_playlist = True
@@ -226,6 +279,25 @@ class ConfigDefaults:
     delete_messages = True
     delete_invoking = False
     debug_mode = False
+    soft_limiter = False
+    level_meter = False
+    opus_cache = False
+    opus_passthrough = True
+    normalize_loudness = False
+    loudness_target = -16.0
+    gapless = True
+    crossfade = 0.0
+    jitter_buffer = 25
+    shared_decoding = False
+    persistent_queue = True
+    fair_queue = False
+    metadata_cache_size = 32
+    extraction_workers = 4
+    extraction_processes = False
+    stream_while_downloading = True
+    playlist_concurrency = 3
+    predownload_window = 5
+    predownload_concurrency = 2
 
     options_file = 'config/options.ini'
     blacklist_file = 'config/blacklist.txt'
@@ -5,4 +5,6 @@ SUB_VERSION = ''
 VERSION = MAIN_VERSION + SUB_VERSION
 
 AUDIO_CACHE_PATH = os.path.join(os.getcwd(), 'audio_cache')
+INFO_CACHE_PATH = os.path.join(os.getcwd(), 'info_cache')
+QUEUE_PATH = os.path.join(os.getcwd(), 'queues')
 DISCORD_MSG_CHAR_LIMIT = 2000
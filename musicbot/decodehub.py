@@ -0,0 +1,300 @@
+import os
+import threading
+import subprocess
+
+FRAME_LENGTH = 0.02  # Seconds of audio in a frame
+FRAME_SIZE = 3840  # Bytes in a frame of 48kHz, 16 bit, stereo pcm
+
+# How far (in frames) a decode gets ahead of the furthest along player, and how many frames it keeps in all.  The
+# ones behind are for players that start the same song a bit later.  30 seconds of pcm is about 5.5MB per song.
+AHEAD = 250
+RETAIN = 1500
+
+
+def ffmpeg_args(filename, offset=0, ffmpeg='ffmpeg'):
+    """
+        Returns the command that decodes `filename` from `offset` seconds in, the same way discord.py's ffmpeg player
+        would.
+    """
+    args = [ffmpeg, '-nostdin']
+
+    if offset:
+        args += ['-ss', '%.2f' % offset]
+
+    return args + ['-i', filename, '-vn', '-f', 's16le', '-ar', '48000', '-ac', '2', '-loglevel', 'warning', 'pipe:1']
+
+
+def _read_into(pipe, view):
+    filled = 0
+
+    while filled < len(view):
+        got = pipe.readinto(view[filled:])
+        if not got:
+            break
+        filled += got
+
+    return filled
+
+
+class Subscription:
+    """
+        One player's place in a SharedDecode, which reads like ffmpeg's stdout would, a frame at a time.  If it falls
+        so far behind (paused, say) that its frames have been dropped, it carries on with an ffmpeg of its own.
+    """
+
+    def __init__(self, decode, cursor):
+        self.decode = decode
+        self.cursor = cursor
+        self.process = None
+        self.closed = False
+
+    @property
+    def position(self):
+        return self.decode.offset + self.cursor * FRAME_LENGTH
+
+    def read(self, size=FRAME_SIZE):
+        if self.process:
+            return self.process.stdout.read(size)
+
+        decode = self.decode
+
+        with decode.cond:
+            while not self.closed and not decode.eof and decode.base <= self.cursor >= decode.head:
+                decode.cond.wait()
+
+            if self.closed:
+                return b''
+
+            if decode.base <= self.cursor < decode.head:
+                slot = self.cursor % RETAIN
+                start = slot * FRAME_SIZE
+                frame = bytes(decode.view[start:start + decode.lengths[slot]])
+
+                self.cursor += 1
+                decode.cond.notify_all()
+                return frame
+
+            if self.cursor >= decode.head:
+                return b''
+
+        self._detach()
+        return self.read(size)
+
+    def readinto(self, view):
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def _detach(self):
+        decode = self.decode
+        decode.unsubscribe(self)
+
+        self.process = subprocess.Popen(ffmpeg_args(decode.filename, self.position, decode.hub.ffmpeg),
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        decode.hub.detached += 1
+
+    def close(self):
+        if self.closed:
+            return
+
+        with self.decode.cond:
+            self.closed = True
+            self.decode.cond.notify_all()
+
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+        else:
+            self.decode.unsubscribe(self)
+
+
+class SharedDecode:
+    """
+        One ffmpeg decoding `filename` from `offset` seconds in, into a ring of the last RETAIN frames that any number
+        of Subscriptions read at their own pace.
+    """
+
+    def __init__(self, hub, filename, offset=0):
+        self.hub = hub
+        self.filename = filename
+        self.offset = offset
+
+        self.ring = bytearray(RETAIN * FRAME_SIZE)
+        self.view = memoryview(self.ring)
+        self.lengths = [0] * RETAIN
+
+        self.base = 0  # Oldest frame still in the ring
+        self.head = 0  # Next frame to decode
+        self.eof = False
+        self.closed = False
+
+        self.subscribers = set()
+        self.cond = threading.Condition()
+
+        self.process = subprocess.Popen(ffmpeg_args(filename, offset, hub.ffmpeg),
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        self._thread = threading.Thread(target=self._decode, name='SharedDecode', daemon=True)
+        self._thread.start()
+
+    def frame_at(self, offset):
+        """
+            Returns the index of the frame `offset` seconds into the song, if it's in the ring or decoded next.
+        """
+        index = round((offset - self.offset) / FRAME_LENGTH)
+
+        with self.cond:
+            if self.closed or (self.eof and index >= self.head):
+                return None
+
+            if self.base <= index <= self.head:
+                return index
+
+        return None
+
+    def subscribe(self, cursor):
+        subscription = Subscription(self, cursor)
+
+        with self.cond:
+            self.subscribers.add(subscription)
+            self.cond.notify_all()
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.hub.lock:
+            with self.cond:
+                self.subscribers.discard(subscription)
+                self.cond.notify_all()
+                empty = not self.subscribers
+
+            if empty:
+                self.hub.remove(self)
+
+        if empty:
+            self.close()
+
+    def _can_decode(self):
+        if not self.subscribers:
+            return False
+
+        cursors = [subscription.cursor for subscription in self.subscribers]
+        furthest = max(cursors)
+
+        if self.head - furthest >= AHEAD:
+            return False
+
+        if self.head - self.base < RETAIN:
+            return True
+
+        # The oldest frame can go if nobody needs it, or if somebody's waiting on a new one (anyone still on it is
+        # too far behind, and gets their own ffmpeg)
+        return min(cursors) > self.base or furthest >= self.head
+
+    def _decode(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.closed and not self._can_decode():
+                        self.cond.wait()
+
+                    if self.closed:
+                        return
+
+                    if self.head - self.base >= RETAIN:
+                        self.base += 1
+
+                    slot = self.head % RETAIN
+
+                # Nobody reads the slot until head moves past it
+                length = _read_into(self.process.stdout, self.view[slot * FRAME_SIZE:(slot + 1) * FRAME_SIZE])
+
+                with self.cond:
+                    if length:
+                        self.lengths[slot] = length
+                        self.head += 1
+
+                    self.cond.notify_all()
+
+                if length < FRAME_SIZE:
+                    return
+
+        except (OSError, ValueError):
+            pass
+
+        finally:
+            with self.cond:
+                self.eof = True
+                self.cond.notify_all()
+
+            self.process.wait()
+            self.process.stdout.close()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        self.process.kill()
+
+
+class DecodeHub:
+    """
+        Shares decoding between players, so a song playing in several servers at once is decoded once.  A player that
+        starts a song another one started up to RETAIN frames ago (at the same place) reads the same decode from its
+        own cursor.  Volume and everything else is still applied by each player, to its own copy of the frames.
+    """
+
+    def __init__(self, ffmpeg='ffmpeg'):
+        self.ffmpeg = ffmpeg
+        self.lock = threading.Lock()
+
+        self.started = 0  # ffmpegs started
+        self.joined = 0  # Players that joined one that was already going
+        self.detached = 0  # Players that fell behind and needed their own
+        self._decodes = {}  # filename -> [SharedDecode]
+
+    def __len__(self):
+        return sum(len(decodes) for decodes in self._decodes.values())
+
+    def subscribe(self, filename, offset=0):
+        """
+            Returns a Subscription to `filename` from `offset` seconds in, sharing a decode that's already going if
+            there's one that can.
+        """
+        filename = os.path.abspath(filename)
+
+        with self.lock:
+            for decode in self._decodes.get(filename, ()):
+                index = decode.frame_at(offset)
+
+                if index is not None:
+                    self.joined += 1
+                    return decode.subscribe(index)
+
+            decode = SharedDecode(self, filename, offset)
+            self._decodes.setdefault(filename, []).append(decode)
+            self.started += 1
+
+            return decode.subscribe(0)
+
+    def remove(self, decode):
+        """
+            Forgets a decode nobody's reading anymore.  Call it with `lock` held.
+        """
+        decodes = self._decodes.get(decode.filename, [])
+
+        if decode in decodes:
+            decodes.remove(decode)
+
+        if not decodes:
+            self._decodes.pop(decode.filename, None)
+
+    def close(self):
+        with self.lock:
+            decodes = [decode for decodes in self._decodes.values() for decode in decodes]
+            self._decodes.clear()
+
+        for decode in decodes:
+            decode.close()
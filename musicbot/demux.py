@@ -0,0 +1,267 @@
+import struct
+
+# Matroska/WebM element ids, the ones that are needed to find opus packets
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+CODEC_ID = 0x86
+CLUSTER = 0x1F43B675
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+SIMPLE_BLOCK = 0xA3
+
+# These are only containers, their children are read as if they were at the top
+_EBML_MASTERS = {SEGMENT, TRACKS, TRACK_ENTRY, CLUSTER, BLOCK_GROUP}
+
+
+class DemuxError(Exception):
+    pass
+
+
+def _read_exact(f, size):
+    """
+        Reads exactly `size` bytes, or returns b'' at a clean end of file.
+    """
+    data = f.read(size)
+
+    if data and len(data) < size:
+        while len(data) < size:
+            more = f.read(size - len(data))
+            if not more:
+                raise DemuxError("File ends in the middle of a page")
+            data += more
+
+    return data
+
+
+def ogg_packets(f):
+    """
+        Yields the packets of the first logical stream in an ogg file object, in order.
+    """
+    serial = None
+    partial = []
+
+    while True:
+        header = _read_exact(f, 27)
+        if not header:
+            return
+
+        if header[:4] != b'OggS':
+            raise DemuxError("Lost sync, not an ogg page")
+
+        page_serial = struct.unpack_from('<I', header, 14)[0]
+        lacing = _read_exact(f, header[26])
+        data = _read_exact(f, sum(lacing))
+
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            continue
+
+        pos = 0
+        for size in lacing:
+            partial.append(data[pos:pos + size])
+            pos += size
+
+            # A lacing value of 255 means the packet carries on into the next segment
+            if size < 255:
+                yield b''.join(partial)
+                partial = []
+
+
+def ogg_opus_packets(f):
+    """
+        Yields the audio packets of an ogg opus file object, skipping the OpusHead and OpusTags headers.
+    """
+    packets = ogg_packets(f)
+    head = next(packets, None)
+
+    if not head or not head.startswith(b'OpusHead'):
+        raise DemuxError("Not an ogg opus stream")
+
+    for packet in packets:
+        if not packet.startswith(b'OpusTags'):
+            yield packet
+
+
+def _read_vint(f, *, is_id=False):
+    """
+        Reads an EBML variable length integer.  Returns it and whether it's the reserved "unknown size" value,
+        or (None, False) at the end of the file.  Ids keep their length marker bits, sizes don't.
+    """
+    first = f.read(1)
+    if not first:
+        return None, False
+
+    length = 1
+    mask = 0x80
+    while not first[0] & mask:
+        mask >>= 1
+        length += 1
+        if length > 8:
+            raise DemuxError("Broken EBML integer")
+
+    value = first[0] if is_id else first[0] & (mask - 1)
+    for byte in _read_exact(f, length - 1) if length > 1 else b'':
+        value = (value << 8) | byte
+
+    return value, not is_id and value == (1 << (7 * length)) - 1
+
+
+def _vint_from(data, pos, *, signed=False):
+    """
+        Reads an EBML variable length integer out of `data` at `pos`.  Returns it and the position after it.
+    """
+    length = 1
+    mask = 0x80
+    while not data[pos] & mask:
+        mask >>= 1
+        length += 1
+        if length > 8:
+            raise DemuxError("Broken EBML integer")
+
+    value = data[pos] & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+
+    if signed:
+        value -= (1 << (7 * length - 1)) - 1
+
+    return value, pos + length
+
+
+def _block_frames(data):
+    """
+        Splits a (Simple)Block into its track number and frames, handling the three kinds of lacing.
+    """
+    track, pos = _vint_from(data, 0)
+    flags = data[pos + 2]
+    pos += 3
+
+    lacing = (flags >> 1) & 3
+    if not lacing:
+        return track, [data[pos:]]
+
+    count = data[pos] + 1
+    pos += 1
+    sizes = []
+
+    if lacing == 1:  # Xiph
+        for _ in range(count - 1):
+            size = 0
+            while data[pos] == 255:
+                size += 255
+                pos += 1
+            size += data[pos]
+            pos += 1
+            sizes.append(size)
+
+    elif lacing == 3:  # EBML
+        size, pos = _vint_from(data, pos)
+        sizes.append(size)
+        for _ in range(count - 2):
+            delta, pos = _vint_from(data, pos, signed=True)
+            size += delta
+            sizes.append(size)
+
+    else:  # Fixed
+        sizes = [(len(data) - pos) // count] * (count - 1)
+
+    frames = []
+    for size in sizes:
+        frames.append(data[pos:pos + size])
+        pos += size
+    frames.append(data[pos:])
+
+    return track, frames
+
+
+def webm_opus_packets(f):
+    """
+        Yields the packets of the first opus track in a webm (or matroska) file object, in order.
+    """
+    tracks = []
+    opus_track = None
+
+    while True:
+        element, _ = _read_vint(f, is_id=True)
+        if element is None:
+            return
+
+        size, unknown = _read_vint(f)
+        if size is None:
+            raise DemuxError("File ends in the middle of an element")
+
+        if element in _EBML_MASTERS:
+            if element == TRACK_ENTRY:
+                tracks.append({})
+
+            elif element == CLUSTER and opus_track is None:
+                opus_track = next((t.get('number') for t in tracks if t.get('codec') == 'A_OPUS'), None)
+                if opus_track is None:
+                    raise DemuxError("No opus track, codecs are %s" % [t.get('codec') for t in tracks])
+
+            continue
+
+        if unknown:
+            raise DemuxError("Element %x has an unknown size" % element)
+
+        if element in (TRACK_NUMBER, CODEC_ID, BLOCK, SIMPLE_BLOCK):
+            data = _read_exact(f, size)
+
+            if element == TRACK_NUMBER and tracks:
+                tracks[-1]['number'] = int.from_bytes(data, 'big')
+
+            elif element == CODEC_ID and tracks:
+                tracks[-1]['codec'] = data.rstrip(b'\0').decode('ascii', 'replace')
+
+            elif opus_track is not None:
+                track, frames = _block_frames(data)
+                if track == opus_track:
+                    yield from frames
+
+        else:
+            f.seek(size, 1)
+
+
+def opus_packets(f):
+    """
+        Yields the opus packets of an ogg or webm file object, whichever it turns out to be.
+    """
+    magic = f.read(4)
+    f.seek(-len(magic), 1)
+
+    if magic == b'OggS':
+        return ogg_opus_packets(f)
+
+    if magic == b'\x1a\x45\xdf\xa3':
+        return webm_opus_packets(f)
+
+    raise DemuxError("Not an ogg or webm file")
+
+
+def opus_packet_duration(packet):
+    """
+        Returns how many seconds of audio an opus packet holds, from its TOC byte.
+    """
+    toc = packet[0]
+    config = toc >> 3
+
+    if config < 12:  # SILK
+        frame = (10, 20, 40, 60)[config & 3]
+    elif config < 16:  # Hybrid
+        frame = (10, 20)[config & 1]
+    else:  # CELT
+        frame = (2.5, 5, 10, 20)[config & 3]
+
+    code = toc & 3
+    if code == 0:
+        count = 1
+    elif code < 3:
+        count = 2
+    else:
+        count = packet[1] & 0x3F
+
+    return frame * count / 1000
@@ -1,9 +1,21 @@
 import os
+import re
+import json
+import time
 import asyncio
+import heapq
+import hashlib
 import functools
+import itertools
+import threading
+import traceback
 import youtube_dl
 
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+
+from .audiocache import AudioCache
 
 ytdl_format_options = {
     'format': 'bestaudio/best',
@@ -24,6 +36,35 @@ ytdl_format_options = {
 # Fuck your useless bugreports message that gets two link embeds and confuses users
 youtube_dl.utils.bug_reports_message = lambda: ''
 
+# Extraction work is handed out most important first, see ExtractionScheduler
+PRIORITY_INTERACTIVE = 0  # Someone is waiting on a command
+PRIORITY_PLAYBACK = 1     # Downloading what's playing now or next
+PRIORITY_BACKGROUND = 2   # Playlist imports, the autoplaylist and other bulk work
+PRIORITY_NAMES = ('interactive', 'playback', 'background')
+
+# How long (in seconds) extracted info is considered fresh, by extractor.  Anything processed has
+# signed media urls in it, so those are also capped by the url's own `expire` parameter.
+INFO_CACHE_TTLS = {
+    'youtube': 60 * 60 * 4,
+    'youtube:playlist': 60 * 15,
+    'soundcloud': 60 * 60,
+    'soundcloud:set': 60 * 15,
+    'bandcamp': 60 * 60,
+    'bandcamp:album': 60 * 15,
+    'generic': 60 * 10,
+    'search': 60 * 10,
+}
+INFO_CACHE_DEFAULT_TTL = 60 * 30
+
+# The parts of an info dict the bot reads.  The rest (formats, thumbnails, subtitles, descriptions...) can be a few
+# hundred KB a video, so it's left out of the cache.
+INFO_CACHE_FIELDS = ('_type', 'id', 'url', 'webpage_url', 'title', 'duration', 'extractor', 'extractor_key', 'ie_key',
+                     'ext', 'protocol', 'http_headers', 'entries')
+
+_youtube_id_re = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|embed/|v/)|youtu\.be/)([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])')
+
+
 '''
     Alright, here's the problem.  To catch youtube-dl errors for their useful information, I have to
     catch the exceptions with `ignoreerrors` off.  To not break when ytdl hits a dumb video
@@ -32,12 +73,472 @@ youtube_dl.utils.bug_reports_message = lambda: ''
 
 '''
 
+def url_expiry(url):
+    """
+        Returns when a signed media url stops working (as a unix timestamp), if the url says so.
+    """
+    if not url.startswith('http'):
+        return None
+
+    expire = parse_qs(urlsplit(url).query).get('expire')
+
+    if not expire:
+        # Youtube sometimes puts the parameters in the path instead, /expire/1234/
+        match = re.search(r'/expire/(\d+)', url)
+        expire = match and [match.group(1)]
+
+    try:
+        return int(expire[0]) if expire else None
+    except ValueError:
+        return None
+
+
+def slim_info(info):
+    """
+        Returns a copy of `info` (and of its playlist entries) with only the `INFO_CACHE_FIELDS` in it.
+    """
+    if not isinstance(info, dict):
+        return info
+
+    slim = {}
+
+    for key in INFO_CACHE_FIELDS:
+        if key in info:
+            value = info[key]
+
+            if key == 'entries' and isinstance(value, list):
+                value = [slim_info(entry) for entry in value]
+            elif isinstance(value, dict):
+                value = dict(value)
+
+            slim[key] = value
+
+    return slim
+
+
+class InfoCache:
+    """
+        Caches ytdl info dicts in memory and on disk, keyed by the normalized url and extractor.  Only the fields in
+        `INFO_CACHE_FIELDS` are kept, and every hit is a fresh copy, so callers can change what they get back.
+
+        Entries expire after a per extractor ttl (see `INFO_CACHE_TTLS`), and the least recently used ones are
+        dropped once they add up to more than `max_bytes`, in memory and on disk each.
+    """
+
+    def __init__(self, cache_folder=None, max_bytes=32 * 1024 * 1024):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires, info, size)
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(url, process=True):
+        """
+            Turns a url (or search string) into `extractor:id|flag`.  Youtube links are reduced to the video id so the
+            many forms of the same link share an entry.  Returns None for things that shouldn't be cached.
+        """
+        url = url.strip().strip('<>')
+        flag = 'p' if process else 'r'
+
+        match = _youtube_id_re.search(url)
+        if match and 'list=' not in url:
+            return 'youtube:%s|%s' % (match.group(1), flag)
+
+        parts = urlsplit(url)
+
+        if parts.scheme not in ('http', 'https'):
+            # ytdl treats anything that isn't a url as a search
+            return 'search:%s|%s' % (' '.join(url.lower().split()), flag)
+
+        netloc = parts.netloc.lower()
+        if netloc.startswith('www.'):
+            netloc = netloc[4:]
+
+        for site in ('youtube', 'soundcloud', 'bandcamp'):
+            if site in netloc:
+                extractor = site
+                break
+        else:
+            extractor = 'generic'
+
+        return '%s:%s|%s' % (extractor, urlunsplit((parts.scheme.lower(), netloc, parts.path, parts.query, '')), flag)
+
+    @staticmethod
+    def _ttl_for(info):
+        extractor = (info.get('extractor') or 'generic').lower()
+
+        if ':search' in extractor or info.get('url', '').startswith('ytsearch'):
+            ttl = INFO_CACHE_TTLS['search']
+        else:
+            ttl = INFO_CACHE_TTLS.get(extractor, INFO_CACHE_TTLS.get(extractor.split(':')[0], INFO_CACHE_DEFAULT_TTL))
+
+        # Don't hand out media urls that are about to go stale
+        expires = url_expiry(info.get('url', ''))
+        if expires:
+            ttl = min(ttl, expires - time.time() - 60 * 10)
+
+        return ttl
+
+    @staticmethod
+    def cacheable(info):
+        # Lazy playlists (generators, PagedLists) can only be read once and can't be cached
+        return bool(info) and isinstance(info.get('entries', []), list)
+
+    def _disk_path(self, key):
+        keyhash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_folder, keyhash[:2], keyhash + '.json')
+
+    def get(self, key):
+        """
+            Returns the cached info for `key` from memory, or None.  Use `load` to also check the disk.
+        """
+        item = self._entries.get(key)
+
+        if item:
+            expires, info, size = item
+
+            if expires > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return slim_info(info)
+
+            self._forget(key)
+
+        return None
+
+    def load(self, key):
+        """
+            Reads `key` back from the disk cache.  This does file io, so run it in an executor.
+        """
+        if not self.cache_folder:
+            return None
+
+        path = self._disk_path(key)
+
+        try:
+            with open(path, encoding='utf8') as f:
+                data = json.load(f)
+
+        except FileNotFoundError:
+            return None
+
+        except Exception:
+            # Broken or half written, whatever, just get rid of it
+            self._unlink(path)
+            return None
+
+        if data.get('key') != key or data.get('expires', 0) <= time.time():
+            self._unlink(path)
+            return None
+
+        return data['expires'], slim_info(data['info'])
+
+    def put(self, key, info):
+        """
+            Stores `info` in memory and returns the (expires, info) pair to pass to `save`, or None if it's not cacheable.
+        """
+        if not self.cacheable(info):
+            return None
+
+        ttl = self._ttl_for(info)
+        if ttl <= 0:
+            return None
+
+        item = (time.time() + ttl, slim_info(info))
+        self._remember(key, item)
+        return item
+
+    def _remember(self, key, item):
+        expires, info = item
+
+        try:
+            size = len(json.dumps(info))
+        except TypeError:
+            size = len(repr(info))
+
+        self._forget(key)
+        self._entries[key] = (expires, info, size)
+        self.size += size
+
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            self._forget(next(iter(self._entries)))
+
+    def _forget(self, key):
+        item = self._entries.pop(key, None)
+        if item:
+            self.size -= item[2]
+
+    def save(self, key, item):
+        """
+            Writes an item returned by `put` to the disk cache.  This does file io, so run it in an executor.
+        """
+        if not self.cache_folder:
+            return
+
+        expires, info = item
+        path = self._disk_path(key)
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(path + '.tmp', 'w', encoding='utf8') as f:
+                json.dump({'key': key, 'expires': expires, 'info': info}, f)
+
+            os.replace(path + '.tmp', path)
+
+        except TypeError:
+            # Something in there isn't json serializable, it'll just live in memory
+            self._unlink(path + '.tmp')
+
+        except OSError:
+            traceback.print_exc()
+
+    def prune(self):
+        """
+            Removes expired files from the disk cache, then the oldest ones until it fits in `max_bytes`.
+            This does file io, so run it in an executor.
+        """
+        if not self.cache_folder or not os.path.isdir(self.cache_folder):
+            return
+
+        now = time.time()
+        files = []
+
+        for shard in os.scandir(self.cache_folder):
+            if not shard.is_dir():
+                continue
+
+            for item in os.scandir(shard.path):
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+
+                mtime = stat.st_mtime
+
+                # Nothing lives longer than the longest ttl, so this is a cheap way to spot dead files
+                if mtime + max(INFO_CACHE_TTLS.values()) < now or item.name.endswith('.tmp'):
+                    self._unlink(item.path)
+                else:
+                    files.append((mtime, stat.st_size, item.path))
+
+        total = sum(size for mtime, size, path in files)
+        files.sort()
+
+        for mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+
+            self._unlink(path)
+            total -= size
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'func', 'loop', 'future')
+
+    def __init__(self, priority, seq, func, loop):
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.loop = loop
+        self.future = loop.create_future()
+
+
+class ExtractionScheduler:
+    """
+        Feeds jobs to an executor a few at a time, lowest priority number first, then oldest first.
+
+        Queued jobs can be promoted or cancelled (cancel the future `submit` returned), but once a job is running it
+        runs to the end.  Playback jobs (downloads, which can take minutes) never take the last free worker, and
+        background jobs leave one more for playback, so a command never has to wait for either to make room.
+    """
+
+    def __init__(self, executor, max_running=2):
+        self.executor = executor
+        self.max_running = max_running
+        # How many workers can be busy before a job of each priority has to wait, with one worker per step down kept
+        # for the classes above it
+        self.limits = [max(1, max_running - p) for p in range(len(PRIORITY_NAMES))]
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._queued_jobs = {}  # future -> job, for everything that hasn't started yet
+
+        self.running = [0] * len(PRIORITY_NAMES)
+        self.queued = [0] * len(PRIORITY_NAMES)
+        self.completed = [0] * len(PRIORITY_NAMES)
+        self.preempted = 0
+
+    def submit(self, loop, func, priority=PRIORITY_INTERACTIVE):
+        """
+            Queues `func` to run in the executor.  Returns a future for its result.
+        """
+        job = _Job(priority, next(self._seq), func, loop)
+        job.future.add_done_callback(self._on_cancel)
+
+        self._queued_jobs[job.future] = job
+        self._push(job)
+        self._pump(loop)
+        return job.future
+
+    def promote(self, future, priority):
+        """
+            Moves a still queued job up to `priority`.  Does nothing if it's already running or more important.
+        """
+        job = self._queued_jobs.get(future)
+
+        if job and priority < job.priority:
+            self.queued[job.priority] -= 1
+            job.priority = priority
+            self._push(job)
+            self._pump(job.loop)
+
+    def _push(self, job):
+        self.queued[job.priority] += 1
+        # Promoted jobs leave their old heap item behind, _pump skips it since the priority doesn't match anymore
+        heapq.heappush(self._heap, (job.priority, job.seq, job))
+
+    def _on_cancel(self, future):
+        job = self._queued_jobs.pop(future, None)
+        if job:
+            self.queued[job.priority] -= 1
+
+    def _pump(self, loop):
+        while self._heap and sum(self.running) < self.max_running:
+            priority, seq, job = self._heap[0]
+
+            if job.future not in self._queued_jobs or priority != job.priority:
+                heapq.heappop(self._heap)
+                continue
+
+            # Everything after it in the heap is at least as unimportant, so it would have to wait too
+            if sum(self.running) >= self.limits[priority]:
+                break
+
+            heapq.heappop(self._heap)
+            del self._queued_jobs[job.future]
+            self.queued[priority] -= 1
+            self.running[priority] += 1
+
+            if any(self.queued[p] for p in range(priority + 1, len(PRIORITY_NAMES))):
+                # Something less important that was queued first is still waiting
+                self.preempted += 1
+
+            cfuture = loop.run_in_executor(self.executor, job.func)
+            cfuture.add_done_callback(functools.partial(self._on_done, loop, job))
+
+    def _on_done(self, loop, job, cfuture):
+        self.running[job.priority] -= 1
+        self.completed[job.priority] += 1
+
+        if not job.future.done():
+            if cfuture.cancelled():
+                job.future.cancel()
+            elif cfuture.exception():
+                job.future.set_exception(cfuture.exception())
+            else:
+                job.future.set_result(cfuture.result())
+
+        elif not cfuture.cancelled():
+            cfuture.exception()
+
+        self._pump(loop)
+
+    def stats(self):
+        """
+            Returns the queue depth, running and completed counts for each priority class.
+        """
+        return {
+            name: {'queued': self.queued[p], 'running': self.running[p], 'completed': self.completed[p]}
+            for p, name in enumerate(PRIORITY_NAMES)
+        }
+
+
+# Process pool workers keep their own ytdl objects around between calls, built from the params they're sent.
+_worker_ytdl = {}
+
+
+def _materialize(info):
+    """
+        Turns lazy playlist entries (generators, PagedLists) into plain lists so the info dict can be pickled.
+    """
+    if isinstance(info, dict):
+        entries = info.get('entries')
+
+        if entries is not None and not isinstance(entries, list):
+            if hasattr(entries, 'getslice'):
+                entries = entries.getslice()
+            info['entries'] = list(entries)
+
+        for value in info.values():
+            if isinstance(value, (dict, list)):
+                _materialize(value)
+
+    elif isinstance(info, list):
+        for value in info:
+            _materialize(value)
+
+    return info
+
+
+def _add_extractors(ytdl, extractors):
+    """
+        Puts extra InfoExtractor classes in front of ytdl's own, so they get a url before the generic extractor does.
+    """
+    for ie_class in reversed(extractors):
+        ytdl.add_info_extractor(ie_class())
+        ytdl._ies.insert(0, ytdl._ies.pop())
+
+
+def _thread_extract(ytdl, *args, **kwargs):
+    # Playlists come back as plain lists either way, so they can be counted, cached and read more than once
+    return _materialize(ytdl.extract_info(*args, **kwargs))
+
+
+def _worker_extract(params, extractors, *args, **kwargs):
+    """
+        Runs in a process pool worker.  `params` are the ytdl options, so warm instances are reused per option set.
+    """
+    key = repr((sorted(params.items()), extractors))
+    ytdl = _worker_ytdl.get(key)
+
+    if ytdl is None:
+        ytdl = _worker_ytdl[key] = youtube_dl.YoutubeDL(params)
+        _add_extractors(ytdl, extractors)
+
+    try:
+        return _materialize(ytdl.extract_info(*args, **kwargs))
+
+    except Exception as e:
+        # ytdl errors hold on to tracebacks, which can't be sent back to the bot process
+        raise youtube_dl.utils.DownloadError(str(e)) from None
+
+
 class Downloader:
-    def __init__(self, download_folder=None):
-        self.thread_pool = ThreadPoolExecutor(max_workers=2)
+    def __init__(self, download_folder=None, *, cache_folder=None, cache_size=32 * 1024 * 1024, workers=2, use_processes=False,
+                 extractors=()):
         self.unsafe_ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
         self.safe_ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
         self.safe_ytdl.params['ignoreerrors'] = True
+
+        # Extra InfoExtractor classes to try first (the benchmarks use this), they have to be picklable for processes
+        self.extractors = tuple(extractors)
+        _add_extractors(self.unsafe_ytdl, self.extractors)
+        _add_extractors(self.safe_ytdl, self.extractors)
         self.download_folder = download_folder
 
         if download_folder:
@@ -48,20 +549,119 @@ class Downloader:
             otmpl = self.safe_ytdl.params['outtmpl']
             self.safe_ytdl.params['outtmpl'] = os.path.join(download_folder, otmpl)
 
+        self.workers = workers
+        self.use_processes = use_processes
+
+        self.audio_cache = AudioCache(download_folder or os.curdir)
+
+        if use_processes:
+            # youtube_dl is a lot of pure python, so in processes it stops fighting the voice threads for the GIL
+            self.thread_pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.thread_pool = ThreadPoolExecutor(max_workers=workers)
+
+        self.scheduler = ExtractionScheduler(self.thread_pool, workers)
+        self.info_cache = InfoCache(cache_folder, cache_size) if cache_size else None
+        self._inflight = {}
+        self.coalesced = 0
+
+        if self.info_cache:
+            threading.Thread(target=self.info_cache.prune, daemon=True).start()
+
+    def _extract_func(self, ytdl, *args, **kwargs):
+        if self.use_processes:
+            return functools.partial(_worker_extract, dict(ytdl.params), self.extractors, *args, **kwargs)
+        else:
+            return functools.partial(_thread_extract, ytdl, *args, **kwargs)
+
+    def shutdown(self):
+        self.thread_pool.shutdown(wait=False)
 
     @property
     def ytdl(self):
         return self.safe_ytdl
 
-    async def extract_info(self, loop, *args, on_error=None, retry_on_error=False, **kwargs):
+    async def _cached_extract(self, loop, ytdl, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+            Runs `ytdl.extract_info` in the pool, answering from the info cache when possible.
+            Only metadata lookups (download=False) are cached, downloading always goes to ytdl.
+
+            Identical requests that come in while one is already running wait on that one instead of starting their own.
         """
-            Runs ytdl.extract_info within the threadpool. Returns a future that will fire when it's done.
+        func = self._extract_func(ytdl, *args, **kwargs)
+
+        if len(args) != 1 or not isinstance(args[0], str) or set(kwargs) - {'download', 'process'}:
+            return await self.scheduler.submit(loop, func, priority)
+
+        download = kwargs.get('download', True)
+        process = kwargs.get('process', True)
+        key = InfoCache.make_key(args[0], process)
+
+        if self.info_cache and not download:
+            info = self.info_cache.get(key)
+            if info is not None:
+                return info
+
+        flight_key = (ytdl is self.safe_ytdl, download, key)
+        flight = self._inflight.get(flight_key)
+
+        if flight is None:
+            flight = self._inflight[flight_key] = {'priority': priority, 'job': None}
+            flight['task'] = asyncio.ensure_future(self._extract(loop, func, None if download else key, flight), loop=loop)
+            flight['task'].add_done_callback(functools.partial(self._flight_done, flight_key))
+
+        else:
+            self.coalesced += 1
+
+            # Someone more important wants the same thing, it shouldn't wait behind the background queue
+            if priority < flight['priority']:
+                flight['priority'] = priority
+                if flight['job']:
+                    self.scheduler.promote(flight['job'], priority)
+
+        # Shielded so one impatient caller getting cancelled doesn't cancel it for everyone else
+        info = await asyncio.shield(flight['task'])
+
+        # Everyone waiting on a lookup gets their own copy, the same as a cache hit would
+        return info if download else slim_info(info)
+
+    async def _extract(self, loop, func, cache_key, flight):
+        if self.info_cache and cache_key:
+            item = await loop.run_in_executor(None, self.info_cache.load, cache_key)
+            if item:
+                self.info_cache.hits += 1
+                self.info_cache._remember(cache_key, item)
+                return item[1]
+
+            self.info_cache.misses += 1
+
+        flight['job'] = self.scheduler.submit(loop, func, flight['priority'])
+        info = await flight['job']
+
+        if self.info_cache and cache_key:
+            item = self.info_cache.put(cache_key, info)
+            if item:
+                loop.run_in_executor(None, self.info_cache.save, cache_key, item)
+
+        return info
+
+    def _flight_done(self, flight_key, task):
+        if self._inflight.get(flight_key, {}).get('task') is task:
+            del self._inflight[flight_key]
+
+        # If every waiter gave up, nobody is left to look at the error
+        if not task.cancelled():
+            task.exception()
+
+    async def extract_info(self, loop, *args, on_error=None, retry_on_error=False, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+            Runs ytdl.extract_info within the pool. Returns a future that will fire when it's done.
             If `on_error` is passed and an exception is raised, the exception will be caught and passed to
-            on_error as an argument.
+            on_error as an argument.  `priority` is one of the PRIORITY_* classes, see ExtractionScheduler.
         """
         if callable(on_error):
             try:
-                return await loop.run_in_executor(self.thread_pool, functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs))
+                return await self._cached_extract(loop, self.unsafe_ytdl, *args, priority=priority, **kwargs)
 
             except Exception as e:
 
@@ -77,9 +677,13 @@ class Downloader:
                     loop.call_soon_threadsafe(on_error, e)
 
                 if retry_on_error:
-                    return await self.safe_extract_info(loop, *args, **kwargs)
+                    return await self.safe_extract_info(loop, *args, priority=priority, **kwargs)
         else:
-            return await loop.run_in_executor(self.thread_pool, functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs))
+            return await self._cached_extract(loop, self.unsafe_ytdl, *args, priority=priority, **kwargs)
 
-    async def safe_extract_info(self, loop, *args, **kwargs):
-        return await loop.run_in_executor(self.thread_pool, functools.partial(self.safe_ytdl.extract_info, *args, **kwargs))
+    async def safe_extract_info(self, loop, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        return await self._cached_extract(loop, self.safe_ytdl, *args, priority=priority, **kwargs)
+
+    @property
+    def queue_depths(self):
+        return self.scheduler.stats()
@@ -1,11 +1,18 @@
 import asyncio
 import json
 import os
+import time
+import functools
 import traceback
 
+from . import loudness, opuscache
 from .exceptions import ExtractionError
+from .downloader import PRIORITY_PLAYBACK, PRIORITY_BACKGROUND, url_expiry
 from .utils import get_header, md5sum
 
+# ffmpeg can read these directly, anything else (dash segments, rtmp...) has to be downloaded first
+STREAMABLE_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')
+
 
 class BasePlaylistEntry:
     def __init__(self):
@@ -84,30 +91,138 @@ class URLPlaylistEntry(BasePlaylistEntry):
 
         self.download_folder = self.playlist.downloader.download_folder
 
+        self.stream_url = None
+        self.stream_headers = {}
+        self.stream_expires = 0
+
+    @property
+    def is_streamable(self):
+        # Leave a bit of room, ffmpeg needs to be able to reconnect with it for a while
+        return bool(self.stream_url) and self.stream_expires > time.time() + 60
+
+    @property
+    def playback_source(self):
+        """
+            What ffmpeg should read from: the cached file if it's downloaded, otherwise the stream url.
+        """
+        if self.is_downloaded:
+            return self.filename
+
+        return self.stream_url
+
+    def update_stream(self, info):
+        """
+            Remembers the media url from a processed info dict so playback can start before the download is done.
+        """
+        url = info.get('url')
+
+        if not url or info.get('protocol', 'http') not in STREAMABLE_PROTOCOLS:
+            return
+
+        self.stream_url = url
+        self.stream_headers = info.get('http_headers', {})
+        self.stream_expires = url_expiry(url) or time.time() + 60 * 30
+
+    async def resolve(self, priority=PRIORITY_PLAYBACK):
+        """
+            Looks the song up if it was queued from a playlist's song list, which doesn't say what file it'll be saved
+            as (see Playlist.fill_in).  Does nothing if it already knows.
+        """
+        if not self.expected_filename:
+            await self.playlist.fill_in(self, priority=priority)
+
+    async def get_playable(self):
+        """
+            Returns the entry as soon as it can start playing.  If the song isn't in the audio cache yet, this returns
+            once there's a fresh media url to stream from, and the download carries on in the background so the file
+            is there next time.  Falls back to waiting for the download if the song can't be streamed.
+        """
+        await self.resolve()
+
+        if not self.is_downloaded and not self._is_downloading:
+            self.filename = self._find_cached_file()
+
+        future = self.get_ready_future()
+        if future.done():
+            return future.result()
+
+        if not self.is_streamable:
+            try:
+                info = await self.playlist.downloader.extract_info(
+                    self.playlist.loop, self.url, download=False, priority=PRIORITY_PLAYBACK)
+                if info:
+                    self.update_stream(info)
+
+            except Exception:
+                print("[Stream] Could not get a stream url for %s, waiting for the download instead" % self.url)
+
+        if self.is_streamable and not future.done():
+            print("[Stream] Streaming while downloading:", self.url)
+            return self
+
+        return await future
+
+    def _find_cached_file(self):
+        """
+            Returns the path of this song in the audio cache, allowing for a different extension, or None.
+            The generic extractor needs a size check against the server, `_download` deals with that.
+        """
+        if not self.expected_filename:
+            return None
+
+        extractor = os.path.basename(self.expected_filename).split('-')[0]
+        if extractor == 'generic':
+            return None
+
+        filename = self.playlist.downloader.audio_cache.lookup(self.expected_filename)
+
+        if filename:
+            if filename.rsplit('.', 1)[-1] == self.expected_filename.rsplit('.', 1)[-1]:
+                print("[Download] Cached:", self.url)
+            else:
+                print("[Download] Cached (different extension):", self.url)
+                print("Expected %s, got %s" % (
+                    self.expected_filename.rsplit('.', 1)[-1],
+                    filename.rsplit('.', 1)[-1]
+                ))
+
+        return filename
+
     @classmethod
     def from_json(cls, playlist, jsonstring):
-        data = json.loads(jsonstring)
-        print(data)
+        return cls.from_dict(playlist, json.loads(jsonstring))
+
+    @classmethod
+    def from_dict(cls, playlist, data):
+        """
+            Makes an entry from what `to_dict` gave.  If the song is in the audio cache it's ready to play straight
+            away, otherwise it's downloaded again when it's needed.
+        """
         # TODO: version check
-        url = data['url']
-        title = data['title']
-        duration = data['duration']
-        downloaded = data['downloaded']
-        filename = data['filename'] if downloaded else None
         meta = {}
+        channel = None
 
         # TODO: Better [name] fallbacks
         if 'channel' in data['meta']:
-            ch = playlist.bot.get_channel(data['meta']['channel']['id'])
-            meta['channel'] = ch or data['meta']['channel']['name']
+            channel = meta['channel'] = playlist.bot.get_channel(data['meta']['channel']['id'])
 
         if 'author' in data['meta']:
-            meta['author'] = meta['channel'].server.get_member(data['meta']['author']['id'])
+            meta['author'] = channel.server.get_member(data['meta']['author']['id']) if channel else None
 
-        return cls(playlist, url, title, duration, filename, **meta)
+        entry = cls(playlist, data['url'], data['title'], data['duration'], data.get('expected_filename'), **meta)
+
+        name = data.get('filename') or entry.expected_filename
+        cached = name and playlist.downloader.audio_cache.lookup(name)
+        if cached:
+            entry.filename = cached
+
+        return entry
 
     def to_json(self):
-        data = {
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_dict(self):
+        return {
             'version': 1,
             'type': self.__class__.__name__,
             'url': self.url,
@@ -115,16 +230,16 @@ class URLPlaylistEntry(BasePlaylistEntry):
             'duration': self.duration,
             'downloaded': self.is_downloaded,
             'filename': self.filename,
+            'expected_filename': self.expected_filename,
             'meta': {
                 i: {
                     'type': self.meta[i].__class__.__name__,
                     'id': self.meta[i].id,
                     'name': self.meta[i].name
-                    } for i in self.meta
+                    } for i in self.meta if hasattr(self.meta[i], 'id')
                 }
             # Actually I think I can just getattr instead, getattr(discord, type)
         }
-        return json.dumps(data, indent=2)
 
     # noinspection PyTypeChecker
     async def _download(self):
@@ -133,6 +248,8 @@ class URLPlaylistEntry(BasePlaylistEntry):
 
         self._is_downloading = True
         try:
+            await self.resolve()
+
             # Ensure the folder that we're going to move into exists.
             if not os.path.exists(self.download_folder):
                 os.makedirs(self.download_folder)
@@ -143,20 +260,14 @@ class URLPlaylistEntry(BasePlaylistEntry):
             # the generic extractor requires special handling
             if extractor == 'generic':
                 # print("Handling generic")
-                flistdir = [f.rsplit('-', 1)[0] for f in os.listdir(self.download_folder)]
-                expected_fname_noex, fname_ex = os.path.basename(self.expected_filename).rsplit('.', 1)
+                lfile = self.playlist.downloader.audio_cache.lookup(self.expected_filename)
 
-                if expected_fname_noex in flistdir:
+                if lfile:
                     try:
                         rsize = int(await get_header(self.playlist.bot.aiosession, self.url, 'CONTENT-LENGTH'))
                     except:
                         rsize = 0
 
-                    lfile = os.path.join(
-                        self.download_folder,
-                        os.listdir(self.download_folder)[flistdir.index(expected_fname_noex)]
-                    )
-
                     # print("Resolved %s to %s" % (self.expected_filename, lfile))
                     lsize = os.path.getsize(lfile)
                     # print("Remote size: %s Local size: %s" % (rsize, lsize))
@@ -172,32 +283,17 @@ class URLPlaylistEntry(BasePlaylistEntry):
                     await self._really_download(hash=True)
 
             else:
-                ldir = os.listdir(self.download_folder)
-                flistdir = [f.rsplit('.', 1)[0] for f in ldir]
-                expected_fname_base = os.path.basename(self.expected_filename)
-                expected_fname_noex = expected_fname_base.rsplit('.', 1)[0]
-
-                # idk wtf this is but its probably legacy code
-                # or i have youtube to blame for changing shit again
-
-                if expected_fname_base in ldir:
-                    self.filename = os.path.join(self.download_folder, expected_fname_base)
-                    print("[Download] Cached:", self.url)
-
-                elif expected_fname_noex in flistdir:
-                    print("[Download] Cached (different extension):", self.url)
-                    self.filename = os.path.join(self.download_folder, ldir[flistdir.index(expected_fname_noex)])
-                    print("Expected %s, got %s" % (
-                        self.expected_filename.rsplit('.', 1)[-1],
-                        self.filename.rsplit('.', 1)[-1]
-                    ))
+                self.filename = self._find_cached_file()
 
-                else:
+                if not self.filename:
                     await self._really_download()
 
             # Trigger ready callbacks.
             self._for_each_future(lambda future: future.set_result(self))
 
+            # Nothing waits on these, the song can play while they run
+            asyncio.ensure_future(self._postprocess(self.filename), loop=self.playlist.loop)
+
         except Exception as e:
             traceback.print_exc()
             self._for_each_future(lambda future: future.set_exception(e))
@@ -210,7 +306,8 @@ class URLPlaylistEntry(BasePlaylistEntry):
         print("[Download] Started:", self.url)
 
         try:
-            result = await self.playlist.downloader.extract_info(self.playlist.loop, self.url, download=True)
+            result = await self.playlist.downloader.extract_info(
+                self.playlist.loop, self.url, download=True, priority=PRIORITY_PLAYBACK)
         except Exception as e:
             raise ExtractionError(e)
 
@@ -233,5 +330,65 @@ class URLPlaylistEntry(BasePlaylistEntry):
                 # Move the temporary file to it's final location.
                 os.rename(unhashed_fname, self.filename)
 
+        audio_cache = self.playlist.downloader.audio_cache
+        audio_cache.add(self.filename)
+        audio_cache.schedule_save(self.playlist.loop)
+
+    async def _postprocess(self, filename):
+        """
+            The background work on a downloaded song: measuring its loudness, then encoding it into the opus cache
+            with that correction applied.
+        """
+        config = self.playlist.bot.config
+
+        try:
+            if config.normalize_loudness:
+                await self._analyze_loudness(filename)
+
+            # Only worth it if the file is going to be kept around
+            if config.opus_cache and (config.save_videos or config.audio_cache_size):
+                record = self.playlist.downloader.audio_cache.record_for(filename)
+                normalization = loudness.gain_for(record, config.loudness_target) if config.normalize_loudness else 1.0
+
+                await opuscache.ensure_encoded(
+                    self.playlist.downloader, filename, config.default_volume, normalization, self.playlist.loop)
+
+        except Exception:
+            traceback.print_exc()
+
+    async def _analyze_loudness(self, filename):
+        """
+            Measures the song's loudness, once.  It's kept with the file in the audio cache, and used from the next
+            time the song starts playing.
+        """
+        audio_cache = self.playlist.downloader.audio_cache
+        record = audio_cache.record_for(filename) or audio_cache.add(filename)
+
+        if 'loudness' in record:
+            return
+
+        try:
+            result = await self.playlist.downloader.scheduler.submit(
+                self.playlist.loop, functools.partial(loudness.analyze, filename), PRIORITY_BACKGROUND)
+        except Exception as e:
+            print("[Loudness] Could not analyze %s: %s" % (filename, e))
+            return
+
+        # The file could've been evicted while it was being measured
+        record = audio_cache.record_for(filename)
+        if not record:
+            return
+
+        if result:
+            record['loudness'], record['peak'] = result
+            print("[Loudness] %s: %.1f LUFS, peak %.1f dBFS" % (os.path.basename(filename), *result))
+        else:
+            # Don't try again every time it comes around
+            record['loudness'] = None
+            print("[Loudness] Could not analyze", filename)
+
+        audio_cache.touch(filename)
+        audio_cache.schedule_save(self.playlist.loop)
+
 
 
@@ -0,0 +1,494 @@
+import random
+
+from collections import Counter, OrderedDict, deque
+
+# Emptied slots are compacted away once there's at least this many and they outnumber the entries
+COMPACT_MIN = 64
+
+
+class FenwickTree:
+    """
+        Prefix sums over a list of numbers that can be changed and appended to, each in O(log n).
+    """
+
+    def __init__(self, values=()):
+        self._tree = [0]  # 1-based, the first one isn't used
+        self._tree.extend(values)
+
+        # Each node passes its sum up to the next one that covers it, which builds the whole tree in O(n)
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def append(self, value):
+        i = len(self._tree)
+        # The node for i covers the values from i - lowbit(i) + 1 to i, the others of which are already in
+        self._tree.append(value + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def add(self, index, delta):
+        i = index + 1
+
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, count):
+        """
+            Returns the sum of the first `count` values.
+        """
+        total = 0
+
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+
+        return total
+
+    def search(self, target):
+        """
+            Returns the index of the value that makes the running sum reach `target`, if they're all 0 or above.
+        """
+        index = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+
+        while step:
+            nxt = index + step
+
+            if nxt < len(self._tree) and self._tree[nxt] < target:
+                index = nxt
+                target -= self._tree[nxt]
+
+            step >>= 1
+
+        return index
+
+
+class EntryQueue:
+    """
+        The playlist's queue.  It works like a deque of entries for what the playlist needs (append, popleft,
+        remove, indexing and iterating), but doesn't have to look through the whole queue to answer how many songs
+        someone has queued (kept count of as they come and go), where an entry is, or how long until a position is
+        reached.
+
+        Entries are kept in slots in the order they were added, and removing one just empties its slot.  Two Fenwick
+        trees over the slots, one counting entries and one adding up their durations, turn a slot into a position
+        or a position into a total duration in O(log n), and find the slot at a position the same way.  Emptied
+        slots are compacted away once they're over half of them, so that's O(1) per removal overall.
+    """
+
+    def __init__(self, entries=()):
+        self._rebuild(entries)
+
+    def _rebuild(self, entries):
+        self._slots = list(entries)  # The entry, or None once it's been removed
+        self._durations = [entry.duration or 0 for entry in self._slots]
+        self._slot_of = {entry: slot for slot, entry in enumerate(self._slots)}  # entry -> slot
+        self._head = 0  # No entries before this slot
+        self._counts = FenwickTree([1] * len(self._slots))
+        self._duration_sums = FenwickTree(self._durations)
+        self._authors = Counter(self._author(entry) for entry in self._slots)
+        self._len = len(self._slots)
+
+        if len(self._slot_of) != self._len:
+            raise ValueError('the same entry is in there twice')
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        # A copy, so the queue can change while it's being gone through
+        for entry in self._slots[self._head:]:
+            if entry is not None:
+                yield entry
+
+    def __contains__(self, entry):
+        return entry in self._slot_of
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+
+        if not 0 <= index < self._len:
+            raise IndexError('queue index out of range')
+
+        return self._slots[self._slot_at(index)]
+
+    def __repr__(self):
+        return '<EntryQueue of %s entries>' % self._len
+
+    def _slot_at(self, index):
+        if index == 0:
+            return self._head
+
+        return self._counts.search(index + 1)
+
+    @staticmethod
+    def _author(entry):
+        return entry.meta.get('author', None)
+
+    def append(self, entry):
+        if entry in self._slot_of:
+            raise ValueError('%r is already queued' % entry)
+
+        duration = entry.duration or 0
+
+        self._slot_of[entry] = len(self._slots)
+        self._slots.append(entry)
+        self._durations.append(duration)
+        self._counts.append(1)
+        self._duration_sums.append(duration)
+        self._authors[self._author(entry)] += 1
+        self._len += 1
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty queue')
+
+        entry = self._slots[self._head]
+        self._vacate(self._head)
+        return entry
+
+    def remove(self, entry):
+        slot = self._slot_of.get(entry)
+
+        if slot is None:
+            raise ValueError('%r is not in the queue' % entry)
+
+        self._vacate(slot)
+
+    def replace(self, old, new):
+        """
+            Puts `new` where `old` is.  It has to be by the same author and as long.
+        """
+        if new in self._slot_of:
+            raise ValueError('%r is already queued' % new)
+
+        slot = self._slot_of.pop(old, None)
+
+        if slot is None:
+            raise ValueError('%r is not in the queue' % old)
+
+        self._slots[slot] = new
+        self._slot_of[new] = slot
+
+    def duration_changed(self, entry):
+        """
+            Updates the totals for `entry`'s new duration, for a song that only found out how long it is once it was
+            looked up.
+        """
+        slot = self._slot_of.get(entry)
+
+        if slot is None:
+            raise ValueError('%r is not in the queue' % entry)
+
+        duration = entry.duration or 0
+        self._duration_sums.add(slot, duration - self._durations[slot])
+        self._durations[slot] = duration
+
+    def _vacate(self, slot):
+        entry = self._slots[slot]
+        author = self._author(entry)
+
+        self._slots[slot] = None
+        del self._slot_of[entry]
+
+        self._counts.add(slot, -1)
+        self._duration_sums.add(slot, -self._durations[slot])
+        self._len -= 1
+
+        self._authors[author] -= 1
+        if not self._authors[author]:
+            del self._authors[author]
+
+        if len(self._slots) >= COMPACT_MIN and self._len * 2 < len(self._slots):
+            self._rebuild(list(self))
+            return
+
+        while self._head < len(self._slots) and self._slots[self._head] is None:
+            self._head += 1
+
+    def clear(self):
+        self._rebuild(())
+
+    def shuffle(self):
+        entries = list(self)
+        random.shuffle(entries)
+        self._rebuild(entries)
+
+    def index(self, entry):
+        """
+            Returns where `entry` is in the queue, from 0.
+        """
+        slot = self._slot_of.get(entry)
+
+        if slot is None:
+            raise ValueError('%r is not in the queue' % entry)
+
+        return self._counts.prefix(slot)
+
+    def count_for(self, author):
+        """
+            Returns how many of the entries `author` queued.
+        """
+        return self._authors.get(author, 0)
+
+    def duration_before(self, position):
+        """
+            Returns the total duration of the first `position` entries.
+        """
+        if position <= 0:
+            return 0
+
+        if position >= self._len:
+            return self._duration_sums.prefix(len(self._slots))
+
+        return self._duration_sums.prefix(self._slot_at(position))
+
+
+class FairQueue:
+    """
+        The playlist's queue when FairQueue is on.  Every author gets a queue of their own, and the songs are taken
+        from them in turns: `weight(author)` songs from each author that has songs queued, then round again, so a
+        new song only ever has to wait for one round no matter how many songs anyone else has queued.  Someone
+        that queues a song when they had none left joins the end of the round that's going.
+
+        Each author's queue is an EntryQueue, and which of them is next is kept in an OrderedDict, so taking the
+        next song is O(1).  The whole order is never stored: the first `r` rounds take `min(len, r * weight)`
+        songs from each author, so a position is found by binary searching for its round, and turned into an entry
+        or a total duration with the author queues' own indexes.  That's O(authors * log^2 n).
+    """
+
+    def __init__(self, entries=(), weight=None):
+        self.weight = weight or (lambda author: 1)
+        self._rebuild(entries)
+
+    def _rebuild(self, entries):
+        self._queues = {}  # author -> EntryQueue
+        self._weights = {}  # author -> songs per turn
+        self._turns = OrderedDict()  # The authors with songs queued, in the order they get their turn
+        self._used = 0  # How many songs the first one's had this turn
+        self._len = 0
+
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        # A copy, so the queue can change while it's being gone through
+        pending = deque([list(self._queues[author]), 0, self._weights[author], self._weights[author] - shift]
+                        for author, shift in self._shifts())
+
+        while pending:
+            entries, start, weight, turn = pending.popleft()
+            yield from entries[start:start + turn]
+
+            if start + turn < len(entries):
+                pending.append([entries, start + turn, weight, weight])
+
+    def __contains__(self, entry):
+        queue = self._queues.get(EntryQueue._author(entry))
+        return queue is not None and entry in queue
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+
+        if not 0 <= index < self._len:
+            raise IndexError('queue index out of range')
+
+        if index == 0:
+            return self._queues[next(iter(self._turns))][0]
+
+        layout = self._layout()
+        rounds, index = self._locate(layout, index)
+
+        for queue, weight, shift in layout:
+            before = self._taken(queue, weight, shift, rounds)
+            turn = self._taken(queue, weight, shift, rounds + 1) - before
+
+            if index < turn:
+                return queue[before + index]
+
+            index -= turn
+
+    def __repr__(self):
+        return '<FairQueue of %s entries from %s authors>' % (self._len, len(self._queues))
+
+    def _shifts(self):
+        # Songs each author has already had this round, which is only ever the one whose turn it is
+        return [(author, self._used if not i else 0) for i, author in enumerate(self._turns)]
+
+    def _layout(self):
+        return [(self._queues[author], self._weights[author], shift) for author, shift in self._shifts()]
+
+    @staticmethod
+    def _taken(queue, weight, shift, rounds):
+        """
+            Returns how many of `queue`'s songs are played in the first `rounds` rounds.
+        """
+        return min(len(queue), max(0, rounds * weight - shift))
+
+    def _locate(self, layout, position):
+        """
+            Returns the round `position` is played in, and how many songs into that round it is.
+        """
+        low = 0
+        high = max((len(queue) + shift + weight - 1) // weight for queue, weight, shift in layout)
+
+        # The last round that starts at or before it
+        while low < high:
+            middle = (low + high + 1) // 2
+
+            if sum(self._taken(queue, weight, shift, middle) for queue, weight, shift in layout) <= position:
+                low = middle
+            else:
+                high = middle - 1
+
+        return low, position - sum(self._taken(queue, weight, shift, low) for queue, weight, shift in layout)
+
+    def append(self, entry):
+        if entry in self:
+            raise ValueError('%r is already queued' % entry)
+
+        author = EntryQueue._author(entry)
+        queue = self._queues.get(author)
+
+        if queue is None:
+            queue = self._queues[author] = EntryQueue()
+            self._weights[author] = max(1, self.weight(author))
+            self._turns[author] = None
+
+        queue.append(entry)
+        self._len += 1
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty queue')
+
+        author = next(iter(self._turns))
+        queue = self._queues[author]
+
+        entry = queue.popleft()
+        self._len -= 1
+        self._used += 1
+
+        if not queue:
+            self._drop(author)
+
+        elif self._used >= self._weights[author]:
+            self._turns.move_to_end(author)
+            self._used = 0
+
+        return entry
+
+    def remove(self, entry):
+        author = EntryQueue._author(entry)
+        queue = self._queues.get(author)
+
+        if queue is None:
+            raise ValueError('%r is not in the queue' % entry)
+
+        queue.remove(entry)
+        self._len -= 1
+
+        if not queue:
+            self._drop(author)
+
+    def replace(self, old, new):
+        """
+            Puts `new` where `old` is.  It has to be by the same author and as long.
+        """
+        queue = self._queues.get(EntryQueue._author(old))
+
+        if queue is None:
+            raise ValueError('%r is not in the queue' % old)
+
+        queue.replace(old, new)
+
+    def duration_changed(self, entry):
+        queue = self._queues.get(EntryQueue._author(entry))
+
+        if queue is None:
+            raise ValueError('%r is not in the queue' % entry)
+
+        queue.duration_changed(entry)
+
+    def _drop(self, author):
+        if author == next(iter(self._turns)):
+            self._used = 0
+
+        del self._queues[author]
+        del self._weights[author]
+        del self._turns[author]
+
+    def clear(self):
+        self._rebuild(())
+
+    def shuffle(self):
+        # The songs within each author's turns, and the order the turns go in
+        for queue in self._queues.values():
+            queue.shuffle()
+
+        authors = list(self._turns)
+        random.shuffle(authors)
+
+        self._turns = OrderedDict.fromkeys(authors)
+        self._used = 0
+
+    def index(self, entry):
+        """
+            Returns where `entry` is in the queue, from 0.
+        """
+        author = EntryQueue._author(entry)
+        queue = self._queues.get(author)
+
+        if queue is None:
+            raise ValueError('%r is not in the queue' % entry)
+
+        position = queue.index(entry)
+        layout = self._layout()
+        turn = list(self._turns).index(author)
+        rounds = (position + layout[turn][2]) // layout[turn][1]
+
+        # Their own songs before it, and everyone else's from the rounds before, and from this one if they go first
+        for i, (other, weight, shift) in enumerate(layout):
+            if i != turn:
+                position += self._taken(other, weight, shift, rounds + 1 if i < turn else rounds)
+
+        return position
+
+    def count_for(self, author):
+        """
+            Returns how many of the entries `author` queued.
+        """
+        queue = self._queues.get(author)
+        return len(queue) if queue else 0
+
+    def duration_before(self, position):
+        """
+            Returns the total duration of the first `position` entries.
+        """
+        if position <= 0:
+            return 0
+
+        if position >= self._len:
+            return sum(queue.duration_before(len(queue)) for queue in self._queues.values())
+
+        layout = self._layout()
+        rounds, position = self._locate(layout, position)
+        total = 0
+
+        for queue, weight, shift in layout:
+            before = self._taken(queue, weight, shift, rounds)
+            turn = min(position, self._taken(queue, weight, shift, rounds + 1) - before)
+
+            total += queue.duration_before(before + turn)
+            position -= turn
+
+        return total
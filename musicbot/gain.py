@@ -0,0 +1,198 @@
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import audioop
+except ImportError:  # Removed in python 3.13
+    audioop = None
+
+
+# ffmpeg gives us 20ms frames of 48kHz stereo s16le pcm
+CHANNELS = 2
+SAMPLE_MAX = 32767
+SAMPLE_MIN = -32768
+
+
+class GainStage:
+    """
+        Applies the volume to pcm frames.  Volume changes are ramped linearly over `ramp_frames` frames instead of
+        jumping, so they don't click.  Samples are saturated instead of wrapping around when they get too loud, and
+        with `limiter` on, peaks over `threshold` (a fraction of full scale) are softly squashed instead of clipped.
+
+        `normalization` is the song's loudness correction (see loudness.gain_for), it's multiplied into the volume.
+
+        This uses numpy when it's installed, otherwise audioop (or plain python when that's gone too), which steps
+        through the ramp a frame at a time and has no limiter.
+    """
+
+    def __init__(self, volume=1.0, *, normalization=1.0, max_gain=2.0, ramp_frames=5, limiter=False, threshold=0.8):
+        self.max_gain = max_gain
+        self.ramp_frames = max(1, ramp_frames)
+        self.limiter = limiter
+        self.threshold = threshold
+
+        self._volume = volume
+        self._normalization = normalization
+        self._gain = self._target = min(volume * normalization, max_gain)
+        self._step = 0.0
+        self.frames = 0
+
+        self._buffers = {}  # frame length -> scratch arrays, so there's no allocating per frame
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = value
+        self._retarget()
+
+    @property
+    def normalization(self):
+        return self._normalization
+
+    @normalization.setter
+    def normalization(self, value):
+        self._normalization = value
+        self._retarget()
+
+    def _retarget(self):
+        self._target = min(self._volume * self._normalization, self.max_gain)
+
+        if not self.frames:
+            # Nothing's been heard yet, so there's nothing to ramp from
+            self._gain = self._target
+
+        self._step = (self._target - self._gain) / self.ramp_frames
+
+    def _next_gain(self):
+        """
+            Returns the gain at the start and end of the next frame.
+        """
+        start = self._gain
+
+        if start != self._target:
+            end = start + self._step
+            if (self._step > 0 and end > self._target) or (self._step < 0 and end < self._target):
+                end = self._target
+            self._gain = end
+        else:
+            end = start
+
+        return start, end
+
+    def process(self, frame):
+        self.frames += 1
+        start, end = self._next_gain()
+
+        if start == end == 1 and not self.limiter:
+            return frame
+
+        if numpy is not None:
+            return self._process_numpy(frame, start, end)
+
+        return self._process_fallback(frame, end)
+
+    def _scratch(self, length):
+        buffers = self._buffers.get(length)
+
+        if buffers is None:
+            if len(self._buffers) > 4:
+                self._buffers.clear()
+
+            ramp = numpy.arange(length // CHANNELS, dtype=numpy.float32)
+            ramp /= max(1, len(ramp))
+
+            buffers = self._buffers[length] = (
+                numpy.empty(length, dtype=numpy.float32),
+                numpy.empty(length, dtype='<i2'),
+                ramp,
+                numpy.empty(len(ramp), dtype=numpy.float32),
+            )
+
+        return buffers
+
+    def _process_numpy(self, frame, start, end):
+        samples = numpy.frombuffer(frame, dtype='<i2')  # A view, the frame isn't copied
+        work, out, ramp, gains = self._scratch(len(samples))
+
+        if start == end:
+            numpy.multiply(samples, numpy.float32(start), out=work)
+
+        else:
+            numpy.multiply(ramp, numpy.float32(end - start), out=gains)
+            gains += numpy.float32(start)
+
+            frames = len(samples) // CHANNELS
+            numpy.multiply(samples[:frames * CHANNELS].reshape(frames, CHANNELS), gains[:, None],
+                           out=work[:frames * CHANNELS].reshape(frames, CHANNELS))
+            work[frames * CHANNELS:] = samples[frames * CHANNELS:] * end
+
+        if self.limiter:
+            self._limit(work)
+
+        numpy.clip(work, SAMPLE_MIN, SAMPLE_MAX, out=work)
+        numpy.copyto(out, work, casting='unsafe')
+        return out.tobytes()
+
+    def _limit(self, work):
+        """
+            Squashes everything over the threshold with a tanh curve, so it approaches full scale but never reaches it.
+        """
+        knee = self.threshold * SAMPLE_MAX
+        headroom = SAMPLE_MAX - knee
+
+        if headroom <= 0 or numpy.abs(work).max() <= knee:
+            return
+
+        over = numpy.abs(work) > knee
+        loud = work[over]
+        squashed = knee + headroom * numpy.tanh((numpy.abs(loud) - knee) / headroom)
+        work[over] = numpy.copysign(squashed, loud)
+
+    @staticmethod
+    def _process_fallback(frame, gain):
+        if audioop is not None:
+            return audioop.mul(frame, 2, gain)
+
+        samples = array('h', frame)
+
+        for i in range(len(samples)):
+            samples[i] = max(SAMPLE_MIN, min(SAMPLE_MAX, int(samples[i] * gain)))
+
+        return samples.tobytes()
+
+
+def crossfade(outgoing, incoming, start, end):
+    """
+        Mixes two s16le frames of the same length, fading `outgoing` out and `incoming` in.  `start` and `end` are
+        how far through the fade (0 to 1) the frame begins and ends.
+    """
+    if numpy is not None:
+        old = numpy.frombuffer(outgoing, dtype='<i2').reshape(-1, CHANNELS)
+        new = numpy.frombuffer(incoming, dtype='<i2').reshape(-1, CHANNELS)
+        fade = numpy.linspace(start, end, len(old), endpoint=False, dtype=numpy.float32)[:, None]
+
+        mixed = old * (1 - fade) + new * fade
+        numpy.clip(mixed, SAMPLE_MIN, SAMPLE_MAX, out=mixed)
+        return mixed.astype('<i2').tobytes()
+
+    # A frame is short enough that one step per frame doesn't click
+    middle = (start + end) / 2
+
+    if audioop is not None:
+        return audioop.add(audioop.mul(outgoing, 2, 1 - middle), audioop.mul(incoming, 2, middle), 2)
+
+    old = array('h', outgoing)
+    new = array('h', incoming)
+
+    for i in range(len(old)):
+        old[i] = max(SAMPLE_MIN, min(SAMPLE_MAX, int(old[i] * (1 - middle) + new[i] * middle)))
+
+    return old.tobytes()
+
@@ -0,0 +1,148 @@
+import time
+import threading
+
+FRAME_LENGTH = 0.02  # Seconds of audio in a frame
+
+# How long the first read waits for the buffer to fill before it gives up and plays silence
+START_TIMEOUT = 10
+
+# The reader waiting this long (in seconds) for room counts as an overrun.  It's normally a frame, sometimes two
+# when a player starts up.
+OVERRUN_WAIT = 0.1
+
+
+class JitterBuffer:
+    """
+        A fixed size ring of pcm frames between ffmpeg and the voice thread.  A reader thread keeps it topped up from
+        `source` (ffmpeg's stdout), up to `frames` frames ahead, so a slow disk, a busy cpu or a long GC pause on our
+        side don't hold up sending.  Reading never blocks on io: when the ring is empty `read` returns None and the
+        voice thread plays silence instead (an underrun).
+
+        The ring is allocated once and ffmpeg's output is read straight into it.  Underruns, overruns (the reader
+        waiting a lot longer than a frame for room, which means the voice thread stalled) and the most frames ever
+        buffered are counted in `metrics` (a PlaybackMetrics), if there is one.
+    """
+
+    def __init__(self, source, frame_size, frames, *, metrics=None):
+        self.source = source
+        self.frame_size = frame_size
+        self.capacity = max(2, frames)
+        self.prefill = self.capacity // 2
+        self.metrics = metrics
+
+        self._ring = bytearray(self.capacity * frame_size)
+        self._view = memoryview(self._ring)
+        self._lengths = [0] * self.capacity  # Only the last frame can be short
+
+        self._head = 0  # Next slot to read
+        self._tail = 0  # Next slot to fill
+        self._count = 0
+        self._cond = threading.Condition()
+
+        self._started = False
+        self._eof = False
+        self._closed = False
+
+        self._reader = threading.Thread(target=self._fill, name='JitterBuffer', daemon=True)
+        self._reader.start()
+
+    def __len__(self):
+        return self._count
+
+    def _read_into(self, view):
+        filled = 0
+
+        while filled < len(view):
+            got = self.source.readinto(view[filled:])
+            if not got:
+                break
+            filled += got
+
+        return filled
+
+    def _fill(self):
+        frame_size = self.frame_size
+
+        try:
+            while True:
+                with self._cond:
+                    waited = None
+
+                    while self._count >= self.capacity and not self._closed:
+                        # Filling up before the song starts doesn't count
+                        if waited is None and self._started:
+                            waited = time.perf_counter()
+
+                        self._cond.wait()
+
+                    if self._closed:
+                        return
+
+                    if waited and time.perf_counter() - waited > OVERRUN_WAIT and self.metrics:
+                        self.metrics.overrun()
+
+                    slot = self._tail
+
+                # The slot isn't the consumer's until it's counted, so this happens outside the lock
+                length = self._read_into(self._view[slot * frame_size:(slot + 1) * frame_size])
+
+                if length:
+                    with self._cond:
+                        self._lengths[slot] = length
+                        self._tail = (slot + 1) % self.capacity
+                        self._count += 1
+                        self._cond.notify_all()
+
+                        if self.metrics:
+                            self.metrics.buffered(self._count)
+
+                if length < frame_size:
+                    return
+
+        except (OSError, ValueError):
+            # The pipe was closed under us
+            pass
+
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    def read(self, frame_size):
+        """
+            Returns the next frame, b'' at the end, or None if the reader hasn't caught up.  The first read waits
+            for the ring to be half full, so songs don't start with an underrun.
+        """
+        with self._cond:
+            if not self._started:
+                self._started = True
+                self._cond.wait_for(lambda: self._count >= self.prefill or self._eof or self._closed, START_TIMEOUT)
+
+            if self._closed:
+                return b''
+
+            if not self._count:
+                if self._eof:
+                    return b''
+
+                if self.metrics:
+                    self.metrics.underrun(FRAME_LENGTH)
+                return None
+
+            slot = self._head
+            start = slot * self.frame_size
+            frame = bytes(self._view[start:start + self._lengths[slot]])
+
+            self._head = (slot + 1) % self.capacity
+            self._count -= 1
+            self._cond.notify_all()
+
+        return frame
+
+    def close(self):
+        """
+            Stops the reader.  Closing ffmpeg's pipe is still up to whoever owns it.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,131 @@
+import math
+
+from array import array
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SAMPLE_MAX = 32767
+SAMPLE_MIN = -32768
+
+
+def frame_levels(frame):
+    """
+        Returns the root mean square, the peak and the number of clipped (full scale) samples of an s16le frame.
+    """
+    if not frame:
+        return 0, 0, 0
+
+    if numpy is not None:
+        samples = numpy.frombuffer(frame, dtype='<i2')
+        high, low = int(samples.max()), int(samples.min())
+        peak = min(SAMPLE_MAX, max(high, -low))
+
+        clipped = 0
+        if high == SAMPLE_MAX or low == SAMPLE_MIN:
+            clipped = int(numpy.count_nonzero(samples == SAMPLE_MAX) + numpy.count_nonzero(samples == SAMPLE_MIN))
+
+        floats = samples.astype(numpy.float32)
+        return int(math.sqrt(float(numpy.dot(floats, floats)) / len(floats))), peak, clipped
+
+    samples = array('h', frame)
+    high, low = max(samples), min(samples)
+
+    return (int(math.sqrt(sum(s * s for s in samples) / len(samples))), min(SAMPLE_MAX, max(high, -low)),
+            samples.count(SAMPLE_MAX) + samples.count(SAMPLE_MIN))
+
+
+class SlidingMax:
+    """
+        The largest of the last `window` values, in O(1) per value.  It keeps a queue of the values that could still
+        be the max, which is always decreasing, so the front is the answer.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._queue = deque()  # (index, value)
+        self._index = 0
+
+    def push(self, value):
+        queue = self._queue
+
+        while queue and queue[-1][1] <= value:
+            queue.pop()
+
+        queue.append((self._index, value))
+
+        if queue[0][0] <= self._index - self.window:
+            queue.popleft()
+
+        self._index += 1
+
+    @property
+    def value(self):
+        return self._queue[0][1] if self._queue else 0
+
+    def clear(self):
+        self._queue.clear()
+
+
+class LevelMeter:
+    """
+        Keeps track of how loud a player is from the frames it sends: the last frame's RMS, the average RMS and the
+        highest RMS and peak over the last `window` frames (100 frames is 2 seconds), and how many samples have
+        clipped.  Updating it is O(1) per frame.  It's updated from the voice thread and anything can read the
+        attributes, or `snapshot()` for all of them at once.
+    """
+
+    def __init__(self, window=100):
+        self.window = window
+
+        self._rmss = deque(maxlen=window)
+        self._sum = 0
+        self._max_rms = SlidingMax(window)
+        self._max_peak = SlidingMax(window)
+
+        self.rms = 0
+        self.average = 0.0
+        self.max_rms = 0
+        self.peak = 0
+        self.clipped = 0
+
+    def update(self, frame):
+        rms, peak, clipped = frame_levels(frame)
+
+        if len(self._rmss) == self.window:
+            self._sum -= self._rmss[0]
+
+        self._rmss.append(rms)
+        self._sum += rms
+        self._max_rms.push(rms)
+        self._max_peak.push(peak)
+
+        self.rms = rms
+        self.average = self._sum / len(self._rmss)
+        self.max_rms = self._max_rms.value
+        self.peak = self._max_peak.value
+        self.clipped += clipped
+
+    def reset(self):
+        self._rmss.clear()
+        self._sum = 0
+        self._max_rms.clear()
+        self._max_peak.clear()
+
+        self.rms = self.max_rms = self.peak = self.clipped = 0
+        self.average = 0.0
+
+    def snapshot(self):
+        """
+            Returns the levels as a dict, as fractions of full scale, plus the clipped sample count.
+        """
+        return {
+            'rms': self.rms / SAMPLE_MAX,
+            'average': self.average / SAMPLE_MAX,
+            'max_rms': self.max_rms / SAMPLE_MAX,
+            'peak': self.peak / SAMPLE_MAX,
+            'clipped': self.clipped,
+        }
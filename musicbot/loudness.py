@@ -0,0 +1,50 @@
+import re
+import subprocess
+
+# Don't boost quiet songs by more than this (in dB), it mostly just brings up the noise
+MAX_BOOST = 12.0
+
+# Leave this much headroom (in dB) under full scale after normalizing
+PEAK_CEILING = -1.0
+
+_integrated_re = re.compile(r'^\s*I:\s+(-?[\d.]+) LUFS', re.MULTILINE)
+_peak_re = re.compile(r'^\s*Peak:\s+(-?[\d.]+|-inf) dBFS', re.MULTILINE)
+
+
+def analyze(filename, ffmpeg='ffmpeg'):
+    """
+        Measures the integrated loudness (LUFS) and true peak (dBFS) of a file with ffmpeg's ebur128 filter.
+        Returns them as a tuple, or None if ffmpeg couldn't do it.  This takes a few seconds per song, so run it
+        in the background.
+    """
+    try:
+        process = subprocess.run(
+            [ffmpeg, '-nostdin', '-hide_banner', '-i', filename, '-vn', '-af', 'ebur128=peak=true', '-f', 'null', '-'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=300)
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    output = process.stderr.decode('utf8', 'replace')
+
+    # The per frame log lines look the same, the summary is the last one
+    integrated = _integrated_re.findall(output)
+    peak = _peak_re.findall(output)
+
+    if process.returncode or not integrated:
+        return None
+
+    return float(integrated[-1]), float(peak[-1]) if peak else 0.0
+
+
+def gain_for(record, target):
+    """
+        Returns the volume multiplier that brings a song with the loudness in its audio cache `record` to `target`
+        LUFS, or 1.0 if it hasn't been measured.
+    """
+    if not record or record.get('loudness') is None:
+        return 1.0
+
+    gain = min(target - record['loudness'], MAX_BOOST)
+    gain = min(gain, PEAK_CEILING - record.get('peak', 0.0))
+
+    return 10 ** (gain / 20)
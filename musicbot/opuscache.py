@@ -0,0 +1,279 @@
+import os
+import mmap
+import time
+import struct
+import functools
+import subprocess
+import traceback
+
+from collections import deque
+from itertools import islice
+
+from discord.voice_client import StreamPlayer
+
+from .demux import ogg_opus_packets, opus_packets, opus_packet_duration, DemuxError
+from .downloader import PRIORITY_BACKGROUND
+
+# Pre-encoded songs go in this folder inside the audio cache, named after the song's file
+OPUS_FOLDER = '.opus'
+
+# Packet files are this header, then each packet as a little endian 2 byte length and the packet itself
+MAGIC = b'MBOPUS1\n'
+
+FRAME_LENGTH = 0.02  # Seconds of audio in each packet
+
+
+def encode(filename, out_path, gain=1.0, *, ffmpeg='ffmpeg', bitrate=128):
+    """
+        Encodes `filename` into an opus packet file at `out_path`, with `gain` applied.  Returns the number of
+        packets and the file's size, or None if ffmpeg failed.  This takes a while, so run it in the background.
+    """
+    args = [ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', filename, '-vn', '-map', '0:a:0',
+            '-af', 'volume=%.5f' % gain, '-ar', '48000', '-ac', '2',
+            '-c:a', 'libopus', '-b:a', '%sk' % bitrate, '-frame_duration', '20', '-application', 'audio',
+            '-f', 'ogg', 'pipe:1']
+
+    tmp_path = out_path + '.tmp'
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+
+    frames = 0
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+
+            for packet in ogg_opus_packets(process.stdout):
+                f.write(struct.pack('<H', len(packet)))
+                f.write(packet)
+                frames += 1
+
+        if process.wait() or not frames:
+            raise DemuxError("ffmpeg exited with %s" % process.returncode)
+
+        os.replace(tmp_path, out_path)
+        return frames, os.path.getsize(out_path)
+
+    except (OSError, DemuxError):
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+        return None
+
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+
+
+def is_current(record, volume, normalization):
+    """
+        Returns True if the song in `record` has a packet file encoded at this volume and normalization.
+    """
+    opus = record and record.get('opus')
+
+    return bool(opus) and abs(opus['volume'] - volume) < 1e-3 and abs(opus['normalization'] - normalization) < 1e-3
+
+
+_encoding = set()
+
+
+async def ensure_encoded(downloader, filename, volume, normalization, loop):
+    """
+        Encodes a downloaded song into the opus cache in the background, unless it's already there at this gain.
+    """
+    audio_cache = downloader.audio_cache
+    record = audio_cache.record_for(filename)
+
+    if not record or is_current(record, volume, normalization) or filename in _encoding:
+        return
+
+    name = os.path.join(OPUS_FOLDER, os.path.basename(filename).rsplit('.', 1)[0] + '.opus')
+    func = functools.partial(encode, filename, os.path.join(audio_cache.folder, name), volume * normalization)
+
+    _encoding.add(filename)
+    started = time.time()
+
+    try:
+        result = await downloader.scheduler.submit(loop, func, PRIORITY_BACKGROUND)
+    except Exception:
+        traceback.print_exc()
+        return
+    finally:
+        _encoding.discard(filename)
+
+    if not result:
+        print("[Opus] Could not encode", filename)
+        return
+
+    # The file could've been evicted while it was encoding
+    record = audio_cache.record_for(filename)
+    if not record:
+        return
+
+    frames, size = result
+    record['opus'] = {'name': name, 'size': size, 'frames': frames, 'volume': volume, 'normalization': normalization}
+    audio_cache.touch(filename)
+    audio_cache.schedule_save(loop)
+
+    print("[Opus] Encoded %s in %.1fs" % (os.path.basename(filename), time.time() - started))
+
+
+class OpusPacketReader:
+    """
+        Reads the packets out of a packet file, memory mapped so it doesn't need to be read into memory.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise DemuxError("%s is not an opus packet file" % path)
+
+        self._offset = len(MAGIC)
+        self.frame_count = 0
+
+    @property
+    def seconds_read(self):
+        return self.frame_count * FRAME_LENGTH
+
+    def skip(self, frames):
+        """
+            Skips ahead `frames` packets without reading them, for starting part way in.  They don't count
+            towards `frame_count`.
+        """
+        for _ in range(frames):
+            start = self._offset + 2
+            if start > len(self._map):
+                break
+
+            self._offset = start + struct.unpack_from('<H', self._map, self._offset)[0]
+
+    def read_packet(self):
+        """
+            Returns the next packet, or None at the end.
+        """
+        start = self._offset + 2
+        if start > len(self._map):
+            return None
+
+        size = struct.unpack_from('<H', self._map, self._offset)[0]
+        if start + size > len(self._map):
+            return None
+
+        self._offset = start + size
+        self.frame_count += 1
+        return self._map[start:start + size]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class PassthroughReader:
+    """
+        Reads the opus packets straight out of a downloaded webm or ogg file.  The first `probe` packets are checked
+        when it's opened, and they have to be 20ms long like the ones discord.py sends, otherwise it raises DemuxError.
+    """
+
+    def __init__(self, path, probe=50):
+        self._file = open(path, 'rb')
+
+        try:
+            self._packets = opus_packets(self._file)
+            self._buffered = deque(islice(self._packets, probe))
+
+            if not self._buffered:
+                raise DemuxError("No packets in %s" % path)
+
+            if any(opus_packet_duration(packet) != FRAME_LENGTH for packet in self._buffered):
+                raise DemuxError("%s doesn't use 20ms packets" % path)
+
+        except (DemuxError, IndexError) as e:
+            self._file.close()
+            raise DemuxError("Can't pass %s through: %s" % (os.path.basename(path), e))
+
+        self.frame_count = 0
+
+    @property
+    def seconds_read(self):
+        return self.frame_count * FRAME_LENGTH
+
+    def read_packet(self):
+        """
+            Returns the next packet, or None at the end.  A broken file just ends early.
+        """
+        try:
+            packet = self._buffered.popleft() if self._buffered else next(self._packets, None)
+        except (DemuxError, IndexError, OSError):
+            packet = None
+
+        if packet is not None:
+            self.frame_count += 1
+
+        return packet
+
+    def close(self):
+        self._file.close()
+
+
+class OpusPacketPlayer(StreamPlayer):
+    """
+        Plays opus packets from a reader (OpusPacketReader or PassthroughReader), sending them as they are,
+        so there's no ffmpeg or encoding involved.  The gain is whatever the packets were encoded at.
+    """
+
+    def __init__(self, reader, voice_client, after=None, *, metrics=None, **kwargs):
+        super().__init__(reader, voice_client.encoder, voice_client._connected, voice_client.play_audio, after, **kwargs)
+        self.metrics = metrics  # See player.PlaybackMetrics
+
+    def _do_run(self):
+        self.loops = 0
+        self._start = time.time()
+
+        while not self._end.is_set():
+            if not self._resumed.is_set():
+                self._resumed.wait()
+
+                # Stopped while paused
+                if self._end.is_set():
+                    break
+
+            if not self._connected.is_set():
+                self.stop()
+                break
+
+            self.loops += 1
+
+            started = time.perf_counter()
+            packet = self.buff.read_packet()
+
+            if self.metrics is not None and packet is not None:
+                self.metrics.frame(started, time.perf_counter())
+
+            if packet is None:
+                self.stop()
+                break
+
+            self.player(packet, encode=False)
+            next_time = self._start + self.delay * self.loops
+            time.sleep(max(0, self.delay + (next_time - time.time())))
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            self.buff.close()
@@ -20,6 +20,7 @@ class PermissionsDefaults:
 
     AllowPlaylists = True
     InstaSkip = False
+    QueueWeight = 1
 
 
 class Permissions:
@@ -101,6 +102,7 @@ class PermissionGroup:
 
         self.allow_playlists = section_data.get('AllowPlaylists', fallback=PermissionsDefaults.AllowPlaylists)
         self.instaskip = section_data.get('InstaSkip', fallback=PermissionsDefaults.InstaSkip)
+        self.queue_weight = section_data.get('QueueWeight', fallback=PermissionsDefaults.QueueWeight)
 
         self.validate()
 
@@ -143,6 +145,11 @@ class PermissionGroup:
             self.instaskip, PermissionsDefaults.InstaSkip
         )
 
+        try:
+            self.queue_weight = max(1, int(self.queue_weight))
+        except:
+            self.queue_weight = PermissionsDefaults.QueueWeight
+
 
     def add_user(self, uid):
         self.user_list.add(uid)
@@ -1,78 +1,213 @@
 import os
+import time
+import shlex
 import asyncio
-import audioop
+import threading
 import traceback
 
 from enum import Enum
-from array import array
 from collections import deque
-from shutil import get_terminal_size
 
+from . import loudness, opuscache
+from .decodehub import Subscription
+from .demux import DemuxError
+from .gain import GainStage, crossfade
+from .jitterbuffer import JitterBuffer
+from .levels import LevelMeter
 from .lib.event_emitter import EventEmitter
 
+# ffmpeg hands us 48kHz, 16 bit, stereo pcm
+PCM_BYTES_PER_SECOND = 48000 * 2 * 2
+FRAME_LENGTH = 0.02
+
+# The next song's player is set up this many seconds (plus the crossfade) before the current one ends,
+# with this many frames decoded ahead of time
+PREPARE_AHEAD = 5
+PREBUFFER_FRAMES = 50
+
+
+class PlaybackMetrics:
+    """
+        Counts how smoothly songs play: the silence between one song's last frame and the next one's first (gaps),
+        and the frames that weren't decoded in time (underruns), both in milliseconds.  Frames are timed as the voice
+        thread reads them.  With a JitterBuffer it counts its overruns and how full it's been too.
+    """
+
+    def __init__(self):
+        self.transitions = 0
+        self.gaps = 0
+        self.gap_ms = 0.0
+        self.max_gap_ms = 0.0
+        self.underruns = 0
+        self.underrun_ms = 0.0
+        self.overruns = 0
+        self.high_water = 0  # Most frames the jitter buffer has held
+
+        self._last_frame = None
+        self._starting = False
+        self._new_song = False
+
+    def starting(self, *, new_song=True):
+        """
+            Called right before a player starts, so waiting for its first frame isn't counted as an underrun.
+        """
+        self._starting = True
+        self._new_song = new_song
+
+    def frame(self, started, finished):
+        if self._starting:
+            self._starting = False
+
+            # Anything longer was a pause or an empty queue, not a gap
+            if self._new_song and self._last_frame is not None and finished - self._last_frame < 5:
+                gap_ms = max(0.0, finished - self._last_frame - FRAME_LENGTH) * 1000
+                self.transitions += 1
+                self.max_gap_ms = max(self.max_gap_ms, gap_ms)
+
+                if gap_ms >= 1:
+                    self.gaps += 1
+                    self.gap_ms += gap_ms
+
+        elif finished - started > FRAME_LENGTH:
+            self.underrun(finished - started - FRAME_LENGTH)
+
+        self._last_frame = finished
+
+    def underrun(self, seconds):
+        self.underruns += 1
+        self.underrun_ms += seconds * 1000
+
+    def overrun(self):
+        self.overruns += 1
+
+    def buffered(self, frames):
+        if frames > self.high_water:
+            self.high_water = frames
+
+    def __str__(self):
+        return '%s transitions, %s gaps (%.1fms total, %.1fms max), %s underruns (%.1fms total), ' \
+               '%s overruns, %s frames buffered at most' % (
+                   self.transitions, self.gaps, self.gap_ms, self.max_gap_ms, self.underruns, self.underrun_ms,
+                   self.overruns, self.high_water)
+
 
 class PatchedBuff:
     """
         PatchedBuff monkey patches a readable object, allowing you to vary what the volume is as the song is playing.
+
+        It can also read ahead (`prebuffer`) before the song starts, and fade into the next song (`crossfade_into`).
+        With a `meter` (a LevelMeter), the levels of what's sent are measured.
     """
 
-    def __init__(self, buff, *, draw=False):
+    def __init__(self, buff, *, volume=1.0, normalization=1.0, limiter=False, metrics=None, meter=None):
         self.buff = buff
         self.frame_count = 0
-        self.volume = 1.0
+        self.bytes_read = 0
+        self.gain = GainStage(volume, normalization=normalization, limiter=limiter)
+        self.metrics = metrics
 
-        self.draw = draw
-        self.use_audioop = True
-        self.frame_skip = 2
-        self.rmss = deque([2048], maxlen=90)
+        self._lock = threading.Lock()
+        self._prebuffered = deque()
+        self._ended = False
 
-    def __del__(self):
-        if self.draw:
-            print(' ' * (get_terminal_size().columns-1), end='\r')
+        self.incoming = None
+        self.fade_start = 0
+        self.fade_length = 0
 
-    def read(self, frame_size):
-        self.frame_count += 1
+        self.meter = meter
 
-        frame = self.buff.read(frame_size)
+    @property
+    def volume(self):
+        return self.gain.volume
 
-        if self.volume != 1:
-            frame = self._frame_vol(frame, self.volume, maxv=2)
+    @volume.setter
+    def volume(self, value):
+        self.gain.volume = value
 
-        if self.draw and not self.frame_count % self.frame_skip:
-            # these should be processed for every frame, but "overhead"
-            rms = audioop.rms(frame, 2)
-            self.rmss.append(rms)
+    @property
+    def seconds_read(self):
+        return self.bytes_read / PCM_BYTES_PER_SECOND
 
-            max_rms = sorted(self.rmss)[-1]
-            meter_text = 'avg rms: {:.2f}, max rms: {:.2f} '.format(self._avg(self.rmss), max_rms)
-            self._pprint_meter(rms / max(1, max_rms), text=meter_text, shift=True)
+    def prebuffer(self, frame_size, frames):
+        """
+            Reads up to `frames` frames ahead, so they're there the moment the song starts.  This blocks until ffmpeg
+            has decoded them, so run it in an executor.  A JitterBuffer already does this by itself.
+        """
+        if isinstance(self.buff, JitterBuffer):
+            return
 
-        return frame
+        with self._lock:
+            while len(self._prebuffered) < frames:
+                frame = self.buff.read(frame_size)
+                if frame:
+                    self._prebuffered.append(frame)
 
-    def _frame_vol(self, frame, mult, *, maxv=2, use_audioop=True):
-        if use_audioop:
-            return audioop.mul(frame, 2, min(mult, maxv))
-        else:
-            # ffmpeg returns s16le pcm frames.
-            frame_array = array('h', frame)
+                if len(frame) < frame_size:
+                    break
+
+    def crossfade_into(self, incoming, start, length):
+        """
+            Mixes in `incoming` (the next song's PatchedBuff) from `start` seconds in, over `length` seconds.  This
+            song ends when the fade does, and the next one carries on from where the fade left it.
+        """
+        self.fade_start = start
+        self.fade_length = length
+        self.incoming = incoming
 
-            for i in range(len(frame_array)):
-                frame_array[i] = int(frame_array[i] * min(mult, min(1, maxv)))
+    def _read(self, frame_size):
+        with self._lock:
+            frame = self._prebuffered.popleft() if self._prebuffered else self.buff.read(frame_size)
 
-            return frame_array.tobytes()
+        if frame is None:
+            # The jitter buffer ran dry, this keeps the voice thread going
+            return bytes(frame_size)
 
-    def _avg(self, i):
-        return sum(i) / len(i)
+        self.bytes_read += len(frame)
+        return self.gain.process(frame)
 
-    def _pprint_meter(self, perc, *, char='#', text='', shift=True):
-        tx, ty = get_terminal_size()
+    def close(self):
+        source = self.buff
 
-        if shift:
-            outstr = text + "{}".format(char * (int((tx - len(text)) * perc) - 1))
-        else:
-            outstr = text + "{}".format(char * (int(tx * perc) - 1))[len(text):]
+        if isinstance(source, JitterBuffer):
+            source.close()
+            source = source.source
+
+        if isinstance(source, Subscription):
+            source.close()
+
+    def read(self, frame_size):
+        if self._ended:
+            return b''
+
+        self.frame_count += 1
+
+        started = time.perf_counter()
+        frame = self._read(frame_size)
+
+        # The short one at the end isn't sent, so it doesn't count
+        if self.metrics is not None and len(frame) == frame_size:
+            self.metrics.frame(started, time.perf_counter())
+
+        incoming = self.incoming
+        if incoming is not None and self.seconds_read > self.fade_start:
+            frame = self._fade(incoming, frame, frame_size)
 
-        print(outstr.ljust(tx - 1), end='\r')
+        if self.meter is not None:
+            self.meter.update(frame)
+
+        return frame
+
+    def _fade(self, incoming, frame, frame_size):
+        end = min(1.0, (self.seconds_read - self.fade_start) / self.fade_length)
+        start = max(0.0, end - FRAME_LENGTH / self.fade_length)
+
+        # Whichever runs out first is padded with silence, the frame has to be whole or the player stops
+        if len(frame) < frame_size or end >= 1:
+            self._ended = True
+            frame = frame.ljust(frame_size, b'\0')
+
+        next_frame = incoming._read(frame_size).ljust(frame_size, b'\0')
+        return crossfade(frame, next_frame, start, end)
 
 
 class MusicPlayerState(Enum):
@@ -99,9 +234,15 @@ class MusicPlayer(EventEmitter):
         self._play_lock = asyncio.Lock()
         self._current_player = None
         self._current_entry = None
+        self._start_offset = 0  # Where in the song the current player started, after seeking
         self.state = MusicPlayerState.STOPPED
 
-        self.loop.create_task(self.websocket_check())
+        # The next song's player, set up ahead of time so it can start the moment this one ends
+        self._next = None  # (entry, player)
+        self._next_lock = threading.Lock()
+        self._prepare_handle = None
+        self.metrics = PlaybackMetrics()
+        self.levels = LevelMeter() if bot.config.level_meter else None  # How loud what's being sent is
 
     @property
     def volume(self):
@@ -110,18 +251,44 @@ class MusicPlayer(EventEmitter):
     @volume.setter
     def volume(self, value):
         self._volume = value
-        if self._current_player:
+
+        if isinstance(self._current_player, opuscache.OpusPacketPlayer):
+            # The packets have their volume baked in, so ffmpeg takes over from here
+            self._restart_current(self.position)
+
+        elif self._current_player:
             self._current_player.buff.volume = value
 
+        if self._next and isinstance(self._next[1].buff, PatchedBuff):
+            self._next[1].buff.volume = value
+
+        elif self._next:
+            self._discard_next()
+            self._prepare_next()
+
+    def current_levels(self):
+        """
+            Returns the levels of what's playing (see LevelMeter.snapshot), or None if the meter's off or the song
+            isn't being decoded, like pre-encoded opus, which goes out as it is.
+        """
+        if self.levels is None or not isinstance(getattr(self._current_player, 'buff', None), PatchedBuff):
+            return None
+
+        return self.levels.snapshot()
+
     def on_entry_added(self, playlist, entry):
         if self.is_stopped:
             self.loop.call_later(2, self.play)
 
+        elif playlist.peek() is entry:
+            self._prepare_next()
+
     def skip(self):
         self._kill_current_player()
 
     def stop(self):
         self.state = MusicPlayerState.STOPPED
+        self._discard_next()
         self._kill_current_player()
 
         self.emit('stop', player=self)
@@ -131,6 +298,7 @@ class MusicPlayer(EventEmitter):
             self._current_player.resume()
             self.state = MusicPlayerState.PLAYING
             self.emit('resume', player=self, entry=self.current_entry)
+            self._schedule_prepare()
             return
 
         if self.is_paused and not self._current_player:
@@ -159,8 +327,57 @@ class MusicPlayer(EventEmitter):
         self.state = MusicPlayerState.DEAD
         self.playlist.clear()
         self._events.clear()
+        self._discard_next()
         self._kill_current_player()
 
+    def _player_finished(self, player):
+        """
+            Called when a player ends, usually from the voice thread.  If the next song's player is set up it's
+            started right here, at the frame the last one would've sent next, and the loop catches up after.
+        """
+        if isinstance(player.buff, PatchedBuff):
+            player.buff.close()
+
+        with self._next_lock:
+            prepared, self._next = self._next, None
+
+        # Anything the loop owns is off limits here, the playlist keeps `upcoming` up to date for this
+        if prepared and self.is_playing and self.voice_client._connected.is_set() \
+                and self.playlist.upcoming is prepared[0]:
+            self.metrics.starting()
+            prepared[1].start()
+            self.loop.call_soon_threadsafe(self._handoff, prepared)
+            return
+
+        if prepared:
+            self.loop.call_soon_threadsafe(self._close_player, prepared[1])
+
+        self.loop.call_soon_threadsafe(self._playback_finished)
+
+    def _handoff(self, prepared):
+        entry, player = prepared
+        finished = self._current_entry
+
+        if self.is_stopped or self.is_dead:
+            # Stopped before the loop caught up
+            player.after = None
+            player.stop()
+
+            if isinstance(player.buff, PatchedBuff):
+                player.buff.close()
+            self._playback_finished()
+            return
+
+        self.playlist.take_next(entry)
+
+        self._current_player = player
+        self._current_entry = entry
+        self._start_offset = 0
+
+        self._finish_entry(finished)
+        self.emit('play', player=self, entry=entry)
+        self._schedule_prepare()
+
     def _playback_finished(self):
         entry = self._current_entry
 
@@ -173,7 +390,19 @@ class MusicPlayer(EventEmitter):
         if not self.is_stopped and not self.is_dead:
             self.play(_continue=True)
 
-        if not self.bot.config.save_videos and entry:
+        self._finish_entry(entry)
+
+    def _finish_entry(self, entry):
+        if self.bot.config.debug_mode:
+            print("[Debug] Playback:", self.metrics)
+
+        if entry and entry.is_downloaded:
+            # The eviction and the index saving go through the same records on the loop
+            self.loop.call_soon_threadsafe(self.bot.downloader.audio_cache.played, entry.filename)
+
+        # With a size limit the cache manager does the deleting
+        if not self.bot.config.save_videos and not self.bot.config.audio_cache_size and entry and entry.is_downloaded:
+            # If it was streamed and is still downloading, it stays in the cache until the next startup
             if any([entry.filename == e.filename for e in self.playlist.entries]):
                 print("[Config:SaveVideos] Skipping deletion, found song in queue")
 
@@ -201,6 +430,8 @@ class MusicPlayer(EventEmitter):
         for x in range(30):
             try:
                 os.unlink(filename)
+                self.bot.downloader.audio_cache.discard(filename)
+                self.bot.downloader.audio_cache.schedule_save(self.loop)
                 break
 
             except PermissionError as e:
@@ -231,7 +462,7 @@ class MusicPlayer(EventEmitter):
         with await self._play_lock:
             if self.is_stopped or _continue:
                 try:
-                    entry = await self.playlist.get_next_entry()
+                    entry = await self.playlist.get_next_entry(stream=self.bot.config.stream_while_downloading)
 
                 except Exception as e:
                     print("Failed to get entry.")
@@ -246,30 +477,286 @@ class MusicPlayer(EventEmitter):
                     return
 
                 # In-case there was a player, kill it. RIP.
+                self._discard_next()
                 self._kill_current_player()
 
-                self._current_player = self._monkeypatch_player(self.voice_client.create_ffmpeg_player(
-                    entry.filename,
-                    before_options="-nostdin",
-                    options="-vn -b:a 128k",
-                    # Threadsafe call soon, b/c after will be called from the voice playback thread.
-                    after=lambda: self.loop.call_soon_threadsafe(self._playback_finished)
-                ))
+                # Only the song that was playing when the queue was saved doesn't start at the beginning
+                position = self.playlist.start_position(entry)
+
+                self._current_player = self._create_player(entry, position)
                 self._current_player.setDaemon(True)
-                self._current_player.buff.volume = self.volume
+                self._start_offset = position
 
                 # I need to add ytdl hooks
                 self.state = MusicPlayerState.PLAYING
                 self._current_entry = entry
 
+                self.metrics.starting()
                 self._current_player.start()
                 self.emit('play', player=self, entry=entry)
+                self._schedule_prepare()
 
-    def _monkeypatch_player(self, player):
+    def _schedule_prepare(self):
+        """
+            Sets the next song up a little before the current one ends, see `_prepare_next`.
+        """
+        if self._prepare_handle:
+            self._prepare_handle.cancel()
+            self._prepare_handle = None
+
+        entry = self._current_entry
+        if not self.bot.config.gapless or not entry or not entry.duration:
+            return
+
+        delay = entry.duration - self.position - PREPARE_AHEAD - self.bot.config.crossfade
+        self._prepare_handle = self.loop.call_later(max(0, delay), self._prepare_next)
+
+    def _prepare_next(self):
+        """
+            Creates the next song's player and decodes its first frames, so `_player_finished` can start it without
+            a gap.  Only downloaded songs are set up, one that's still downloading gets another go when it's done.
+        """
+        current = self._current_player
+        current_entry = self._current_entry
+        entry = self.playlist.peek()
+
+        if not self.bot.config.gapless or not current or not current_entry or not current_entry.duration:
+            return
+
+        if self.is_stopped or self.is_dead or (self._next and self._next[0] is entry):
+            return
+
+        # Too early, the timer will be back (or resume will set it again)
+        if current_entry.duration - self.position > PREPARE_AHEAD + self.bot.config.crossfade + 1:
+            return
+
+        self._discard_next()
+
+        if not entry:
+            return
+
+        if not entry.is_downloaded:
+            future = entry.get_ready_future()
+            if not future.done():
+                future.add_done_callback(lambda _: self._prepare_next())
+            return
+
+        # Fading needs both songs as pcm
+        crossfade = self.bot.config.crossfade if isinstance(current.buff, PatchedBuff) else 0
+
+        try:
+            player = self._create_player(entry, pcm=bool(crossfade))
+        except Exception:
+            traceback.print_exc()
+            return
+
+        player.setDaemon(True)
+
+        with self._next_lock:
+            self._next = (entry, player)
+
+        if isinstance(player.buff, PatchedBuff):
+            self.loop.run_in_executor(None, player.buff.prebuffer, player.frame_size, PREBUFFER_FRAMES)
+
+            fade_start = current_entry.duration - crossfade - self._start_offset
+            if crossfade and current.buff.seconds_read < fade_start:
+                current.buff.crossfade_into(player.buff, fade_start, crossfade)
+
+    def _discard_next(self):
+        with self._next_lock:
+            prepared, self._next = self._next, None
+
+        if not prepared:
+            return
+
+        if self._current_player and getattr(self._current_player.buff, 'incoming', None) is prepared[1].buff:
+            self._current_player.buff.incoming = None
+
+        self._close_player(prepared[1])
+
+    @staticmethod
+    def _close_player(player):
+        """
+            Cleans up a player that was never started.
+        """
+        player.after = None
+
+        if isinstance(player, opuscache.OpusPacketPlayer):
+            player.buff.close()
+            return
+
+        player.buff.close()
+
+        # Shared decodes are closed with their buff, there's no process of our own
+        if not hasattr(player, 'process'):
+            return
+
+        try:
+            player.process.kill()
+            player.process.wait()
+        except OSError:
+            pass
+
+    def _create_player(self, entry, position=0, *, pcm=False):
+        """
+            Returns a player for `entry`, starting `position` seconds in.  That's its pre-encoded opus packets when
+            they're there and match the volume, otherwise ffmpeg (shared with other servers playing it, if that's
+            on).  With `pcm` it's always decoded, for mixing.
+        """
+        # Called from the voice playback thread, see _player_finished
+        after = self._player_finished
+
+        player = None
+        if not pcm:
+            player = self._opus_player(entry, after, position)
+
+        # Getting to the middle of a webm means demuxing everything before it, ffmpeg can do better
+        if not player and not position and not pcm:
+            player = self._passthrough_player(entry, after)
+
+        if player:
+            return player
+
+        if self.bot.config.shared_decoding and entry.is_downloaded:
+            subscription = self.bot.decode_hub.subscribe(entry.filename, position)
+            return self._monkeypatch_player(self.voice_client.create_stream_player(subscription, after=after), entry)
+
+        source, before_options = self._ffmpeg_input(entry)
+
+        if position:
+            before_options += " -ss %.2f" % position
+
+        return self._monkeypatch_player(self.voice_client.create_ffmpeg_player(
+            source,
+            before_options=before_options,
+            options="-vn -b:a 128k",
+            after=after
+        ), entry)
+
+    def _opus_player(self, entry, after, position=0):
+        if not self.bot.config.opus_cache or not entry.is_downloaded:
+            return None
+
+        audio_cache = self.bot.downloader.audio_cache
+        record = audio_cache.record_for(entry.filename)
+
+        if not opuscache.is_current(record, self.volume, self._normalization_for(entry)):
+            return None
+
+        try:
+            reader = opuscache.OpusPacketReader(os.path.join(audio_cache.folder, record['opus']['name']))
+        except (OSError, ValueError, DemuxError):
+            # Gone or broken, it'll be encoded again the next time it's downloaded
+            del record['opus']
+            audio_cache.touch(entry.filename)
+            return None
+
+        reader.skip(int(position / opuscache.FRAME_LENGTH))
+        return opuscache.OpusPacketPlayer(reader, self.voice_client, after=after, metrics=self.metrics)
+
+    def _passthrough_player(self, entry, after):
+        """
+            Returns a player that sends the opus packets in a downloaded webm/ogg file as they are, if nothing needs
+            to change them: the volume and loudness correction cancel out, and there's no limiter.
+        """
+        if not self.bot.config.opus_passthrough or self.bot.config.soft_limiter or not entry.is_downloaded:
+            return None
+
+        if abs(self.volume * self._normalization_for(entry) - 1) > 1e-3:
+            return None
+
+        if not entry.filename.endswith(('.webm', '.ogg', '.opus')):
+            return None
+
+        try:
+            reader = opuscache.PassthroughReader(entry.filename)
+        except (OSError, DemuxError) as e:
+            print("[Opus] Not passing through:", e)
+            return None
+
+        return opuscache.OpusPacketPlayer(reader, self.voice_client, after=after, metrics=self.metrics)
+
+    def seek(self, position):
+        """
+            Jumps to `position` seconds into the current song, from the downloaded file (or the stream) without
+            downloading anything again.  Returns False if nothing is playing.
+        """
+        if not self._current_player or not self._current_entry:
+            return False
+
+        duration = self._current_entry.duration
+        position = max(0, min(position, duration - 1 if duration else position))
+
+        self._restart_current(position)
+        self.emit('seek', player=self, entry=self._current_entry, position=position)
+        return True
+
+    def _restart_current(self, position):
+        """
+            Swaps the current song's player for a new one, carrying on from `position` seconds in.  This goes to
+            ffmpeg unless the song's opus packets can be used at the current volume.
+        """
+        old_player = self._current_player
+        old_player.after = None
+        old_player.stop()
+        old_player.resume()  # So the thread notices, if it was paused
+
+        if isinstance(old_player.buff, PatchedBuff):
+            old_player.buff.close()
+
+        # It might have been fading into the next song, that's set up again from the new position
+        self._discard_next()
+
+        self._current_player = self._create_player(self._current_entry, position)
+        self._current_player.setDaemon(True)
+        self._start_offset = position
+
+        if self.is_paused:
+            self._current_player.pause()
+
+        self.metrics.starting(new_song=False)
+        self._current_player.start()
+        self._schedule_prepare()
+
+    @staticmethod
+    def _ffmpeg_input(entry):
+        """
+            Returns what ffmpeg should play for `entry` and the options that go before it.
+        """
+        if entry.is_downloaded or not getattr(entry, 'stream_url', None):
+            return entry.filename, "-nostdin"
+
+        # Streaming while the download finishes, these keep ffmpeg going if the connection hiccups
+        before_options = "-nostdin -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+
+        if entry.stream_headers:
+            headers = ''.join('%s: %s\r\n' % (k, v) for k, v in entry.stream_headers.items())
+            before_options += " -headers " + shlex.quote(headers)
+
+        return entry.playback_source, before_options
+
+    def _monkeypatch_player(self, player, entry=None):
         original_buff = player.buff
-        player.buff = PatchedBuff(original_buff)
+
+        if self.bot.config.jitter_buffer:
+            original_buff = JitterBuffer(original_buff, player.frame_size, self.bot.config.jitter_buffer,
+                                         metrics=self.metrics)
+
+        player.buff = PatchedBuff(original_buff, volume=self.volume, normalization=self._normalization_for(entry),
+                                  limiter=self.bot.config.soft_limiter, metrics=self.metrics, meter=self.levels)
         return player
 
+    def _normalization_for(self, entry):
+        """
+            Returns the loudness correction for `entry`, measured in the background after it was downloaded.  Songs
+            that are still streaming or haven't been measured yet play as they are.
+        """
+        if not self.bot.config.normalize_loudness or not entry or not entry.is_downloaded:
+            return 1.0
+
+        record = self.bot.downloader.audio_cache.record_for(entry.filename)
+        return loudness.gain_for(record, self.bot.config.loudness_target)
+
     def reload_voice(self, voice_client):
         self.voice_client = voice_client
         if self._current_player:
@@ -277,21 +764,8 @@ class MusicPlayer(EventEmitter):
             self._current_player._resumed.clear()
             self._current_player._connected.set()
 
-    async def websocket_check(self):
-        if self.bot.config.debug_mode:
-            print("[Debug] Creating websocket check loop")
-
-        while not self.is_dead:
-            try:
-                self.voice_client.ws.ensure_open()
-                assert self.voice_client.ws.open
-            except:
-                if self.bot.config.debug_mode:
-                    print("[Debug] Voice websocket is %s, reconnecting" % self.voice_client.ws.state_name)
-                await self.bot.reconnect_voice_client(self.voice_client.channel.server)
-                await asyncio.sleep(4)
-            finally:
-                await asyncio.sleep(1)
+        if self._next:
+            self._next[1].player = voice_client.play_audio
 
     @property
     def current_entry(self):
@@ -313,13 +787,19 @@ class MusicPlayer(EventEmitter):
     def is_dead(self):
         return self.state == MusicPlayerState.DEAD
 
+    @property
+    def position(self):
+        """
+            How far into the current song playback is, in seconds, counted from the audio that's actually been read.
+        """
+        if not self._current_player:
+            return 0
+
+        return self._start_offset + self._current_player.buff.seconds_read
+
     @property
     def progress(self):
-        return round(self._current_player.buff.frame_count * 0.02)
-        # TODO: Properly implement this
-        #       Correct calculation should be bytes_read/192k
-        #       192k AKA sampleRate * (bitDepth / 8) * channelCount
-        #       Change frame_count to bytes_read in the PatchedBuff
+        return round(self.position)
 
 
 # if redistributing ffmpeg is an issue, it can be downloaded from here:
@@ -1,15 +1,111 @@
+import time
+import asyncio
 import datetime
-import traceback
-from collections import deque
-from itertools import islice
-from random import shuffle
 
 from .utils import get_header
 from .entry import URLPlaylistEntry
+from .entryqueue import EntryQueue, FairQueue
+from .predownload import Predownloader
+from .songrecords import SongRecords, QueuedSong
+from .downloader import PRIORITY_INTERACTIVE, PRIORITY_PLAYBACK, PRIORITY_BACKGROUND
 from .exceptions import ExtractionError, WrongEntryTypeError
 from .lib.event_emitter import EventEmitter
 
 
+class ImportProgress:
+    """
+        Keeps count of how a playlist import is going, so whoever started it can report on it.
+    """
+
+    def __init__(self, total=0):
+        self.total = total
+        self.processed = 0
+        self.added = 0
+        self.dropped = 0  # Over the max song length
+        self.failed = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def per_song(self):
+        return self.elapsed / max(1, self.processed)
+
+
+class PlaylistImport:
+    """
+        A playlist import running in the background.  Use `async for entry in it` to get the entries as they're
+        added to the playlist, or `await it.wait()` for all of them at once.  `progress` has the running totals.
+    """
+
+    def __init__(self, playlist, playlist_url, *, max_song_length=0, **meta):
+        self.playlist = playlist
+        self.playlist_url = playlist_url
+        self.max_song_length = max_song_length
+        self.meta = meta
+
+        self.progress = ImportProgress()
+        self.entries = []
+
+        self._added = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run(), loop=self.playlist.loop)
+        return self
+
+    def cancel(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        try:
+            songs = await self.playlist._get_songs(self.playlist_url)
+            await self.playlist._process_entries(
+                songs,
+                progress=self.progress,
+                max_song_length=self.max_song_length,
+                on_added=self._added.put_nowait,
+                **self.meta
+            )
+
+        except Exception as e:
+            self._added.put_nowait(e)
+
+        finally:
+            self._added.put_nowait(None)
+
+    def __aiter__(self):
+        return self.start()
+
+    async def __anext__(self):
+        item = await self._added.get()
+
+        if item is None:
+            # Put it back so asking again keeps saying we're done
+            self._added.put_nowait(None)
+            raise StopAsyncIteration
+
+        if isinstance(item, Exception):
+            raise item
+
+        self.entries.append(item)
+        return item
+
+    async def wait(self):
+        """
+            Waits for the whole import to finish and returns every entry that was added.
+        """
+        async for _ in self:
+            pass
+
+        return self.entries
+
+
 class Playlist(EventEmitter):
     """
         A playlist is manages the list of songs that will be played.
@@ -20,29 +116,149 @@ class Playlist(EventEmitter):
         self.bot = bot
         self.loop = bot.loop
         self.downloader = bot.downloader
-        self.entries = deque()
+        self.entries = self._make_queue()
+        self.records = SongRecords()
+        self.upcoming = None  # The next entry as of the last change, see _update_upcoming
+        self.journal = None
+        self.predownloader = Predownloader(self, bot.predownload_budget, bot.config.predownload_window)
+        self._resume = None  # (entry, seconds in)
 
     def __iter__(self):
         return iter(self.entries)
 
+    def _make_queue(self, entries=()):
+        if self.bot.config.fair_queue:
+            return FairQueue(entries, weight=self._queue_weight)
+
+        return EntryQueue(entries)
+
+    def _queue_weight(self, author):
+        # The autoplaylist's songs don't have one
+        if author is None:
+            return 1
+
+        return self.bot.permissions.for_user(author).queue_weight
+
     def shuffle(self):
-        shuffle(self.entries)
+        self.entries.shuffle()
+
+        if self.journal:
+            self.journal.shuffled(self.entries)
+
+        self._predownload_next()
 
     def clear(self):
         self.entries.clear()
+        self.records.clear()
+
+        if self.journal:
+            self.journal.cleared()
+
+        self._predownload_next()
 
-    async def add_entry(self, song_url, **meta):
+    def remove(self, entry):
+        self.entries.remove(entry)
+
+        if isinstance(entry, QueuedSong):
+            self.records.drop(entry)
+
+        if self.journal:
+            self.journal.removed(entry)
+
+        self._predownload_next()
+
+    def restore(self, journal):
+        """
+            Fills the playlist with the queue saved in `journal` (a QueueJournal), and keeps it saved there from now
+            on.  Returns how many songs were restored.
+        """
+        entries, position = journal.restore(lambda data: URLPlaylistEntry.from_dict(self, data))
+
+        self.entries = self._make_queue(entries)
+        self.records.clear()
+        self.journal = journal
+        self._update_upcoming()
+
+        if entries:
+            self._resume = (entries[0], position) if position else None
+            self._predownload_next()
+
+        return len(entries)
+
+    def start_position(self, entry):
+        """
+            Returns how far into `entry` to start playing it, which is only ever not 0 for the song that was playing
+            when the queue was saved.
+        """
+        if self._resume and self._resume[0] is entry:
+            position = self._resume[1]
+            self._resume = None
+            return position
+
+        return 0
+
+    async def add_entry(self, song_url, *, priority=PRIORITY_INTERACTIVE, **meta):
         """
             Validates and adds a song_url to be played. This does not start the download of the song.
 
             Returns the entry & the position it is in the queue.
 
             :param song_url: The song url to add to the playlist.
+            :param priority: How urgently the song info is needed, one of the downloader PRIORITY_* values.
             :param meta: Any additional metadata to add to the playlist entry.
         """
+        entry = await self._resolve_entry(song_url, priority=priority, **meta)
+        self._add_entry(entry)
+        return entry, self.entries.index(entry) + 1
+
+    async def _resolve_entry(self, song_url, *, priority=PRIORITY_INTERACTIVE, **meta):
+        """
+            Validates song_url and returns an entry for it, without adding it to the playlist.
+        """
+        info = await self._lookup(song_url, priority=priority)
+
+        entry = URLPlaylistEntry(
+            self,
+            song_url,
+            info.get('title', 'Untitled'),
+            info.get('duration', 0) or 0,
+            self.downloader.ytdl.prepare_filename(info),
+            **meta
+        )
+        entry.update_stream(info)
+        return entry
+
+    async def fill_in(self, entry, *, priority=PRIORITY_PLAYBACK):
+        """
+            Looks up an entry that was queued from a playlist's song list, which only has its url and title (and
+            sometimes its duration), and fills in the rest.  Raises ExtractionError if it can't be played, or it's
+            longer than its author is allowed.
+        """
+        info = await self._lookup(entry.url, priority=priority)
+        duration = info.get('duration', 0) or 0
+
+        author = entry.meta.get('author', None)
+        max_song_length = author and self.bot.permissions.for_user(author).max_song_length
+
+        if max_song_length and duration > max_song_length:
+            raise ExtractionError("Song duration exceeds limit (%s > %s)" % (duration, max_song_length))
 
+        entry.title = info.get('title', entry.title)
+        entry.expected_filename = self.downloader.ytdl.prepare_filename(info)
+        entry.update_stream(info)
+
+        if duration != entry.duration:
+            entry.duration = duration
+
+            if entry in self.entries:
+                self.entries.duration_changed(entry)
+
+    async def _lookup(self, song_url, *, priority=PRIORITY_INTERACTIVE):
+        """
+            Returns the info for song_url, making sure it's a song that can be played.
+        """
         try:
-            info = await self.downloader.extract_info(self.loop, song_url, download=False)
+            info = await self.downloader.extract_info(self.loop, song_url, download=False, priority=priority)
         except Exception as e:
             raise ExtractionError('Could not extract information from {}\n\n{}'.format(song_url, e))
 
@@ -73,177 +289,260 @@ class Playlist(EventEmitter):
                 elif not content_type.startswith(('audio/', 'video/')):
                     print("[Warning] Questionable content type \"%s\" for url %s" % (content_type, song_url))
 
-        entry = URLPlaylistEntry(
-            self,
-            song_url,
-            info.get('title', 'Untitled'),
-            info.get('duration', 0) or 0,
-            self.downloader.ytdl.prepare_filename(info),
-            **meta
-        )
-        self._add_entry(entry)
-        return entry, len(self.entries)
+        return info
 
-    async def import_from(self, playlist_url, **meta):
+    def import_from(self, playlist_url, *, max_song_length=0, **meta):
         """
-            Imports the songs from `playlist_url` and queues them to be played.
+            Imports the songs from `playlist_url` and queues them to be played, a few at a time and in order.
 
-            Returns a list of `entries` that have been enqueued.
+            Returns a PlaylistImport, which can be iterated over with `async for` to get each entry as it's
+            enqueued.  The first song is queued (and starts downloading) as soon as it's ready, while the rest
+            are still being looked up.
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param max_song_length: Songs longer than this (in seconds) are dropped instead of added, 0 for no limit
             :param meta: Any additional metadata to add to the playlist entry
         """
-        position = len(self.entries) + 1
-        entry_list = []
+        return PlaylistImport(self, playlist_url, max_song_length=max_song_length, **meta)
 
+    async def _get_songs(self, playlist_url):
+        """
+            Looks up `playlist_url` without processing it and returns a (url, title, duration) for each song in it,
+            or None for the broken ones.  That's all a playlist says about its songs, the title is the url if it
+            doesn't have one and the duration is 0 if it doesn't know.
+        """
         try:
-            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False)
+            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False, process=False)
         except Exception as e:
             raise ExtractionError('Could not extract information from {}\n\n{}'.format(playlist_url, e))
 
         if not info:
             raise ExtractionError('Could not extract information from %s' % playlist_url)
 
-        # Once again, the generic extractor fucks things up.
-        if info.get('extractor', None) == 'generic':
-            url_field = 'url'
-        else:
-            url_field = 'webpage_url'
+        songs = []
 
-        baditems = 0
-        for items in info['entries']:
-            if items:
-                try:
-                    entry = URLPlaylistEntry(
-                        self,
-                        items[url_field],
-                        items.get('title', 'Untitled'),
-                        items.get('duration', 0) or 0,
-                        self.downloader.ytdl.prepare_filename(items),
-                        **meta
-                    )
-
-                    self._add_entry(entry)
-                    entry_list.append(entry)
-                except:
-                    baditems += 1
-                    # Once I know more about what's happening here I can add a proper message
-                    traceback.print_exc()
-                    print(items)
-                    print("Could not add item")
+        for entry_data in info['entries']:
+            if not entry_data:
+                songs.append(None)
+                continue
+
+            if info.get('extractor', '').startswith('youtube'):
+                # Youtube playlists, searches and channels just give us the video ids
+                song_url = 'https://www.youtube.com/watch?v=%s' % entry_data['id']
             else:
-                baditems += 1
+                # soundcloud sets, bandcamp albums and most other things
+                song_url = entry_data.get('url') or entry_data.get('webpage_url')
 
-        if baditems:
-            print("Skipped %s bad entries" % baditems)
+            songs.append(song_url and (song_url, entry_data.get('title') or song_url, entry_data.get('duration') or 0))
 
-        return entry_list, position
+        return songs
 
-    async def async_process_youtube_playlist(self, playlist_url, **meta):
+    async def _process_entries(self, songs, *, progress=None, max_song_length=0, on_added=None, **meta):
         """
-            Processes youtube playlists links from `playlist_url` in a questionable, async fashion.
-
-            :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
-            :param meta: Any additional metadata to add to the playlist entry
+            Adds `songs` (what _get_songs gives) to the playlist in their original order.  The ones that will be
+            coming up soon are looked up first by a few workers (the PlaylistConcurrency option), the rest are
+            queued as they are until they get into the predownload window, see SongRecords.  `on_added` is called
+            with each entry right after it's added.  Returns the list of entries that were added.
         """
+        progress = progress or ImportProgress()
+        progress.total = len(songs)
 
-        try:
-            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False, process=False)
-        except Exception as e:
-            raise ExtractionError('Could not extract information from {}\n\n{}'.format(playlist_url, e))
+        pending = iter(enumerate(songs))
+        results = {}
+        looking_up = set()  # The ones being looked up or waiting to be added after
+        gooditems = []
+        next_index = 0
 
-        if not info:
-            raise ExtractionError('Could not extract information from %s' % playlist_url)
+        async def resolve(index, song):
+            nonlocal next_index
+            entry = None
 
-        gooditems = []
-        baditems = 0
-        for entry_data in info['entries']:
-            if entry_data:
-                baseurl = info['webpage_url'].split('playlist?list=')[0]
-                song_url = baseurl + 'watch?v=%s' % entry_data['id']
+            if song and len(self.entries) + len(looking_up) >= self.predownloader.window:
+                # It won't be coming up for a while, so it waits as it is
+                entry = song
+
+            elif song:
+                song_url = song[0]
+                looking_up.add(index)
 
                 try:
-                    entry, elen = await self.add_entry(song_url, **meta)
-                    gooditems.append(entry)
+                    # Nothing else can be queued until the first one is, and someone's waiting to hear it
+                    priority = PRIORITY_INTERACTIVE if index == 0 else PRIORITY_BACKGROUND
+                    entry = await self._resolve_entry(song_url, priority=priority, **meta)
                 except ExtractionError:
-                    baditems += 1
+                    pass
                 except Exception as e:
-                    baditems += 1
                     print("There was an error adding the song {}: {}: {}\n".format(
-                        entry_data['id'], e.__class__.__name__, e))
-            else:
-                baditems += 1
+                        song_url, e.__class__.__name__, e))
 
-        if baditems:
-            print("Skipped %s bad entries" % baditems)
+            progress.processed += 1
 
-        return gooditems
+            if not entry:
+                progress.failed += 1
 
-    async def async_process_sc_bc_playlist(self, playlist_url, **meta):
-        """
-            Processes soundcloud set and bancdamp album links from `playlist_url` in a questionable, async fashion.
+            elif max_song_length and (song[2] if entry is song else entry.duration) > max_song_length:
+                progress.dropped += 1
+                entry = None
 
-            :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
-            :param meta: Any additional metadata to add to the playlist entry
-        """
+            results[index] = entry
 
-        try:
-            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False, process=False)
-        except Exception as e:
-            raise ExtractionError('Could not extract information from {}\n\n{}'.format(playlist_url, e))
+            # Anything that finished early waits here until everything before it is in
+            while next_index in results:
+                entry = results.pop(next_index)
+                looking_up.discard(next_index)
+                next_index += 1
 
-        if not info:
-            raise ExtractionError('Could not extract information from %s' % playlist_url)
+                if entry:
+                    # Songs that won't be coming up for a while wait as records until they are, see SongRecords
+                    if isinstance(entry, tuple):
+                        entry = self.records.add(*entry, None, **meta)
 
-        gooditems = []
-        baditems = 0
-        for entry_data in info['entries']:
-            if entry_data:
-                song_url = entry_data['url']
+                    elif len(self.entries) >= self.predownloader.window:
+                        entry = self.records.store(entry)
 
-                try:
-                    entry, elen = await self.add_entry(song_url, **meta)
+                    entry = self._add_entry(entry)
                     gooditems.append(entry)
-                except ExtractionError:
-                    baditems += 1
-                except Exception as e:
-                    baditems += 1
-                    print("There was an error adding the song {}: {}: {}\n".format(
-                        entry_data['id'], e.__class__.__name__, e))
-            else:
-                baditems += 1
+                    progress.added += 1
+
+                    if on_added:
+                        on_added(entry)
+
+        async def worker():
+            # They all take the next song from the same iterator, so each song is only looked up once
+            for index, song in pending:
+                await resolve(index, song)
+
+        workers = min(self.bot.config.playlist_concurrency, len(songs))
+        tasks = [asyncio.ensure_future(worker(), loop=self.loop) for _ in range(workers)]
 
-        if baditems:
-            print("Skipped %s bad entries" % baditems)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            progress.finished = time.time()
+
+        if progress.failed:
+            print("Skipped %s bad entries" % progress.failed)
 
         return gooditems
 
     def _add_entry(self, entry):
+        """
+            Queues `entry`, and returns it, or the entry it was made into if it's a QueuedSong that's coming up.
+        """
         self.entries.append(entry)
-        self.emit('entry-added', playlist=self, entry=entry)
 
-        if self.peek() is entry:
-            entry.get_ready_future()
+        if self.journal:
+            self.journal.added(entry)
+
+        entry = self._materialize().get(entry, entry)
+        self._update_upcoming()
 
-    async def get_next_entry(self, predownload_next=True):
+        self.emit('entry-added', playlist=self, entry=entry)
+        self.predownloader.update()
+        return entry
+
+    async def get_next_entry(self, predownload_next=True, *, stream=False):
         """
             A coroutine which will return the next song or None if no songs left to play.
 
             Additionally, if predownload_next is set to True, it will attempt to download the next
-            song to be played - so that it's ready by the time we get to it.
+            songs to be played (see Predownloader) - so that they're ready by the time we get to them.
+
+            If stream is set to True, a song that isn't downloaded yet is returned as soon as it can be
+            streamed, see URLPlaylistEntry.get_playable.
         """
         if not self.entries:
             return None
 
+        self._materialize(1)
         entry = self.entries.popleft()
 
+        if self.journal:
+            self.journal.advanced(entry)
+
         if predownload_next:
-            next_entry = self.peek()
-            if next_entry:
-                next_entry.get_ready_future()
+            self._predownload_next()
+        else:
+            self._update_upcoming()
+
+        if stream and hasattr(entry, 'get_playable'):
+            return await entry.get_playable()
 
         return await entry.get_ready_future()
 
+    def take_next(self, entry, predownload_next=True):
+        """
+            Takes an entry that's already started playing off the playlist, like get_next_entry would have.
+        """
+        # Popping it counts as the author's turn, if the queue takes turns
+        if self.peek() is entry:
+            self.entries.popleft()
+
+        elif entry in self.entries:
+            self.entries.remove(entry)
+
+        else:
+            entry = None
+
+        if entry and self.journal:
+            self.journal.advanced(entry)
+
+        if predownload_next:
+            self._predownload_next()
+        else:
+            self._update_upcoming()
+
+    def _predownload_next(self):
+        self._materialize()
+        self._update_upcoming()
+        self.predownloader.update()
+
+    def _update_upcoming(self):
+        """
+            Notes down what's next in the queue, making it into an entry first if it's a QueuedSong so that peek never
+            has to.  The queue is only ever changed and looked through on the loop, so this is what the voice thread
+            checks a prepared song against instead (see MusicPlayer._player_finished).
+        """
+        self._materialize(1)
+        self.upcoming = self.entries[0] if self.entries else None
+
+    def _materialize(self, count=None):
+        """
+            Makes the QueuedSongs in the first `count` places (the predownload window by default) into entries.
+            Returns the ones it made, as {song: entry}.
+        """
+        made = {}
+
+        for i in range(min(len(self.entries), count or self.predownloader.window)):
+            song = self.entries[i]
+
+            if isinstance(song, QueuedSong):
+                entry = made[song] = song.materialize(self)
+                self.entries.replace(song, entry)
+                self.records.drop(song)
+
+                if self.journal:
+                    self.journal.replaced(song, entry)
+
+                # It's coming up, so find out now if it can't be played
+                if not entry.expected_filename:
+                    asyncio.ensure_future(self._look_up_queued(entry), loop=self.loop)
+
+        return made
+
+    async def _look_up_queued(self, entry):
+        try:
+            await entry.resolve(PRIORITY_BACKGROUND)
+
+        except Exception as e:
+            print("[Queue] Removing %s, it can't be played: %s" % (entry.url, e))
+
+            if entry in self.entries:
+                self.remove(entry)
+
     def peek(self):
         """
             Returns the next entry that should be scheduled to be played.
@@ -255,7 +554,7 @@ class Playlist(EventEmitter):
         """
             (very) Roughly estimates the time till the queue will 'position'
         """
-        estimated_time = sum([e.duration for e in islice(self.entries, position - 1)])
+        estimated_time = self.entries.duration_before(position - 1)
 
         # When the player plays a song, it eats the first playlist item, so we just have to add the time back
         if not player.is_stopped and player.current_entry:
@@ -264,6 +563,6 @@ class Playlist(EventEmitter):
         return datetime.timedelta(seconds=estimated_time)
 
     def count_for_user(self, user):
-        return sum(1 for e in self.entries if e.meta.get('author', None) == user)
+        return self.entries.count_for(user)
 
 
@@ -0,0 +1,162 @@
+import time
+import asyncio
+
+# Until a download has been timed, songs are guessed to download this many times faster than they play
+DEFAULT_SPEED = 20
+
+# How much each new download counts towards the average speed
+SMOOTHING = 0.3
+
+# Songs that are ready quicker than this were already cached, they don't say anything about download speed
+CACHE_HIT_TIME = 0.25
+
+# Downloads are planned as if they'll take this much longer than the average says
+SAFETY = 1.5
+
+# How long a song without a duration (a live stream, say) is expected to take
+UNKNOWN_DOWNLOAD_TIME = 10
+
+
+class Predownloader:
+    """
+        Keeps the next few songs in a playlist downloaded.  The next one always starts downloading straight away,
+        the ones after it start as soon as waiting any longer could leave the player waiting on them: when everything
+        up to them would take longer to download (going by how fast this playlist's downloads have been) than there's
+        left to play before them.  That's up to `window` songs ahead.
+
+        Those extra downloads share `budget`, a semaphore shared by every server, so one big queue can't hog the
+        downloader.  The ones still waiting for their turn are cancelled when their song is removed, cleared or
+        shuffled out of the window.  One that's already started is left to finish, the file's cached either way.
+    """
+
+    def __init__(self, playlist, budget=None, window=5):
+        self.playlist = playlist
+        self.budget = budget
+        self.window = window
+        self.player = None
+
+        self.speed = DEFAULT_SPEED  # Seconds of audio downloaded per second
+        self.timed = 0
+        self.cancelled = 0
+
+        self._head = None  # (entry, future) for the next song
+        self._tasks = {}  # entry -> task, for the songs after it
+        self._started = set()  # The ones that got through the budget
+        self._recheck = None  # Timer for when another song will be due to start downloading
+
+    def attach(self, player):
+        """
+            Takes how much is left of `player`'s current song into account, and looks again when it changes song,
+            pauses, resumes or seeks.
+        """
+        self.player = player
+
+        for event in ('play', 'pause', 'resume', 'seek'):
+            player.on(event, lambda **_: self.update())
+
+        return self
+
+    def _remaining(self):
+        entry = self.player and self.player.current_entry
+
+        if not entry or not entry.duration:
+            return 0
+
+        return max(0, entry.duration - self.player.position)
+
+    def _download_time(self, entry):
+        if not entry.duration:
+            return UNKNOWN_DOWNLOAD_TIME
+
+        return entry.duration / self.speed
+
+    def wanted(self):
+        """
+            Returns the upcoming entries that should be downloading by now.
+        """
+        return self._plan()[0]
+
+    def _plan(self):
+        # Also works out how much more of the current song can play before another one's wanted (None if never)
+        entries = self.playlist.entries
+        wanted = []
+        due = None
+
+        until = self._remaining()  # Until song `i` starts
+        needed = 0  # To download everything up to it that isn't yet
+
+        for i in range(min(len(entries), self.window if self.budget else 1)):
+            entry = entries[i]
+
+            if not entry.is_downloaded:
+                needed += self._download_time(entry) * SAFETY
+
+                if not i or needed >= until:
+                    wanted.append(entry)
+                elif due is None or until - needed < due:
+                    due = until - needed
+
+            until += entry.duration or 0
+
+        return wanted, due
+
+    def update(self):
+        wanted, due = self._plan()
+
+        if self._recheck:
+            self._recheck.cancel()
+            self._recheck = None
+
+        # Only playing counts the time down
+        if due is not None and self.player and self.player.is_playing:
+            self._recheck = self.playlist.loop.call_later(due, self.update)
+
+        for entry, task in list(self._tasks.items()):
+            if entry not in wanted and entry not in self._started:
+                del self._tasks[entry]
+                task.cancel()
+                self.cancelled += 1
+
+        head = self.playlist.peek()
+
+        for entry in wanted:
+            if entry is head:
+                if not self._head or self._head[0] is not entry:
+                    self._head = (entry, self._timed(entry))
+
+            elif entry not in self._tasks:
+                task = self._tasks[entry] = asyncio.ensure_future(self._fetch(entry), loop=self.playlist.loop)
+                task.add_done_callback(lambda task, entry=entry: self._fetched(entry, task))
+
+    def _timed(self, entry):
+        started = time.time()
+        future = entry.get_ready_future()
+
+        def done(future):
+            if not future.cancelled() and not future.exception():
+                self._measure(entry, time.time() - started)
+
+        future.add_done_callback(done)
+        return future
+
+    async def _fetch(self, entry):
+        with await self.budget:
+            self._started.add(entry)
+
+            try:
+                await self._timed(entry)
+            except Exception:
+                pass  # The player finds out when it gets to it
+
+    def _fetched(self, entry, task):
+        self._started.discard(entry)
+
+        if self._tasks.get(entry) is task:
+            del self._tasks[entry]
+
+    def _measure(self, entry, elapsed):
+        if elapsed < CACHE_HIT_TIME or not entry.duration:
+            return
+
+        self.speed += (entry.duration / elapsed - self.speed) * SMOOTHING
+        self.timed += 1
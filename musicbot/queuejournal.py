@@ -0,0 +1,354 @@
+import os
+import json
+import threading
+import traceback
+
+from collections import OrderedDict
+
+JOURNAL_VERSION = 1
+
+# Changes are written this long after the first one, all at once
+FLUSH_DELAY = 1
+
+# The journal is compacted into a new snapshot after this many changes
+SNAPSHOT_EVERY = 1000
+
+# While a song plays, where it's up to is noted down this often, so a crash doesn't start it over
+POSITION_EVERY = 5
+
+
+class QueueJournal:
+    """
+        Keeps one server's queue on disk, so it survives restarts and crashes.  Every change to the queue is appended
+        to `journal.jsonl` in the server's folder as one line of json (add, remove, shuffle, clear and advance, plus
+        where the current song had got to when it was paused or seeked), and every SNAPSHOT_EVERY changes the whole
+        queue is written to `snapshot.json` and the journal starts over.  While a song plays, its position is
+        noted every POSITION_EVERY seconds too.
+
+        Changes are batched and written (and fsynced) from an executor, so the event loop never waits on the disk.
+        Each line is numbered, and loading skips the ones already in the snapshot and stops at a torn last line,
+        so a crash halfway through a write loses at most that batch.
+
+        The journal keeps its own copy of the queue as entry dicts (see URLPlaylistEntry.to_dict), so it can write
+        a snapshot without going back to the playlist.
+    """
+
+    def __init__(self, folder, loop):
+        self.folder = folder
+        self.loop = loop
+        self.snapshot_path = os.path.join(folder, 'snapshot.json')
+        self.journal_path = os.path.join(folder, 'journal.jsonl')
+
+        self.queue = OrderedDict()  # id -> entry dict
+        self.current = None  # [id, entry dict, position]
+
+        self._ids = {}  # entry -> id, for the queued ones
+        self._current_entry = None
+        self._player = None
+        self._position_handle = None
+        self._next_id = 0
+        self._seq = 0
+        self._since_snapshot = 0
+
+        self._pending = []
+        self._flush_handle = None
+        self._writing = False
+        self._write_lock = threading.Lock()
+        self._written_snapshot = 0
+        self._closed = False
+
+        self.load()
+
+    def load(self):
+        """
+            Reads the snapshot and replays the journal after it.
+        """
+        self.queue.clear()
+        self.current = None
+
+        try:
+            with open(self.snapshot_path, encoding='utf8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            snapshot = None
+        except (OSError, ValueError):
+            print("[Queue] The saved queue in %s is broken, starting over" % self.folder)
+            snapshot = None
+
+        if snapshot and snapshot.get('version') == JOURNAL_VERSION:
+            self._seq = self._written_snapshot = snapshot['seq']
+            self._next_id = snapshot['next_id']
+            self.queue.update((item['id'], item['entry']) for item in snapshot['queue'])
+            self.current = snapshot['current']
+
+        try:
+            with open(self.journal_path, encoding='utf8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Only the last write can have been cut off
+                        break
+
+                    if record['seq'] > self._seq:
+                        self._apply(record)
+                        self._seq = record['seq']
+                        self._since_snapshot += 1
+
+        except FileNotFoundError:
+            pass
+
+        except OSError:
+            traceback.print_exc()
+
+    def _apply(self, record):
+        op = record['op']
+
+        if op == 'add':
+            self.queue[record['id']] = record['entry']
+            self._next_id = max(self._next_id, record['id'] + 1)
+
+        elif op == 'remove':
+            self.queue.pop(record['id'], None)
+
+        elif op == 'advance':
+            entry = self.queue.pop(record['id'], None)
+            self.current = [record['id'], entry, 0] if entry else None
+
+        elif op == 'position':
+            if self.current and self.current[0] == record['id']:
+                self.current[2] = record['position']
+
+        elif op == 'finish':
+            if self.current and self.current[0] == record['id']:
+                self.current = None
+
+        elif op == 'shuffle':
+            self.queue = OrderedDict((i, self.queue[i]) for i in record['order'] if i in self.queue)
+
+        elif op == 'clear':
+            self.queue.clear()
+
+    def restore(self, make_entry):
+        """
+            Returns the saved queue as entries made by `make_entry(entry dict)`, with the song that was playing
+            first, and where in it to carry on from.  Songs that can't be made anymore are left out.
+        """
+        items = list(self.queue.items())
+        position = 0
+
+        if self.current and self.current[1]:
+            items.insert(0, (self.current[0], self.current[1]))
+            position = self.current[2]
+
+        entries = []
+        self._ids.clear()
+        self._current_entry = None
+
+        for item_id, data in items:
+            try:
+                entry = make_entry(data)
+            except Exception:
+                traceback.print_exc()
+                continue
+
+            entries.append(entry)
+            self._ids[entry] = item_id
+
+        # The song that was playing is back in the queue, it'll be advanced to again
+        self.queue = OrderedDict((self._ids[entry], entry.to_dict()) for entry in entries)
+        self.current = None
+        self._compact_soon()
+
+        if not entries or self._ids[entries[0]] != items[0][0]:
+            position = 0
+
+        return entries, position
+
+    def _record(self, op, **fields):
+        if self._closed:
+            return
+
+        self._seq += 1
+        fields.update(seq=self._seq, op=op)
+
+        self._apply(fields)
+        self._pending.append(json.dumps(fields))
+        self._since_snapshot += 1
+
+        if not self._flush_handle and not self._writing:
+            self._flush_handle = self.loop.call_later(FLUSH_DELAY, self._flush)
+
+    def added(self, entry):
+        item_id = self._ids[entry] = self._next_id
+        self._record('add', id=item_id, entry=entry.to_dict())
+
+    def removed(self, entry):
+        item_id = self._ids.pop(entry, None)
+
+        if item_id is not None:
+            self._record('remove', id=item_id)
+
+    def advanced(self, entry):
+        item_id = self._ids.pop(entry, None)
+
+        if item_id is not None:
+            self._current_entry = entry
+            self._record('advance', id=item_id)
+
+    def replaced(self, old, new):
+        # The same song, so nothing to write
+        if old in self._ids:
+            self._ids[new] = self._ids.pop(old)
+
+    def shuffled(self, entries):
+        self._record('shuffle', order=[self._ids[entry] for entry in entries if entry in self._ids])
+
+    def cleared(self):
+        self._ids.clear()
+        self._record('clear')
+
+    def position(self, entry, position):
+        if self.current and entry is self._current_entry:
+            self._record('position', id=self.current[0], position=round(position, 2))
+
+    def finished(self, entry):
+        # With gapless playback the next song has already been advanced to by now
+        if self.current and entry is self._current_entry:
+            self._current_entry = None
+            self._record('finish', id=self.current[0])
+
+    def attach(self, player):
+        """
+            Keeps track of where `player` is in the current song, for carrying on from there.
+        """
+        player.on('pause', lambda player, entry, **_: self.position(entry, player.position))
+        player.on('seek', lambda entry, position, **_: self.position(entry, position))
+        player.on('finished-playing', lambda entry, **_: self.finished(entry))
+        player.on('play', lambda **_: self._track_position())
+        player.on('resume', lambda **_: self._track_position())
+
+        self._player = player
+        return self
+
+    def _track_position(self):
+        if not self._position_handle and not self._closed:
+            self._position_handle = self.loop.call_later(POSITION_EVERY, self._save_position)
+
+    def _save_position(self):
+        # Goes out with the next flush, along with anything else that's changed
+        self._position_handle = None
+        player = self._player
+
+        if self._closed or not player or not player.is_playing:
+            return
+
+        self.position(player.current_entry, player.position)
+        self._track_position()
+
+    def _compact_soon(self):
+        self._since_snapshot = SNAPSHOT_EVERY
+
+        if not self._flush_handle and not self._writing:
+            self._flush_handle = self.loop.call_later(FLUSH_DELAY, self._flush)
+
+    def _snapshot(self):
+        return {
+            'version': JOURNAL_VERSION,
+            'seq': self._seq,
+            'next_id': self._next_id,
+            'queue': [{'id': item_id, 'entry': entry} for item_id, entry in self.queue.items()],
+            'current': self.current,
+        }
+
+    def _take_batch(self):
+        lines, self._pending = self._pending, []
+        snapshot = None
+
+        if self._since_snapshot >= SNAPSHOT_EVERY:
+            # Everything in the lines is in the snapshot too
+            snapshot = json.dumps(self._snapshot())
+            self._since_snapshot = 0
+
+        return lines, snapshot, self._seq
+
+    def _flush(self):
+        self._flush_handle = None
+
+        if self._closed or (not self._pending and self._since_snapshot < SNAPSHOT_EVERY):
+            return
+
+        self._writing = True
+        future = self.loop.run_in_executor(None, self._write, *self._take_batch())
+        future.add_done_callback(self._written)
+
+    def _written(self, future):
+        self._writing = False
+
+        if future.exception():
+            print("[Queue] Couldn't save the queue in %s: %s" % (self.folder, future.exception()))
+
+        if self._pending and not self._closed:
+            self._flush_handle = self.loop.call_later(FLUSH_DELAY, self._flush)
+
+    def _write(self, lines, snapshot, seq):
+        """
+            Appends `lines` to the journal, or replaces the snapshot and empties the journal.  This waits on the
+            disk, so it runs in an executor, except when closing.
+        """
+        with self._write_lock:
+            if snapshot is None and self._written_snapshot >= seq:
+                return
+
+            os.makedirs(self.folder, exist_ok=True)
+
+            if snapshot is not None:
+                # A late write from before the last snapshot mustn't replace it
+                if seq < self._written_snapshot:
+                    return
+
+                with open(self.snapshot_path + '.tmp', 'w', encoding='utf8') as f:
+                    f.write(snapshot)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+                self._written_snapshot = seq
+
+                # Lines from before it are skipped when loading, so a crash right here doesn't lose anything
+                with open(self.journal_path, 'w', encoding='utf8'):
+                    pass
+
+            elif lines:
+                with open(self.journal_path, 'a', encoding='utf8') as f:
+                    f.write('\n'.join(lines) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def close(self, player=None):
+        """
+            Writes a snapshot of the queue right now, with where `player` is in the current song, and stops writing.
+            Call it on the way out, before the player is killed (which clears the queue).
+        """
+        if self._closed:
+            return
+
+        if player and player.current_entry:
+            self.position(player.current_entry, player.position)
+
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._position_handle:
+            self._position_handle.cancel()
+            self._position_handle = None
+
+        self._since_snapshot = SNAPSHOT_EVERY
+        batch = self._take_batch()
+        self._closed = True
+
+        try:
+            self._write(*batch)
+        except OSError:
+            traceback.print_exc()
@@ -0,0 +1,212 @@
+from array import array
+
+from .entry import URLPlaylistEntry
+
+# Dropped rows are compacted away once there's at least this many rows and they're over half of them
+COMPACT_MIN = 64
+
+# The strings each row keeps in the text pool, in order
+URL, TITLE, EXPECTED_FILENAME = range(3)
+
+
+class QueuedSong:
+    """
+        A song from a playlist import that's queued but not coming up for a while.  It's only a row in its playlist's
+        SongRecords, and reads like an entry for what the queue and the commands look at (url, title, duration,
+        meta), but it can't be downloaded or played.  The playlist turns it into a URLPlaylistEntry when it gets into
+        the predownload window, see Playlist._materialize.
+
+        Most of them were never looked up, so all they know is what the playlist's song list said: the url, usually
+        the title, and sometimes the duration.  The entry they're made into looks up the rest.
+
+        Once it's been turned into an entry or taken out of the queue, its row is gone and it reads as empty.
+    """
+
+    __slots__ = ('records', 'row')
+
+    # It isn't downloaded until it's an entry
+    filename = None
+    is_downloaded = False
+
+    def __init__(self, records, row):
+        self.records = records
+        self.row = row
+
+    def __repr__(self):
+        return '<QueuedSong %r>' % (self.title if self.records is not None else None)
+
+    @property
+    def url(self):
+        return self.records.text(self.row, URL)
+
+    @property
+    def title(self):
+        return self.records.text(self.row, TITLE)
+
+    @property
+    def expected_filename(self):
+        return self.records.text(self.row, EXPECTED_FILENAME) or None
+
+    @property
+    def duration(self):
+        return self.records.duration(self.row)
+
+    @property
+    def meta(self):
+        if self.records is None:
+            return {}
+
+        return self.records.meta(self.row)
+
+    def materialize(self, playlist):
+        return URLPlaylistEntry(playlist, self.url, self.title, self.duration, self.expected_filename, **self.meta)
+
+    def to_dict(self):
+        meta = self.meta
+
+        # The same as the entry it'll be would give
+        return {
+            'version': 1,
+            'type': URLPlaylistEntry.__name__,
+            'url': self.url,
+            'title': self.title,
+            'duration': self.duration,
+            'downloaded': False,
+            'filename': None,
+            'expected_filename': self.expected_filename,
+            'meta': {
+                i: {
+                    'type': meta[i].__class__.__name__,
+                    'id': meta[i].id,
+                    'name': meta[i].name
+                    } for i in meta if hasattr(meta[i], 'id')
+                }
+        }
+
+
+class SongRecords:
+    """
+        Where a playlist keeps its QueuedSongs.  A URLPlaylistEntry is a couple of kilobytes once its dicts, stream
+        url and headers are counted, which adds up fast with a few 5000 song imports queued.  Here each song is a
+        row across a few arrays instead: where its url, title and expected filename start in one utf8 text pool
+        (and how long they are), its duration, and its channel and author as indexes into a table with one of each.
+        That's around 300 bytes a song, about half of it the text.
+
+        Rows are only ever added at the end.  Dropped ones are compacted away once they're over half of them, which
+        moves the rest to new rows, so a QueuedSong's row is only good until the next drop.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def clear(self):
+        for song in self._songs:
+            if song:
+                song.records = None
+
+        self._reset()
+
+    def _reset(self):
+        self._text = bytearray()
+        self._starts = array('Q')  # Where each row's strings start in _text
+        self._lengths = array('I')  # How long each of them is, three to a row
+        self._durations = array('d')
+        self._channels = array('I')  # Indexes into _interned
+        self._authors = array('I')
+
+        self._interned = [None]
+        self._intern_index = {None: 0}
+
+        self._songs = []  # The QueuedSong for each row, None once it's dropped
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def __repr__(self):
+        return '<SongRecords of %s songs in %s rows>' % (self._live, len(self._songs))
+
+    def add(self, url, title, duration, expected_filename, *, channel=None, author=None):
+        song = QueuedSong(self, len(self._songs))
+        self._append(url, title, duration, expected_filename, channel, author)
+        self._songs.append(song)
+        self._live += 1
+        return song
+
+    def store(self, entry):
+        """
+            Returns a QueuedSong with what `entry` would need to be made again.  The stream url isn't kept, it would
+            have expired by the time the song comes up anyway.
+        """
+        return self.add(entry.url, entry.title, entry.duration, entry.expected_filename, **entry.meta)
+
+    def _append(self, url, title, duration, expected_filename, channel, author):
+        self._starts.append(len(self._text))
+
+        for text in (url, title, expected_filename or ''):
+            data = text.encode('utf8')
+            self._text += data
+            self._lengths.append(len(data))
+
+        self._durations.append(duration or 0)
+        self._channels.append(self._intern(channel))
+        self._authors.append(self._intern(author))
+
+    def _intern(self, value):
+        index = self._intern_index.get(value)
+
+        if index is None:
+            index = self._intern_index[value] = len(self._interned)
+            self._interned.append(value)
+
+        return index
+
+    def text(self, row, field):
+        start = self._starts[row] + sum(self._lengths[row * 3:row * 3 + field])
+        return self._text[start:start + self._lengths[row * 3 + field]].decode('utf8')
+
+    def duration(self, row):
+        duration = self._durations[row]
+        return int(duration) if duration.is_integer() else duration
+
+    def meta(self, row):
+        meta = {}
+
+        for key, column in (('channel', self._channels), ('author', self._authors)):
+            value = self._interned[column[row]]
+            if value is not None:
+                meta[key] = value
+
+        return meta
+
+    def drop(self, song):
+        """
+            Forgets `song`, once it's been made into an entry or taken out of the queue.
+        """
+        if song.records is not self:
+            return
+
+        self._songs[song.row] = None
+        song.records = None
+        self._live -= 1
+
+        if not self._live:
+            self.clear()
+
+        elif len(self._songs) >= COMPACT_MIN and self._live * 2 < len(self._songs):
+            self._compact()
+
+    def _compact(self):
+        songs = [song for song in self._songs if song]
+        rows = [(song.url, song.title, song.duration, song.expected_filename,
+                 song.meta.get('channel'), song.meta.get('author')) for song in songs]
+
+        self._reset()
+
+        for row, (song, values) in enumerate(zip(songs, rows)):
+            self._append(*values)
+            song.records = self
+            song.row = row
+
+        self._songs = songs
+        self._live = len(songs)
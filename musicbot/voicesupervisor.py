@@ -0,0 +1,249 @@
+import math
+import random
+import asyncio
+import traceback
+
+# Reconnect delays double from RECONNECT_BASE up to RECONNECT_MAX seconds while reconnecting keeps failing
+RECONNECT_BASE = 1
+RECONNECT_MAX = 120
+
+# A connection that stayed up this long starts over from the shortest delay when it drops
+STABLE_AFTER = 60
+
+# How often to look at connections whose websocket can't tell us when it closes
+CHECK_INTERVAL = 5
+
+
+class WheelTimer:
+    def __init__(self, callback, args, rounds):
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+        A hashed timer wheel: timers are put in one of `slots` buckets by when they're due, and a single tick every
+        `resolution` seconds runs the bucket it's got to.  Everything shares that one tick, and it only runs while
+        something is scheduled, so it doesn't cost anything while all is well no matter how many servers there are.
+    """
+
+    def __init__(self, loop, *, resolution=0.5, slots=128):
+        self.loop = loop
+        self.resolution = resolution
+
+        self._slots = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._count = 0
+        self._tick_handle = None
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, delay, callback, *args):
+        """
+            Calls `callback(*args)` in about `delay` seconds (rounded up to the resolution).  Returns a timer that
+            can be cancelled.
+        """
+        ticks = max(1, math.ceil(delay / self.resolution))
+        timer = WheelTimer(callback, args, (ticks - 1) // len(self._slots))
+
+        self._slots[(self._cursor + ticks) % len(self._slots)].append(timer)
+        self._count += 1
+
+        if not self._tick_handle:
+            self._tick_handle = self.loop.call_later(self.resolution, self._tick)
+
+        return timer
+
+    def _tick(self):
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        due = []
+
+        for timer in list(slot):
+            if timer.cancelled or not timer.rounds:
+                slot.remove(timer)
+                self._count -= 1
+
+                if not timer.cancelled:
+                    due.append(timer)
+            else:
+                timer.rounds -= 1
+
+        self._tick_handle = self.loop.call_later(self.resolution, self._tick) if self._count else None
+
+        for timer in due:
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                traceback.print_exc()
+
+    def clear(self):
+        for slot in self._slots:
+            slot.clear()
+
+        self._count = 0
+
+        if self._tick_handle:
+            self._tick_handle.cancel()
+            self._tick_handle = None
+
+
+class _Watch:
+    def __init__(self, server):
+        self.server = server
+        self.channel = None
+        self.voice_client = None
+        self.connected_at = 0
+        self.attempts = 0
+        self.timer = None
+        self.reconnecting = False
+        self.resume_after = False
+
+
+class VoiceSupervisor:
+    """
+        Keeps an eye on all of the bot's voice connections.  When one's websocket closes without us closing it, it's
+        reconnected, backing off exponentially (with some jitter, so servers on the same voice host don't all retry
+        at once) for as long as that keeps failing.  The retries for every server share one TimerWheel.
+    """
+
+    def __init__(self, bot, *, base_delay=RECONNECT_BASE, max_delay=RECONNECT_MAX):
+        self.bot = bot
+        self.loop = bot.loop
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.wheel = TimerWheel(bot.loop)
+
+        self.reconnects = 0
+        self.failures = 0
+        self._watches = {}  # server id -> _Watch
+
+    def watch(self, voice_client):
+        """
+            Starts watching a newly connected voice client, in place of any older one for the same server.
+        """
+        server = voice_client.channel.server
+        watch = self._watches.get(server.id) or _Watch(server)
+
+        watch.voice_client = voice_client
+        watch.channel = voice_client.channel
+        watch.connected_at = self.loop.time()
+        self._watches[server.id] = watch
+
+        closed = getattr(voice_client.ws, 'connection_closed', None)
+
+        if closed is not None:
+            closed.add_done_callback(lambda _: self._on_closed(voice_client))
+        else:
+            self.wheel.schedule(CHECK_INTERVAL, self._check, voice_client)
+
+    def forget(self, server):
+        watch = self._watches.pop(server.id, None)
+
+        if watch and watch.timer:
+            watch.timer.cancel()
+
+    def stop(self):
+        self._watches.clear()
+        self.wheel.clear()
+
+    def backoff(self, attempts):
+        """
+            Returns how long to wait before reconnect attempt number `attempts` (from 0), somewhere between half and
+            all of the doubled delay.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** attempts)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _current(self, voice_client):
+        watch = self._watches.get(voice_client.channel.server.id)
+
+        # An old connection that's been replaced, or one that was disconnected on purpose
+        if not watch or watch.voice_client is not voice_client or not voice_client._connected.is_set():
+            return None
+
+        return watch
+
+    def _check(self, voice_client):
+        watch = self._current(voice_client)
+        if not watch:
+            return
+
+        if voice_client.ws.open:
+            self.wheel.schedule(CHECK_INTERVAL, self._check, voice_client)
+        else:
+            self._on_closed(voice_client)
+
+    def _on_closed(self, voice_client):
+        watch = self._current(voice_client)
+        if not watch:
+            return
+
+        if self.loop.time() - watch.connected_at > STABLE_AFTER:
+            watch.attempts = 0
+
+        print("[Voice] Lost the voice connection in %s, reconnecting" % watch.server.name)
+        self._schedule(watch)
+
+    def _schedule(self, watch):
+        if watch.timer or watch.reconnecting:
+            return
+
+        delay = self.backoff(watch.attempts)
+        watch.attempts += 1
+        watch.timer = self.wheel.schedule(delay, self._start_reconnect, watch)
+
+        if self.bot.config.debug_mode:
+            print("[Debug] Reconnecting to voice in %s in %.1fs (attempt %s)" % (
+                watch.server.name, delay, watch.attempts))
+
+    def _start_reconnect(self, watch):
+        watch.timer = None
+
+        if self._watches.get(watch.server.id) is watch:
+            self.loop.create_task(self._reconnect(watch))
+
+    async def _reconnect(self, watch):
+        server = watch.server
+        player = self.bot.players.get(server.id)
+
+        # Held until it's back, so the player doesn't skip through the queue meanwhile
+        if player and player.is_playing:
+            player.pause()
+            watch.resume_after = True
+
+        watch.reconnecting = True
+
+        try:
+            await self.bot.reconnect_voice_client(server, channel=watch.channel)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            self.failures += 1
+            print("[Voice] Couldn't reconnect in %s: %s" % (server.name, e))
+
+            watch.reconnecting = False
+            self._schedule(watch)
+            return
+
+        watch.reconnecting = False
+
+        if server.id not in self.bot.the_voice_clients:
+            # Nothing was playing there, so it just stays disconnected
+            self.forget(server)
+            return
+
+        self.reconnects += 1
+
+        if watch.resume_after and player and player.is_paused:
+            player.resume()
+
+        watch.resume_after = False